@@ -1,23 +1,20 @@
 # import argparse
 from flask import Blueprint, request
-from pymongo import MongoClient
 
+from api import cache, mongo, pagination
 from base import log
-from race.storage import RaceStorage
-from score.storage import AthleteStorage
 
 
 MAX_ITEMS_LIMIT = 100
 RACES_BATCH_SIZE = 101
 
-TRISCORE_DB = 'triscore'
-SCORES_COLLECTION = 'athletes'
-
 
 logger = log.setup_logger(__file__)
 
 api_v1 = Blueprint('api_v1', __name__, template_folder='templates_v1')
 
+response_cache = cache.ResponseCache(get_generation=lambda: mongo.get_data_generation().get())
+
 # parser = argparse.ArgumentParser()
 
 # parser.add_argument('-d', '--database', default='triscore')
@@ -30,8 +27,23 @@ api_v1 = Blueprint('api_v1', __name__, template_folder='templates_v1')
 # global mongo_client
 # mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
 
-def get_mongo_client():
-    return MongoClient(authSource='triscore', username='triscore-reader', password='4c)H0TLDF>kH', connect=False)
+def get_race_storage():
+    return mongo.get_race_storage(generation=response_cache.get_current_generation())
+
+
+def get_page(sort_field, sort_order, after_token):
+    """
+    Returns (index_from, limit, skip, after): keyset pagination when 'after' token is passed, 'from'/'to' otherwise.
+    """
+    if after_token:
+        after_value, after_key, last_index = pagination.decode_token(after_token, sort_field, sort_order)
+        limit = min(MAX_ITEMS_LIMIT, int(request.args.get('limit', default=MAX_ITEMS_LIMIT)))
+        return last_index + 1, limit, 0, (after_value, after_key)
+
+    index_from = int(request.args.get('from'))
+    index_to = int(request.args.get('to'))
+    limit = min(MAX_ITEMS_LIMIT, index_to - index_from + 1)
+    return index_from, limit, index_from, None
 
 
 @api_v1.route('/status')
@@ -39,16 +51,26 @@ def status():
     return 'OK', 200
 
 
+@api_v1.route('/pool-stats')
+def pool_stats():
+    return mongo.pool_stats.get_stats(), 200
+
+
+@api_v1.route('/cache-stats')
+def cache_stats():
+    return response_cache.get_stats(), 200
+
+
 @api_v1.route('/races')
+@response_cache.cached
 def races():
-    race_storage = RaceStorage(mongo_client=get_mongo_client(), db_name=TRISCORE_DB)
+    race_storage = get_race_storage()
 
     logger.info(request.args)
 
     sort = request.args.get('sort')
     order = request.args.get('order')
-    index_from = int(request.args.get('from'))
-    index_to = int(request.args.get('to'))
+    after_token = request.args.get('after')
     filter_name = request.args.get('name', default='')
     filter_country = request.args.get('country', default='')
     filter_race_type = request.args.get('type', default='')
@@ -65,11 +87,14 @@ def races():
 
     sort_order = 1 if order == 'asc' else -1
 
-    limit = min(MAX_ITEMS_LIMIT, index_to - index_from + 1)
+    try:
+        index_from, limit, skip, after = get_page(sort_field, sort_order, after_token)
+    except ValueError as error:
+        return {'error': str(error)}, 400
 
     logger.info(
         f'sort_field: {sort_field} sort_order: {sort_order} from: {index_from} '
-        f'to: {index_to} name: {filter_name} country: {filter_country} race_type: {filter_race_type}')
+        f'limit: {limit} name: {filter_name} country: {filter_country} race_type: {filter_race_type}')
 
     races = race_storage.get_races(
         country=filter_country,
@@ -77,21 +102,30 @@ def races():
         race_type=filter_race_type,
         sort_field=sort_field,
         sort_order=sort_order,
-        skip=index_from,
+        skip=skip,
         limit=limit,
-        batch_size=RACES_BATCH_SIZE)
+        batch_size=RACES_BATCH_SIZE,
+        after=after)
 
-    total_count = races.count(with_limit_and_skip=False)
+    races_list = list(races)
+    total_count, exact = race_storage.count_filtered_races(
+        name=filter_name,
+        country=filter_country,
+        race_type=filter_race_type,
+        count_cache=mongo.get_count_cache())
     data = {
-        'data': list(races),
-        'total': total_count
+        'data': races_list,
+        'total': total_count,
+        'exact': exact,
+        'next': pagination.get_next_token(races_list, sort_field, sort_order, ['name', 'date'], index_from, limit)
     }
     return data, 200
 
 
 @api_v1.route('/race-info')
+@response_cache.cached
 def race_info():
-    race_storage = RaceStorage(mongo_client=get_mongo_client(), db_name=TRISCORE_DB)
+    race_storage = get_race_storage()
 
     logger.info(request.args)
 
@@ -113,10 +147,11 @@ def race_info():
 
 
 @api_v1.route('/race-results')
+@response_cache.cached
 def race_results():
-    score_storage = AthleteStorage(
-        mongo_client=get_mongo_client(), collection_name=SCORES_COLLECTION, db_name=TRISCORE_DB)
-    race_storage = RaceStorage(mongo_client=get_mongo_client(), db_name=TRISCORE_DB)
+    score_storage = mongo.get_athlete_storage()
+    race_score_storage = mongo.get_race_score_storage()
+    race_storage = get_race_storage()
 
     logger.info(request.args)
 
@@ -151,13 +186,29 @@ def race_results():
         limit=limit
     )
 
-    total_count = race_results.count(with_limit_and_skip=False)
+    total_count, exact = race_storage.count_race_results(
+        race_name=race_name,
+        race_date=race_date,
+        athlete_filter=athlete_filter,
+        country_filter=country_filter,
+        age_group_filter=age_group_filter)
     race_results_list = list(race_results)
 
     if len(race_results_list) > 0:
         athlete_ids = list(map(lambda x: x['id'], race_results_list))
-        scores_and_country_by_id = score_storage.get_scores_and_country(
+        score_by_id = race_score_storage.get_score_by_id(
             athlete_ids=athlete_ids, race_name=race_name, race_date=race_date)
+        if len(score_by_id) == len(set(athlete_ids)):
+            # 'c' is the current athlete country, not the country at race time
+            country_by_id = score_storage.get_country_by_id(athlete_ids)
+            scores_and_country_by_id = {
+                athlete_id: dict(score, c=country_by_id[athlete_id]) if athlete_id in country_by_id else score
+                for athlete_id, score in score_by_id.items()
+            }
+        else:
+            # race scores snapshot is not built yet: fall back to athlete histories
+            scores_and_country_by_id = score_storage.get_scores_and_country(
+                athlete_ids=athlete_ids, race_name=race_name, race_date=race_date)
         for i, race_result in enumerate(race_results_list):
             athlete_id = race_result['id']
             race_result.update(scores_and_country_by_id[athlete_id])
@@ -165,23 +216,23 @@ def race_results():
 
     data = {
         'data': race_results_list,
-        'total': total_count
+        'total': total_count,
+        'exact': exact
     }
 
     return data, 200
 
 
 @api_v1.route('/athletes')
+@response_cache.cached
 def athletes():
-    score_storage = AthleteStorage(
-        mongo_client=get_mongo_client(), collection_name=SCORES_COLLECTION, db_name=TRISCORE_DB)
+    score_storage = mongo.get_athlete_storage()
 
     logger.info(request.args)
 
     sort = request.args.get('sort')
     order = request.args.get('order')
-    index_from = int(request.args.get('from'))
-    index_to = int(request.args.get('to'))
+    after_token = request.args.get('after')
     filter_name = request.args.get('name', default='')
     filter_country = request.args.get('country', default='')
     filter_age_group = request.args.get('group', default='')
@@ -193,11 +244,15 @@ def athletes():
         sort_field = 'p'
 
     sort_order = 1 if order == 'asc' else -1
-    limit = min(MAX_ITEMS_LIMIT, index_to - index_from + 1)
+
+    try:
+        index_from, limit, skip, after = get_page(sort_field, sort_order, after_token)
+    except ValueError as error:
+        return {'error': str(error)}, 400
 
     logger.info(
         f'sort_field: {sort_field} sort_order: {sort_order} from: {index_from} '
-        f'to: {index_to} name: {filter_name} country: {filter_country} age_group: {filter_age_group}')
+        f'limit: {limit} name: {filter_name} country: {filter_country} age_group: {filter_age_group}')
 
     cursor = score_storage.get_top_athletes(
         country=filter_country,
@@ -205,8 +260,9 @@ def athletes():
         age_group=filter_age_group,
         sort_field=sort_field,
         sort_order=sort_order,
-        skip=index_from,
-        limit=limit)
+        skip=skip,
+        limit=limit,
+        after=after)
 
     def add_rel_index(iterable, start_index):
         items = []
@@ -216,23 +272,39 @@ def athletes():
         return items
 
     athletes = add_rel_index(cursor, start_index=index_from + 1)
-    total_count = cursor.count(with_limit_and_skip=False)
+    total_count, exact = score_storage.count_athletes(
+        name=filter_name,
+        country=filter_country,
+        age_group=filter_age_group,
+        count_cache=mongo.get_count_cache())
     data = {
         'data': athletes,
-        'total': total_count
+        'total': total_count,
+        'exact': exact,
+        'next': pagination.get_next_token(athletes, sort_field, sort_order, ['id'], index_from, limit)
     }
     return data, 200
 
 
 @api_v1.route('/athlete-details')
+@response_cache.cached
 def athlete_details():
-    score_storage = AthleteStorage(
-        mongo_client=get_mongo_client(), collection_name=SCORES_COLLECTION, db_name=TRISCORE_DB)
+    score_storage = mongo.get_athlete_storage()
     athlete_id = request.args.get('id')
     logger.info(f'athlete_id: {athlete_id}')
     athlete = score_storage.get_athlete(athlete_id=athlete_id)
+    if athlete is None:
+        return {'data': None, 'total': 0}, 200
+
+    # full history lives in the athlete races collection, the athlete document keeps the last races only
+    history_order = -1 if request.args.get('order') == 'desc' else 1
+    history_skip = int(request.args.get('skip', default=0))
+    history_limit = int(request.args.get('limit', default=0))
+    athlete['h'] = list(score_storage.get_athlete_history(
+        athlete_id, sort_order=history_order, skip=history_skip, limit=history_limit))
     data = {
         'data': athlete,
-        'total': 1
+        'total': 1,
+        'history_total': score_storage.count_athlete_history(athlete_id)
     }
     return data, 200
@@ -0,0 +1,245 @@
+import functools
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from flask import Response, json, request
+
+from base import log
+
+
+logger = log.setup_logger(__file__)
+
+MAX_ITEMS = int(os.environ.get('TRISCORE_CACHE_MAX_ITEMS', 10000))
+MAX_BYTES = int(os.environ.get('TRISCORE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+DISK_DIR = os.environ.get('TRISCORE_CACHE_DIR', '')
+DISK_MAX_BYTES = int(os.environ.get('TRISCORE_CACHE_DISK_MAX_BYTES', 1024 * 1024 * 1024))
+# the disk cache is pruned down to this share of its max size
+DISK_PRUNE_RATIO = 0.8
+GENERATION_TTL_SEC = float(os.environ.get('TRISCORE_CACHE_GENERATION_TTL_SEC', 5))
+
+CACHE_FILE_EXTENSION = '.json.gz'
+
+
+class LruCache:
+    """
+    In-process LRU limited by the number of items and the total size of the cached bodies.
+    """
+
+    def __init__(self, max_items=MAX_ITEMS, max_bytes=MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        body, _ = value
+        if len(body) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key)[0])
+            self.items[key] = value
+            self.size += len(body)
+
+            while len(self.items) > self.max_items or self.size > self.max_bytes:
+                _, (evicted_body, _) = self.items.popitem(last=False)
+                self.size -= len(evicted_body)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class DiskCache:
+    """
+    Optional second tier: gzipped bodies in files named by the key hash, one directory per data generation.
+    Directories of older generations are removed, reads touch the files so the least recently used ones are
+    removed first once the cache exceeds max_bytes. The directory is shared by the api processes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DISK_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.generation = None
+        self.written_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key, generation):
+        path = self._get_path(key, generation)
+        try:
+            with gzip.open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return body
+
+    def put(self, key, body, generation):
+        self._set_generation(generation)
+        path = self._get_path(key, generation)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.written_bytes += os.path.getsize(path)
+            # the directory is scanned again once a tenth of the max size is written
+            if self.written_bytes < self.max_bytes / 10:
+                return
+            self.written_bytes = 0
+        self.prune()
+
+    def prune(self):
+        files = []
+        for generation_dir in self._get_generation_dirs():
+            try:
+                for entry in os.scandir(generation_dir):
+                    if entry.name.endswith(CACHE_FILE_EXTENSION):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                # removed by another process
+                continue
+
+        size = sum(file_size for _, file_size, _ in files)
+        if size <= self.max_bytes:
+            return
+        for _, file_size, path in sorted(files):
+            if size <= self.max_bytes * DISK_PRUNE_RATIO:
+                break
+            self._remove(path)
+            size -= file_size
+        logger.info(f'disk cache pruned to {size} bytes')
+
+    def _set_generation(self, generation):
+        if generation == self.generation:
+            return
+        self.generation = generation
+        # processes see a new generation up to GENERATION_TTL_SEC apart: only older generations are removed
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.name.isdigit() and int(entry.name) < generation:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.is_file() and entry.name.endswith(CACHE_FILE_EXTENSION):
+                # files written before the cache was split by generation
+                self._remove(entry.path)
+
+    def _get_generation_dirs(self):
+        return [entry.path for entry in os.scandir(self.cache_dir) if entry.is_dir() and entry.name.isdigit()]
+
+    def _get_path(self, key, generation):
+        return os.path.join(
+            self.cache_dir, str(generation), hashlib.sha1(key.encode('utf-8')).hexdigest() + CACHE_FILE_EXTENSION)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ResponseCache:
+    def __init__(self, get_generation, max_items=MAX_ITEMS, max_bytes=MAX_BYTES, disk_dir=DISK_DIR, disk_max_bytes=DISK_MAX_BYTES):
+        self.get_generation = get_generation
+        self.memory = LruCache(max_items=max_items, max_bytes=max_bytes)
+        self.disk = DiskCache(disk_dir, max_bytes=disk_max_bytes) if disk_dir else None
+        self.generation = None
+        self.generation_time = 0.
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def get_current_generation(self):
+        now = time.monotonic()
+        if self.generation is None or now - self.generation_time > GENERATION_TTL_SEC:
+            self.generation = self.get_generation()
+            self.generation_time = now
+        return self.generation
+
+    def get_key(self, path, args, generation):
+        normalized_args = '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+        return f'{generation}:{path}?{normalized_args}'
+
+    def get(self, key, generation):
+        value = self.memory.get(key)
+        if value is not None:
+            self._inc('hits')
+            return value
+
+        if self.disk:
+            body = self.disk.get(key, generation)
+            if body is not None:
+                self._inc('disk_hits')
+                value = (body, get_etag(body))
+                self.memory.put(key, value)
+                return value
+
+        self._inc('misses')
+        return None
+
+    def put(self, key, body, generation):
+        value = (body, get_etag(body))
+        self.memory.put(key, value)
+        if self.disk:
+            self.disk.put(key, body, generation)
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats.update({
+            'pid': os.getpid(),
+            'generation': self.generation,
+            'items': len(self.memory),
+            'bytes': self.memory.size,
+            'disk': bool(self.disk),
+        })
+        return stats
+
+    def _inc(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def cached(self, view):
+        """
+        Caches successful JSON responses of the view and answers If-None-Match requests with 304.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            generation = self.get_current_generation()
+            key = self.get_key(request.path, request.args, generation)
+            value = self.get(key, generation)
+            if value is None:
+                data, status = view(*args, **kwargs)
+                if status != 200:
+                    return data, status
+                value = self.put(key, json.dumps(data).encode('utf-8'), generation)
+
+            body, etag = value
+            if request.if_none_match.contains(etag):
+                self._inc('not_modified')
+                response = Response(status=304)
+            else:
+                response = Response(body, status=200, mimetype='application/json')
+            response.set_etag(etag)
+            return response
+
+        return wrapper
+
+
+def get_etag(body):
+    return hashlib.sha1(body).hexdigest()
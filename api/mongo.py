@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from pymongo import MongoClient, monitoring
+
+from base import log
+from base.count_cache import CountCache
+from base.generation import DataGeneration
+from race.storage import RaceStorage
+from score.storage import AthleteStorage, RaceScoreStorage
+
+
+logger = log.setup_logger(__file__)
+
+TRISCORE_DB = 'triscore'
+SCORES_COLLECTION = 'athletes'
+RACE_SCORES_COLLECTION = 'race_scores'
+COUNTS_COLLECTION = 'counts'
+
+MONGO_USERNAME = os.environ.get('TRISCORE_MONGO_USERNAME', 'triscore-reader')
+MONGO_PASSWORD = os.environ.get('TRISCORE_MONGO_PASSWORD', '4c)H0TLDF>kH')
+MAX_POOL_SIZE = int(os.environ.get('TRISCORE_MONGO_MAX_POOL_SIZE', 10))
+MIN_POOL_SIZE = int(os.environ.get('TRISCORE_MONGO_MIN_POOL_SIZE', 0))
+CONNECT_TIMEOUT_MS = int(os.environ.get('TRISCORE_MONGO_CONNECT_TIMEOUT_MS', 5000))
+SOCKET_TIMEOUT_MS = int(os.environ.get('TRISCORE_MONGO_SOCKET_TIMEOUT_MS', 30000))
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('TRISCORE_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('TRISCORE_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool checkout wait time and connection counters.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checked_out = 0
+            self.connections = 0
+            self.total_wait_sec = 0.
+            self.max_wait_sec = 0.
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'checked_out': self.checked_out,
+                'connections': self.connections,
+                'total_wait_ms': round(1000. * self.total_wait_sec, 3),
+                'mean_wait_ms': round(1000. * self.total_wait_sec / self.checkouts, 3) if self.checkouts else 0.,
+                'max_wait_ms': round(1000. * self.max_wait_sec, 3),
+                'max_pool_size': MAX_POOL_SIZE,
+            }
+
+    def connection_check_out_started(self, event):
+        self.local.checkout_start = time.monotonic()
+
+    def connection_checked_out(self, event):
+        wait_sec = time.monotonic() - getattr(self.local, 'checkout_start', time.monotonic())
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.total_wait_sec += wait_sec
+            self.max_wait_sec = max(self.max_wait_sec, wait_sec)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            self.connections += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+pool_stats = PoolStatsListener()
+
+_lock = threading.Lock()
+_state = {'pid': None, 'client': None, 'storages': {}}
+
+
+def get_mongo_client():
+    """
+    Returns the process wide client. It is created lazily and recreated after fork, so every uWSGI worker
+    owns its own connection pool.
+    """
+    pid = os.getpid()
+    if _state['pid'] == pid:
+        return _state['client']
+
+    with _lock:
+        if _state['pid'] != pid:
+            logger.info(f'creating mongo client pid: {pid} max_pool_size: {MAX_POOL_SIZE}')
+            pool_stats.reset()
+            _state['client'] = MongoClient(
+                authSource=TRISCORE_DB,
+                username=MONGO_USERNAME,
+                password=MONGO_PASSWORD,
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                connectTimeoutMS=CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=SOCKET_TIMEOUT_MS,
+                serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+                waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+                event_listeners=[pool_stats],
+                connect=False)
+            _state['storages'] = {}
+            _state['pid'] = pid
+        return _state['client']
+
+
+def _get_storage(name, create):
+    mongo_client = get_mongo_client()
+    storages = _state['storages']
+    if name not in storages:
+        with _lock:
+            if name not in storages:
+                storages[name] = create(mongo_client)
+    return storages[name]
+
+
+def get_athlete_storage():
+    return _get_storage('athletes', lambda mongo_client: AthleteStorage(
+        mongo_client=mongo_client, collection_name=SCORES_COLLECTION, db_name=TRISCORE_DB))
+
+
+def get_race_score_storage():
+    return _get_storage('race_scores', lambda mongo_client: RaceScoreStorage(
+        mongo_client=mongo_client, collection_name=RACE_SCORES_COLLECTION, db_name=TRISCORE_DB))
+
+
+def get_race_storage(generation=0):
+    """
+    The race storage is recreated when the data generation changes, so the results layout switched by
+    race/migrate_results.py is read again.
+    """
+    mongo_client = get_mongo_client()
+    storages = _state['storages']
+    cached = storages.get('races')
+    if cached is None or cached[0] != generation:
+        with _lock:
+            cached = storages.get('races')
+            if cached is None or cached[0] != generation:
+                cached = (generation, RaceStorage(mongo_client=mongo_client, db_name=TRISCORE_DB))
+                storages['races'] = cached
+    return cached[1]
+
+
+def get_count_cache():
+    return _get_storage('counts', lambda mongo_client: CountCache(
+        mongo_client=mongo_client, db_name=TRISCORE_DB, collection_name=COUNTS_COLLECTION, read_only=True))
+
+
+def get_data_generation():
+    return _get_storage('generation', lambda mongo_client: DataGeneration(mongo_client=mongo_client, db_name=TRISCORE_DB))
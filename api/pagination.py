@@ -0,0 +1,49 @@
+import base64
+import json
+
+
+def get_field(item, field):
+    """
+    Returns the value of a dotted field, None if it is missing.
+    """
+    value = item
+    for key in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def encode_token(sort_field, sort_order, value, key, index):
+    data = {'f': sort_field, 'o': sort_order, 'v': value, 'k': key, 'i': index}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_token(token, sort_field, sort_order):
+    """
+    Returns (value, key, index) of the last seen item, key is the list of its tie-breaker values.
+    Raises ValueError for malformed tokens or tokens issued for a different sort.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        token_sort_field, token_sort_order = data['f'], data['o']
+        value, key, index = data['v'], data['k'], int(data['i'])
+        assert isinstance(key, list)
+    except Exception as exception:
+        raise ValueError(f'invalid token: {token}') from exception
+
+    if token_sort_field != sort_field or token_sort_order != sort_order:
+        raise ValueError(f'token sort mismatch: {token_sort_field} {token_sort_order}')
+    return value, key, index
+
+
+def get_next_token(items, sort_field, sort_order, key_fields, start_index, limit):
+    """
+    Returns None for the last page: a page shorter than limit.
+    """
+    if len(items) == 0 or len(items) < limit:
+        return None
+    last_item = items[-1]
+    key = [last_item[key_field] for key_field in key_fields]
+    return encode_token(sort_field, sort_order, get_field(last_item, sort_field), key, start_index + len(items) - 1)
+
@@ -0,0 +1,88 @@
+from flask import Blueprint, Flask
+import os
+import pytest
+
+from api.cache import DiskCache, LruCache, ResponseCache
+
+
+class TestLruCache:
+    def test_evict_by_items(self):
+        lru = LruCache(max_items=2, max_bytes=100)
+        lru.put('a', (b'1', 'e1'))
+        lru.put('b', (b'2', 'e2'))
+        lru.get('a')
+        lru.put('c', (b'3', 'e3'))
+        assert lru.get('b') is None
+        assert lru.get('a') is not None
+
+    def test_evict_by_bytes(self):
+        lru = LruCache(max_items=10, max_bytes=5)
+        lru.put('a', (b'123', 'e1'))
+        lru.put('b', (b'456', 'e2'))
+        assert lru.get('a') is None
+        assert lru.size == 3
+
+
+BODY = b'0123456789' * 4
+
+
+class TestDiskCache:
+    def test_drop_older_generations(self, tmp_path):
+        disk = DiskCache(str(tmp_path))
+        disk.put('1:/a', b'old', generation=1)
+        disk.put('2:/a', b'new', generation=2)
+        assert disk.get('1:/a', generation=1) is None
+        assert disk.get('2:/a', generation=2) == b'new'
+        assert os.listdir(tmp_path) == ['2']
+
+    def test_prune_least_recently_used(self, tmp_path):
+        disk = DiskCache(str(tmp_path))
+        disk.put('a', BODY, generation=1)
+        disk.put('b', BODY, generation=1)
+        os.utime(disk._get_path('a', 1), (0, 0))
+        os.utime(disk._get_path('b', 1), (1, 1))
+        disk.get('a', generation=1)
+        # room for two and a half files: one file is pruned
+        disk.max_bytes = 2.5 * os.path.getsize(disk._get_path('a', 1))
+        disk.put('c', BODY, generation=1)
+        assert disk.get('b', generation=1) is None
+        assert disk.get('a', generation=1) is not None
+        assert disk.get('c', generation=1) is not None
+
+
+class TestResponseCache:
+    def setup_method(self):
+        self.generation = 1
+        self.calls = 0
+        self.response_cache = ResponseCache(get_generation=lambda: self.generation, disk_dir='')
+
+        blueprint = Blueprint('test', __name__)
+
+        @blueprint.route('/items')
+        @self.response_cache.cached
+        def items():
+            self.calls += 1
+            return {'data': [self.calls]}, 200
+
+        app = Flask(__name__)
+        app.register_blueprint(blueprint)
+        self.client = app.test_client()
+
+    def test_hit(self):
+        r1 = self.client.get('/items?b=2&a=1')
+        r2 = self.client.get('/items?a=1&b=2')
+        assert r1.data == r2.data
+        assert self.calls == 1
+
+    def test_not_modified(self):
+        r1 = self.client.get('/items')
+        r2 = self.client.get('/items', headers={'If-None-Match': r1.headers['ETag']})
+        assert r2.status_code == 304
+        assert self.response_cache.get_stats()['not_modified'] == 1
+
+    def test_new_generation(self):
+        self.client.get('/items')
+        self.generation = 2
+        self.response_cache.generation = None
+        self.client.get('/items')
+        assert self.calls == 2
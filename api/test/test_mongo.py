@@ -0,0 +1,50 @@
+import api.mongo as mongo
+
+
+class FakeMongoClient(dict):
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.kwargs = kwargs
+
+    def __missing__(self, db_name):
+        return {'athletes': 'athletes', 'athlete_races': 'athlete_races'}
+
+
+class FakeRaceStorage:
+    def __init__(self, mongo_client, db_name):
+        self.mongo_client = mongo_client
+
+
+class TestMongo:
+    def setup_method(self):
+        self.pid = 1
+
+    def patch(self, monkeypatch):
+        monkeypatch.setattr(mongo, 'MongoClient', FakeMongoClient)
+        monkeypatch.setattr(mongo, 'RaceStorage', FakeRaceStorage)
+        monkeypatch.setattr(mongo.os, 'getpid', lambda: self.pid)
+        monkeypatch.setattr(mongo, '_state', {'pid': None, 'client': None, 'storages': {}})
+
+    def test_client_per_process(self, monkeypatch):
+        self.patch(monkeypatch)
+        mongo_client = mongo.get_mongo_client()
+        athlete_storage = mongo.get_athlete_storage()
+        assert mongo.get_mongo_client() is mongo_client
+        assert mongo.get_athlete_storage() is athlete_storage
+        assert mongo_client.kwargs['connect'] is False
+
+        # a forked worker gets its own client and storages
+        self.pid = 2
+        assert mongo.get_mongo_client() is not mongo_client
+        assert mongo.get_athlete_storage() is not athlete_storage
+
+    def test_race_storage_per_generation(self, monkeypatch):
+        self.patch(monkeypatch)
+        race_storage = mongo.get_race_storage(generation=1)
+        assert mongo.get_race_storage(generation=1) is race_storage
+        assert mongo.get_race_storage(generation=2) is not race_storage
+
+        self.pid = 2
+        forked_race_storage = mongo.get_race_storage(generation=2)
+        assert forked_race_storage is not race_storage
+        assert forked_race_storage.mongo_client is mongo.get_mongo_client()
@@ -0,0 +1,44 @@
+import pytest
+from api import pagination
+
+
+class TestToken:
+    def test_roundtrip(self):
+        token = pagination.encode_token('s', -1, 1873, ['12345'], 99)
+        assert pagination.decode_token(token, 's', -1) == (1873, ['12345'], 99)
+
+    def test_sort_mismatch(self):
+        token = pagination.encode_token('s', -1, 1873, ['12345'], 99)
+        with pytest.raises(ValueError):
+            pagination.decode_token(token, 'p', -1)
+
+    def test_invalid_token(self):
+        with pytest.raises(ValueError):
+            pagination.decode_token('not-a-token', 's', -1)
+
+    def test_scalar_key(self):
+        token = pagination.encode_token('s', -1, 1873, '12345', 99)
+        with pytest.raises(ValueError):
+            pagination.decode_token(token, 's', -1)
+
+
+class TestNextToken:
+    def test_empty_page(self):
+        assert pagination.get_next_token([], 'date', 1, ['name', 'date'], 0, 10) is None
+
+    def test_last_page(self):
+        races = [{'name': 'A', 'date': '2020-01-01'}]
+        assert pagination.get_next_token(races, 'date', 1, ['name', 'date'], 0, 10) is None
+
+    def test_nested_sort_field(self):
+        races = [
+            {'name': 'A', 'date': '2019-05-01', 'stats': {'t': 100}},
+            {'name': 'B', 'date': '2020-05-01', 'stats': {'t': 200}},
+        ]
+        token = pagination.get_next_token(races, 'stats.t', 1, ['name', 'date'], 10, 2)
+        assert pagination.decode_token(token, 'stats.t', 1) == (200, ['B', '2020-05-01'], 11)
+
+    def test_missing_sort_field(self):
+        races = [{'name': 'A', 'date': '2020-01-01', 'location': {}}]
+        token = pagination.get_next_token(races, 'location.c', -1, ['name', 'date'], 0, 1)
+        assert pagination.decode_token(token, 'location.c', -1) == (None, ['A', '2020-01-01'], 0)
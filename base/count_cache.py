@@ -0,0 +1,62 @@
+import json
+from base import dt, log
+
+logger = log.setup_logger(__file__)
+
+
+TEXT_COUNT_LIMIT = 1000
+
+
+class CountCache:
+    """
+    Table of exact document counts keyed by (collection, normalized filter). Counts are computed on the first
+    request and recomputed by refresh() when scoring or ingestion finishes. A read only cache (the api user has
+    no write access) counts misses without storing them.
+    """
+
+    def __init__(self, mongo_client, db_name='triscore', collection_name='counts', read_only=False):
+        self.counts_collection = mongo_client[db_name][collection_name]
+        self.read_only = read_only
+
+    @staticmethod
+    def get_key(name, where):
+        return name + ':' + CountCache.normalize(where)
+
+    @staticmethod
+    def normalize(where):
+        return json.dumps(where, sort_keys=True, separators=(',', ':'), default=str)
+
+    def get_count(self, collection, name, where):
+        key = self.get_key(name, where)
+        cached = self.counts_collection.find_one({'_id': key}, projection={'count': 1})
+        if cached:
+            return cached['count']
+
+        count = collection.count_documents(where)
+        if not self.read_only:
+            self._set_count(key, name, where, count)
+        return count
+
+    def refresh(self, collection, name, wheres=[]):
+        normalized_wheres = {self.normalize(where): where for where in wheres}
+        for cached in self.counts_collection.find({'name': name}, projection={'where': 1}):
+            normalized_wheres[cached['where']] = json.loads(cached['where'])
+
+        logger.info(f'refresh {len(normalized_wheres)} counts for {name}')
+        for where in normalized_wheres.values():
+            count = collection.count_documents(where)
+            self._set_count(self.get_key(name, where), name, where, count)
+
+    def _set_count(self, key, name, where, count):
+        self.counts_collection.replace_one(
+            {'_id': key},
+            {'name': name, 'where': self.normalize(where), 'count': count, 'updated': dt.datetime_to_string(dt.now())},
+            upsert=True)
+
+
+def get_capped_count(collection, query, limit=TEXT_COUNT_LIMIT):
+    """
+    Returns (count, exact): counting stops at the limit, so the count is a lower bound when it is not exact.
+    """
+    count = collection.count_documents(query, limit=limit)
+    return count, count < limit
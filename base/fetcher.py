@@ -0,0 +1,154 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from base import log
+
+logger = log.setup_logger(__file__)
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+MAX_WORKERS = 8
+RATE_PER_SEC = 4.
+MAX_RETRIES = 5
+BACKOFF_SEC = 0.5
+MAX_BACKOFF_SEC = 60.
+REQUEST_TIMEOUT_SEC = 60.
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and bursts of up to capacity requests.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_sec = (1 - self.tokens) / self.rate
+            self.sleep(wait_sec)
+
+
+class Fetcher:
+    """
+    Thread safe http client shared by loaders: keep-alive sessions, a token bucket per host,
+    retries with exponential backoff on throttling and server errors and at most max_workers requests in flight.
+    """
+
+    def __init__(self,
+                 max_workers=MAX_WORKERS,
+                 rate_per_sec=RATE_PER_SEC,
+                 burst=1,
+                 max_retries=MAX_RETRIES,
+                 backoff_sec=BACKOFF_SEC,
+                 max_backoff_sec=MAX_BACKOFF_SEC,
+                 timeout=REQUEST_TIMEOUT_SEC,
+                 session_factory=requests.Session,
+                 sleep=time.sleep):
+        self.max_workers = max_workers
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.timeout = timeout
+        self.session_factory = session_factory
+        self.sleep = sleep
+
+        self.in_flight = threading.BoundedSemaphore(max_workers)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def get_bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate_per_sec, self.burst)
+            return self.buckets[host]
+
+    def get_session(self):
+        # sessions are not thread safe: one keep-alive session per thread
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.session_factory()
+            session.mount('https://', HTTPAdapter(pool_maxsize=self.max_workers))
+            session.mount('http://', HTTPAdapter(pool_maxsize=self.max_workers))
+            self.local.session = session
+        return session
+
+    def get_backoff_sec(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(self.max_backoff_sec, float(retry_after))
+        backoff_sec = min(self.max_backoff_sec, self.backoff_sec * 2 ** attempt)
+        return backoff_sec * random.uniform(0.5, 1.)
+
+    def get_response(self, url, headers=None):
+        """
+        Returns the last response, None if every attempt failed to connect.
+        """
+        bucket = self.get_bucket(url)
+        response = None
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                with self.in_flight:
+                    response = self.get_session().get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning(f'GET error url: {url} attempt: {attempt + 1} error: {e}')
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                logger.warning(f'GET retry url: {url} attempt: {attempt + 1} code: {response.status_code}')
+
+            if attempt < self.max_retries:
+                self.sleep(self.get_backoff_sec(attempt, response))
+        return response
+
+    def get(self, url, headers=None):
+        response = self.get_response(url, headers)
+        if response is None or response.status_code != 200:
+            logger.error(f'GET failed url: {url} code: {response.status_code if response is not None else None}')
+            return None
+        return response.text
+
+    def get_json(self, url, headers=None):
+        text = self.get(url, headers)
+        return json.loads(text) if text else {}
+
+    def map_json(self, urls, headers=None):
+        """
+        Yields json of urls in order while up to max_workers of the following urls are being downloaded.
+        """
+        pending = []
+        for url in urls:
+            pending.append(self.executor.submit(self.get_json, url, headers))
+            if len(pending) > self.max_workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
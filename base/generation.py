@@ -0,0 +1,28 @@
+from pymongo import ReturnDocument
+from base import dt, log
+
+logger = log.setup_logger(__file__)
+
+
+class DataGeneration:
+    """
+    Counter bumped by the scorer and the transformer when they finish, readers use it to invalidate caches.
+    """
+
+    GENERATION_ID = 'generation'
+
+    def __init__(self, mongo_client, db_name='triscore', collection_name='generation'):
+        self.generation_collection = mongo_client[db_name][collection_name]
+
+    def get(self):
+        generation = self.generation_collection.find_one({'_id': self.GENERATION_ID})
+        return generation['value'] if generation else 0
+
+    def bump(self, source=''):
+        generation = self.generation_collection.find_one_and_update(
+            {'_id': self.GENERATION_ID},
+            {'$inc': {'value': 1}, '$set': {'source': source, 'updated': dt.datetime_to_string(dt.now())}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        logger.info(f'data generation: {generation["value"]} source: {source}')
+        return generation['value']
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 import requests
@@ -8,46 +9,112 @@ logger = log.setup_logger(__file__)
 
 
 class CachedUrl:
+    """
+    Snapshots of an url response in cache_dir refetched after timeout seconds. The index file keeps the latest
+    snapshot with its validators so a fresh lookup is one small read and a refetch of unchanged data is a 304.
+    """
     CACHE_FILE_EXTENSION = '.cache'
+    COMPRESSED_EXTENSION = '.gz'
+    INDEX_FILE = 'index.json'
+    MAX_AGE_SEC = 86400 * 90
+    MAX_SIZE_BYTES = 100 * 1024 * 1024
 
-    def __init__(self, url, headers, cache_dir, timeout=None):
+    def __init__(self, url, headers, cache_dir, timeout=None, fetcher=None,
+                 max_age_sec=MAX_AGE_SEC, max_size_bytes=MAX_SIZE_BYTES):
         self.url = url
         self.headers = headers
+        self.fetcher = fetcher
         url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
         self.cache_dir = os.path.join(cache_dir, url_hash)
         self.timeout = timeout
+        self.max_age_sec = max_age_sec
+        self.max_size_bytes = max_size_bytes
         self._create_dirs_if_needed(self.cache_dir)
 
     def get(self):
-        cache_file = self._get_cache_file()
-        if self._file_is_empty(cache_file):
-            text = get(self.url, self.headers)
-            self._write_file(text, cache_file)
-            return text
-        return self._read_file(cache_file)
-
-    def _file_is_empty(self, file):
-        return not os.path.exists(file) or os.stat(file).st_size == 0
-
-    def _get_cache_file(self):
-        cache_dt = self._get_cache_dt(dt.now())
-        cache_filename = dt.datetime_to_string(cache_dt) + self.CACHE_FILE_EXTENSION
-        return os.path.join(self.cache_dir, cache_filename)
-
-    def _get_cache_dt(self, current_dt):
-        last_update_dt = self._get_max_update_dt(
-            self.cache_dir, endswith=self.CACHE_FILE_EXTENSION)
-        if last_update_dt is None:
-            return current_dt
-
+        current_dt = dt.now()
+        entry = self._read_index()
+        if entry and not self._is_expired(entry, current_dt):
+            return self._read_file(os.path.join(self.cache_dir, entry['file']))
+
+        response = self._get_response(entry)
+        if entry and response is not None and response.status_code == 304:
+            logger.debug(f'not modified url: {self.url}')
+            entry['updated'] = dt.datetime_to_string(current_dt)
+            self._write_index(entry)
+            return self._read_file(os.path.join(self.cache_dir, entry['file']))
+
+        if response is None or response.status_code != 200:
+            logger.error(f'GET failed url: {self.url} code: {response.status_code if response is not None else None}')
+            return self._read_file(os.path.join(self.cache_dir, entry['file'])) if entry else None
+
+        cache_filename = dt.datetime_to_string(current_dt) + self.CACHE_FILE_EXTENSION + self.COMPRESSED_EXTENSION
+        self._write_file(response.text, os.path.join(self.cache_dir, cache_filename))
+        self._write_index({
+            'file': cache_filename,
+            'updated': dt.datetime_to_string(current_dt),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        })
+        self._prune(current_dt, keep_file=cache_filename)
+        return response.text
+
+    def _is_expired(self, entry, current_dt):
         if self.timeout is None:
-            return last_update_dt
-
-        delta_sec = (current_dt - last_update_dt).total_seconds()
-        if delta_sec > self.timeout:
-            return current_dt
-
-        return last_update_dt
+            return False
+        delta_sec = (current_dt - dt.datetime_from_string(entry['updated'])).total_seconds()
+        return delta_sec > self.timeout
+
+    def _get_response(self, entry):
+        headers = dict(self.headers or {})
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        if self.fetcher:
+            return self.fetcher.get_response(self.url, headers)
+        return get_response(self.url, headers)
+
+    def _read_index(self):
+        index_file = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                return json.load(f)
+        return self._get_legacy_entry()
+
+    def _get_legacy_entry(self):
+        # snapshots written before the index: plain text files named by their timestamp
+        last_update_dt = self._get_max_update_dt(self.cache_dir, endswith=self.CACHE_FILE_EXTENSION)
+        if last_update_dt is None:
+            return None
+        updated = dt.datetime_to_string(last_update_dt)
+        return {'file': updated + self.CACHE_FILE_EXTENSION, 'updated': updated, 'etag': None, 'last_modified': None}
+
+    def _write_index(self, entry):
+        index_file = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, index_file)
+
+    def _prune(self, current_dt, keep_file):
+        snapshots = []
+        for cache_file in os.listdir(self.cache_dir):
+            if cache_file == keep_file or self.CACHE_FILE_EXTENSION not in cache_file:
+                continue
+            path = os.path.join(self.cache_dir, cache_file)
+            stat = os.stat(path)
+            snapshots.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = os.stat(os.path.join(self.cache_dir, keep_file)).st_size
+        current_ts = current_dt.timestamp()
+        # newest first: older snapshots are removed once the total size is over the limit
+        for mtime, size, path in sorted(snapshots, reverse=True):
+            total_size += size
+            if current_ts - mtime > self.max_age_sec or total_size > self.max_size_bytes:
+                logger.debug(f'removing snapshot: {path}')
+                os.remove(path)
+                total_size -= size
 
     def _get_max_update_dt(self, dir, endswith):
         max_dt = dt.min
@@ -62,25 +129,31 @@ class CachedUrl:
 
     def _read_file(self, file):
         logger.debug(f'loading from file: {file}')
+        if file.endswith(self.COMPRESSED_EXTENSION):
+            with gzip.open(file, 'rt', encoding='utf-8') as f:
+                return f.read()
         with open(file, 'r') as f:
             return f.read()
 
     def _write_file(self, text, file):
         logger.debug(f'writing to file: {file}')
-        dir = os.path.dirname(file)
-        with open(file, 'w') as f:
+        with gzip.open(file, 'wt', encoding='utf-8') as f:
             f.write(text)
 
 
-def get(url, headers):
+def get_response(url, headers):
     logger.debug(f'loading url {url} headers: {headers}')
-    r = requests.get(url, headers=headers)
+    return requests.get(url, headers=headers)
+
+
+def get(url, headers):
+    r = get_response(url, headers)
     if r.status_code != 200:
         logger.error(f'GET failed url: {url} code: {r.status_code}')
         return None
     return r.text
 
 
-def get_json(url):
-    text = get(url)
+def get_json(url, headers=None):
+    text = get(url, headers)
     return json.loads(text) if text else {}
@@ -0,0 +1,21 @@
+def get_after_query(sort_field, sort_order, value, keys):
+    """
+    Returns the query of the documents sorted after the last seen one by (sort_field, *key fields).
+    keys are the (field, value) pairs of a unique tie-breaker. A missing sort value is null: mongo sorts
+    it before any value in ascending order and after any value in descending order.
+    """
+    op = '$gt' if sort_order == 1 else '$lt'
+    conditions = []
+    if value is None:
+        if sort_order == 1:
+            conditions.append({sort_field: {'$ne': None}})
+    else:
+        conditions.append({sort_field: {op: value}})
+        if sort_order != 1:
+            conditions.append({sort_field: None})
+
+    equal = {sort_field: value}
+    for field, key in keys:
+        conditions.append(dict(equal, **{field: {op: key}}))
+        equal[field] = key
+    return {'$or': conditions}
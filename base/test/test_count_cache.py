@@ -0,0 +1,76 @@
+from base.count_cache import CountCache, get_capped_count
+from pymongo.errors import OperationFailure
+import pytest
+
+
+class FakeCollection:
+    def __init__(self, count=0):
+        self.count = count
+        self.count_calls = 0
+        self.docs = {}
+        self.read_only = False
+
+    def count_documents(self, where, limit=0):
+        self.count_calls += 1
+        return min(self.count, limit) if limit else self.count
+
+    def find_one(self, where, projection=None):
+        return self.docs.get(where['_id'])
+
+    def find(self, where, projection=None):
+        return [doc for doc in self.docs.values() if doc['name'] == where['name']]
+
+    def replace_one(self, where, doc, upsert=False):
+        if self.read_only:
+            raise OperationFailure('not authorized on triscore to execute command')
+        self.docs[where['_id']] = doc
+
+
+class FakeClient:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getitem__(self, name):
+        return {'counts': self.collection}
+
+
+class TestNormalize:
+    def test_key_order(self):
+        assert CountCache.get_key('athletes', {'c': 643, 'a': 'M30-34'}) == \
+            CountCache.get_key('athletes', {'a': 'M30-34', 'c': 643})
+
+
+class TestCountCache:
+    def test_cached_count(self):
+        cache = CountCache(FakeClient(FakeCollection()))
+        athletes = FakeCollection(count=5)
+        assert cache.get_count(athletes, 'athletes', {'c': 643}) == 5
+        athletes.count = 6
+        assert cache.get_count(athletes, 'athletes', {'c': 643}) == 5
+        assert athletes.count_calls == 1
+
+    def test_refresh(self):
+        cache = CountCache(FakeClient(FakeCollection()))
+        athletes = FakeCollection(count=5)
+        cache.get_count(athletes, 'athletes', {'c': 643})
+        athletes.count = 6
+        cache.refresh(athletes, 'athletes')
+        assert cache.get_count(athletes, 'athletes', {'c': 643}) == 6
+
+
+    def test_read_only_miss(self):
+        counts = FakeCollection()
+        counts.read_only = True
+        cache = CountCache(FakeClient(counts), read_only=True)
+        athletes = FakeCollection(count=5)
+        assert cache.get_count(athletes, 'athletes', {'c': 643, 'a': 'M30-34'}) == 5
+        assert cache.get_count(athletes, 'athletes', {'c': 643, 'a': 'M30-34'}) == 5
+        assert athletes.count_calls == 2 and counts.docs == {}
+
+
+class TestCappedCount:
+    def test_exact(self):
+        assert get_capped_count(FakeCollection(count=5), {}, limit=10) == (5, True)
+
+    def test_capped(self):
+        assert get_capped_count(FakeCollection(count=50), {}, limit=10) == (10, False)
@@ -0,0 +1,87 @@
+from base.fetcher import Fetcher, TokenBucket
+import json
+import threading
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, responses_by_url):
+        self.responses_by_url = responses_by_url
+        self.lock = threading.Lock()
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def get(self, url, headers=None, timeout=None):
+        with self.lock:
+            responses = self.responses_by_url[url]
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.now += sec
+
+
+def make_fetcher(responses_by_url, sleeps, **kwargs):
+    session = FakeSession(responses_by_url)
+    return Fetcher(session_factory=lambda: session, sleep=sleeps.append, rate_per_sec=1000., **kwargs)
+
+
+class TestTokenBucket:
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2., capacity=1, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+        assert clock.now == 2.
+
+    def test_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1., capacity=3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        assert clock.now == 0.
+        bucket.acquire()
+        assert clock.now == 1.
+
+
+class TestFetcher:
+    def test_retry_on_throttling(self):
+        sleeps = []
+        fetcher = make_fetcher({
+            'http://a/1': [FakeResponse(429, headers={'Retry-After': '3'}), FakeResponse(503), FakeResponse(200, '{"x": 1}')],
+        }, sleeps)
+        assert fetcher.get_json('http://a/1') == {'x': 1}
+        assert sleeps[0] == 3.
+        assert len(sleeps) == 2
+
+    def test_give_up(self):
+        sleeps = []
+        fetcher = make_fetcher({'http://a/1': [FakeResponse(500)]}, sleeps, max_retries=2)
+        assert fetcher.get('http://a/1') is None
+        assert len(sleeps) == 2
+
+    def test_no_retry_on_client_error(self):
+        sleeps = []
+        fetcher = make_fetcher({'http://a/1': [FakeResponse(404)]}, sleeps)
+        assert fetcher.get_json('http://a/1') == {}
+        assert sleeps == []
+
+    def test_map_json_order(self):
+        urls = [f'http://a/{i}' for i in range(20)]
+        fetcher = make_fetcher({url: [FakeResponse(200, json.dumps({'i': i}))] for i, url in enumerate(urls)}, [], max_workers=3)
+        assert [data['i'] for data in fetcher.map_json(urls)] == list(range(20))
+        fetcher.close()
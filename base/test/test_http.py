@@ -0,0 +1,72 @@
+from base import dt
+from base.http import CachedUrl
+import json
+import os
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class FakeFetcher:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get_response(self, url, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+def expire(cached_url):
+    index_file = os.path.join(cached_url.cache_dir, CachedUrl.INDEX_FILE)
+    with open(index_file) as f:
+        entry = json.load(f)
+    entry['updated'] = dt.datetime_to_string(dt.delta(dt.now(), days=-2))
+    with open(index_file, 'w') as f:
+        json.dump(entry, f)
+
+
+class TestCachedUrl:
+    def test_fresh_lookup(self, tmp_path):
+        fetcher = FakeFetcher([FakeResponse(200, 'body', {'ETag': '"v1"'})])
+        cached_url = CachedUrl('http://a/list', None, tmp_path, timeout=86400, fetcher=fetcher)
+        assert cached_url.get() == 'body'
+        assert cached_url.get() == 'body'
+        assert len(fetcher.requests) == 1
+        assert any(f.endswith('.cache.gz') for f in os.listdir(cached_url.cache_dir))
+
+    def test_not_modified(self, tmp_path):
+        fetcher = FakeFetcher([
+            FakeResponse(200, 'body', {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jun 2020 00:00:00 GMT'}),
+            FakeResponse(304),
+        ])
+        cached_url = CachedUrl('http://a/list', {'key': 'x'}, tmp_path, timeout=86400, fetcher=fetcher)
+        cached_url.get()
+        expire(cached_url)
+        assert cached_url.get() == 'body'
+        assert fetcher.requests[1] == {
+            'key': 'x', 'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+        assert not cached_url._is_expired(cached_url._read_index(), dt.now())
+
+    def test_prune_by_size(self, tmp_path):
+        fetcher = FakeFetcher([FakeResponse(200, 'first'), FakeResponse(200, 'second')])
+        cached_url = CachedUrl('http://a/list', None, tmp_path, timeout=86400, fetcher=fetcher, max_size_bytes=1)
+        cached_url.get()
+        expire(cached_url)
+        # snapshots are named by second
+        os.rename(
+            os.path.join(cached_url.cache_dir, cached_url._read_index()['file']),
+            os.path.join(cached_url.cache_dir, '2000-01-01T00:00:00.cache.gz'))
+        assert cached_url.get() == 'second'
+        snapshots = [f for f in os.listdir(cached_url.cache_dir) if f.endswith('.gz')]
+        assert snapshots == [cached_url._read_index()['file']]
+
+    def test_legacy_snapshot(self, tmp_path):
+        cached_url = CachedUrl('http://a/list', None, tmp_path, fetcher=FakeFetcher([]))
+        with open(os.path.join(cached_url.cache_dir, '2020-01-01T00:00:00.cache'), 'w') as f:
+            f.write('legacy')
+        assert cached_url.get() == 'legacy'
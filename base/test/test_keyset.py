@@ -0,0 +1,58 @@
+from base.keyset import get_after_query
+
+
+def matches(doc, where):
+    for field, condition in where.items():
+        if field == '$or':
+            if not any(matches(doc, option) for option in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+        elif '$ne' in condition:
+            if value == condition['$ne']:
+                return False
+        elif value is None:
+            # comparisons never match null
+            return False
+        elif '$gt' in condition and not value > condition['$gt']:
+            return False
+        elif '$lt' in condition and not value < condition['$lt']:
+            return False
+    return True
+
+
+def sort_key(doc):
+    # mongo sorts null before any value
+    return [(doc.get(field) is not None, doc.get(field) or '') for field in ['c', 'name', 'date']]
+
+
+def read_pages(docs, sort_order):
+    ordered = sorted(docs, key=sort_key, reverse=sort_order == -1)
+    seen = []
+    query = {}
+    while True:
+        page = [doc for doc in ordered if matches(doc, query)][:1]
+        if not page:
+            return seen
+        last = page[0]
+        seen.append(last)
+        query = get_after_query('c', sort_order, last.get('c'), [('name', last['name']), ('date', last['date'])])
+
+
+class TestAfterQuery:
+    docs = [
+        {'name': 'A', 'date': '2019-01-01', 'c': 'FR'},
+        {'name': 'A', 'date': '2020-01-01', 'c': 'FR'},
+        {'name': 'B', 'date': '2020-01-01', 'c': 'DE'},
+        {'name': 'C', 'date': '2019-01-01'},
+        {'name': 'C', 'date': '2020-01-01'},
+    ]
+
+    def test_ascending(self):
+        assert read_pages(self.docs, 1) == sorted(self.docs, key=sort_key)
+
+    def test_descending(self):
+        assert read_pages(self.docs, -1) == sorted(self.docs, key=sort_key, reverse=True)
@@ -0,0 +1,36 @@
+import json
+import os
+
+from base import tracing
+from score.elo_scorer import EloScorer
+from score.storage import MockAthleteStorage
+from score.test.test_elo_numpy import make_race_results, RACE_INFO
+
+
+class TestTracer:
+    def test_size_bucket(self):
+        assert tracing.get_size_bucket(1) == '1-10'
+        assert tracing.get_size_bucket(100) == '11-100'
+        assert tracing.get_size_bucket(101) == '101-1000'
+        assert tracing.get_size_bucket(6000) == '5001+'
+
+    def test_scorer_spans(self, tmp_path):
+        tracer = tracing.Tracer()
+        elo_scorer = EloScorer(MockAthleteStorage(), tracer=tracer)
+        race_results = sorted(make_race_results(seed=0, group_size=5), key=lambda r: r['t'])
+        elo_scorer.add_race(RACE_INFO, race_results)
+
+        assert tracer.stats['fetch_scores'][0] == 1
+        assert tracer.stats['create_athletes'][0] == 1
+        assert tracer.stats['history_writes'][0] == 1
+        # extended groups: 10, 15 and 10 results
+        assert tracer.stats['process_group[1-10]'][0] == 2
+        assert tracer.stats['process_group[11-100]'][0] == 1
+        assert tracer.stats['seeds[1-10]'][0] == 2
+
+        tracer.write(str(tmp_path))
+        with open(os.path.join(str(tmp_path), tracing.TRACE_FILE)) as f:
+            events = json.load(f)['traceEvents']
+        assert len(events) == sum(count for count, _, _ in tracer.stats.values())
+        assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+        assert 'fetch_scores' in tracer.get_summary()
@@ -0,0 +1,88 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+TRACE_FILE = 'trace.json'
+SUMMARY_FILE = 'timings.txt'
+SIZE_BUCKETS = [10, 100, 1000, 5000]
+
+
+def get_size_bucket(size, buckets=SIZE_BUCKETS):
+    lower = 1
+    for upper in buckets:
+        if size <= upper:
+            return f'{lower}-{upper}'
+        lower = upper + 1
+    return f'{lower}+'
+
+
+class Tracer:
+    """
+    Records wall time and call counts of named spans. Spans are aggregated by name for the summary table
+    and kept as complete events of the Chrome trace format (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, max_events=1000 * 1000):
+        self.start = time.perf_counter()
+        self.max_events = max_events
+        self.events = []
+        self.dropped_events = 0
+        self.stats = {}
+        self.pid = os.getpid()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, args)
+
+    def add(self, name, start, duration, args=None):
+        count, total, longest = self.stats.get(name, (0, 0., 0.))
+        self.stats[name] = (count + 1, total + duration, max(longest, duration))
+
+        if len(self.events) >= self.max_events:
+            self.dropped_events += 1
+            return
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': round(1e6 * (start - self.start), 3),
+            'dur': round(1e6 * duration, 3),
+            'pid': self.pid,
+            'tid': threading.get_ident(),
+            'args': args or {},
+        })
+
+    def get_summary(self):
+        total_sec = time.perf_counter() - self.start
+        lines = [f'{"span":<40} {"count":>10} {"total s":>10} {"mean ms":>10} {"max ms":>10} {"share":>7}']
+        for name, (count, total, longest) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                f'{name:<40} {count:>10} {total:>10.3f} {1000. * total / count:>10.3f} {1000. * longest:>10.3f} '
+                f'{100. * total / total_sec:>6.1f}%')
+        if self.dropped_events:
+            lines.append(f'trace events dropped: {self.dropped_events}')
+        return '\n'.join(lines)
+
+    def write(self, log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, TRACE_FILE), 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        with open(os.path.join(log_dir, SUMMARY_FILE), 'w') as f:
+            f.write(self.get_summary() + '\n')
+
+
+class NullTracer:
+    def span(self, name, **args):
+        return contextlib.nullcontext()
+
+    def add(self, name, start, duration, args=None):
+        pass
+
+
+NULL_TRACER = NullTracer()
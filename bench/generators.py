@@ -0,0 +1,104 @@
+import random
+
+from data.ironman.parser import constants
+from race import builder
+import score.synthetic as synthetic
+
+
+FIRST_NAMES = ['Иван', 'Мария', 'Алексей', 'Ольга', 'Дмитрий', 'Юлия', 'Сергей', 'Анна', 'John', 'Emma']
+LAST_NAMES = ['Иванов', 'Петрова', 'Смирнов', 'Кузнецова', 'Соловьёв', 'Ильин', 'Щукин', 'Smith', 'Brown']
+LOCATION_NAMES = [
+    'Russia', 'Moscow Russia', 'Texas', 'Austin TX', 'England', 'Korea', 'New South Wales Australia',
+    'Unknown Place', 'Germany', 'Victoria',
+]
+# leg time ranges in seconds of a full distance race
+LEG_TIME_RANGES = {
+    constants.SWIM_LEG: (2700, 6000),
+    constants.T1_LEG: (120, 900),
+    constants.BIKE_LEG: (17000, 30000),
+    constants.T2_LEG: (60, 600),
+    constants.RUN_LEG: (10000, 25000),
+}
+
+
+def make_ironman_results(seed, size, dnf_rate=0.08):
+    """
+    Raw results shaped as ironman api results with undefined times already fixed.
+    """
+    rnd = random.Random(seed)
+    results = []
+    for i in range(size):
+        gender = rnd.choice([constants.GENDER_MALE, constants.GENDER_MALE, constants.GENDER_FEMALE])
+        result = {
+            'ContactId': f'contact-{i}',
+            'Contact': {'FullName': f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}', 'Gender': gender},
+            'AgeGroup': synthetic.get_age_group(gender, rnd.randint(18, 64)),
+            'BibNumber': str(i + 1),
+            'CountryRepresentingISONumeric': rnd.choice(synthetic.COUNTRIES),
+            'EventStatus': constants.EVENT_STATUS_FINISH,
+        }
+
+        finished = rnd.random() >= dnf_rate
+        stop_leg = constants.LEG_NAMES.index(rnd.choice(list(LEG_TIME_RANGES))) if not finished else len(LEG_TIME_RANGES)
+        for leg_index, leg in enumerate(constants.LEG_NAMES[:-1]):
+            result[f'{leg}Time'] = rnd.randint(*LEG_TIME_RANGES[leg]) if leg_index < stop_leg else builder.MAX_TIME
+        if finished:
+            result[f'{constants.FINISH_LEG}Time'] = sum(result[f'{leg}Time'] for leg in constants.LEG_NAMES[:-1])
+        else:
+            result[f'{constants.FINISH_LEG}Time'] = builder.MAX_TIME
+            result['EventStatus'] = constants.EVENT_STATUS_DNF
+        results.append(result)
+    return results
+
+
+def get_counts(ironman_results):
+    count_by_age_group = {}
+    count_by_gender = {}
+    for result in ironman_results:
+        count_by_age_group[result['AgeGroup']] = count_by_age_group.get(result['AgeGroup'], 0) + 1
+        gender = result['Contact']['Gender']
+        count_by_gender[gender] = count_by_gender.get(gender, 0) + 1
+    return count_by_age_group, count_by_gender
+
+
+def make_group_results(seed, size, age_group='M30-34'):
+    """
+    Triscore results of one age group sorted by finish time, the input of EloScorer.process_group.
+    """
+    rnd = random.Random(seed)
+    athletes = synthetic.make_athletes(rnd, size)
+    for athlete in athletes:
+        athlete['a'] = age_group
+    _, results = synthetic.make_race(rnd, 0, athletes, 'full')
+    return results
+
+
+def make_athlete_documents(seed, count, history_size=10):
+    """
+    Athlete documents as written by the scorer, with the last races in the history.
+    """
+    rnd = random.Random(seed)
+    athletes = []
+    for athlete in synthetic.make_athletes(rnd, count):
+        score = rnd.randint(1000, 3000)
+        history = []
+        for index in range(1, history_size + 1):
+            history.append({
+                'index': index, 'race': f'Synthetic race {index}', 'date': f'2020-01-{index:02d}', 'type': 'full',
+                'ps': score, 'ns': score, 'da': 0, 'a': athlete['a'], 'c': athlete['c'],
+            })
+        athletes.append({
+            'id': athlete['id'], 'n': athlete['n'], 'g': athlete['g'], 'c': athlete['c'], 'a': athlete['a'],
+            's': score, 'p': history_size, 'h': history,
+        })
+    return athletes
+
+
+def make_cyrillic_names(seed, count):
+    rnd = random.Random(seed)
+    return [f'{rnd.choice(FIRST_NAMES[:8])} {rnd.choice(LAST_NAMES[:7])}' for _ in range(count)]
+
+
+def make_location_names(seed, count):
+    rnd = random.Random(seed)
+    return [rnd.choice(LOCATION_NAMES) for _ in range(count)]
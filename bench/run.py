@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from pymongo import MongoClient
+
+from base import log, translit
+from base.location.resolver import LocationResolver
+import bench.generators as generators
+from data.ironman import transformer
+from data.ironman.parser import result_record
+from score.elo_scorer import EloScorer, ENGINE_NUMPY, ENGINE_SCALAR, START_SCORE
+from score.storage import AthleteStorage, MockAthleteStorage, build_athlete_race
+
+
+logger = log.setup_logger(__file__)
+
+SEED = 0
+MIN_ROUND_SEC = 0.2
+ROUNDS = 5
+# single calls slower than this are measured with one round only
+SLOW_CALL_SEC = 2.
+REGRESSION_RATIO = 1.2
+
+GROUP_SIZES = [10, 100, 1000, 5000]
+# the scalar bisection is quadratic in python, the largest groups are measured only with --full
+SCALAR_MAX_GROUP_SIZE = 1000
+RACE_INFO = {'name': 'Synthetic bench', 'date': '2020-01-01', 'type': 'full', 'location': {'c': 643}}
+
+
+def measure(func, min_round_sec=MIN_ROUND_SEC, rounds=ROUNDS):
+    """
+    Returns per call timings: every round calls func enough times to run at least min_round_sec.
+    """
+    start = time.perf_counter()
+    func()
+    first_sec = time.perf_counter() - start
+
+    loops = max(1, int(min_round_sec / first_sec)) if first_sec > 0 else 1000
+    if first_sec > SLOW_CALL_SEC:
+        rounds = 1
+
+    round_secs = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        round_secs.append((time.perf_counter() - start) / loops)
+
+    return {
+        'min': min(round_secs),
+        'median': statistics.median(round_secs),
+        'mean': statistics.mean(round_secs),
+        'stddev': statistics.stdev(round_secs) if len(round_secs) > 1 else 0.,
+        'rounds': len(round_secs),
+        'loops': loops,
+    }
+
+
+def bench_get_ranks_by_legs(size):
+    records = [result_record.from_result(result) for result in generators.make_ironman_results(SEED, size)]
+    count_by_age_group, count_by_gender = transformer.get_group_counts(records)
+    return lambda: transformer.get_ranks_by_legs(records, count_by_age_group, count_by_gender)
+
+
+def bench_process_group(engine, size):
+    results = generators.make_group_results(SEED, size)
+    elo_scorer = EloScorer(MockAthleteStorage(), engine=engine)
+    start_score_by_id = {result['id']: START_SCORE + (i * 37) % 1000 for i, result in enumerate(results)}
+
+    def process_group():
+        elo_scorer.race_summaries = []
+        elo_scorer.score_by_id = dict(start_score_by_id)
+        elo_scorer.race_count_by_id = {athlete_id: 1 for athlete_id in start_score_by_id}
+        elo_scorer.process_group('M30-34', results, RACE_INFO)
+    return process_group
+
+
+def bench_cyrillic_to_english(count):
+    names = generators.make_cyrillic_names(SEED, count)
+    return lambda: [translit.cyrillic_to_english(name) for name in names]
+
+
+def bench_try_to_deduce_country(count):
+    resolver = LocationResolver()
+    names = generators.make_location_names(SEED, count)
+    return lambda: [resolver.try_to_deduce_country(name) for name in names]
+
+
+def bench_get_scores_and_country(mongo_client, db_name, count):
+    athlete_storage = AthleteStorage(
+        mongo_client=mongo_client, db_name=db_name, collection_name='bench-athletes',
+        races_collection_name='bench-athlete_races')
+    athlete_storage.scores_collection.drop()
+    athlete_storage.races_collection.drop()
+    athlete_storage._create_indices()
+
+    athletes = generators.make_athlete_documents(SEED, count)
+    athlete_storage.races_collection.insert_many(
+        [build_athlete_race(athlete['id'], race_summary) for athlete in athletes for race_summary in athlete['h']])
+    athlete_storage.scores_collection.insert_many(athletes)
+
+    athlete_ids = [athlete['id'] for athlete in athletes]
+    race_summary = athletes[0]['h'][-1]
+    return lambda: athlete_storage.get_scores_and_country(race_summary['race'], race_summary['date'], athlete_ids)
+
+
+def get_benchmarks(full, mongo_client, db_name):
+    benchmarks = []
+    for size in [100, 1000, 3000]:
+        benchmarks.append(('transformer.get_ranks_by_legs', {'size': size}, lambda size=size: bench_get_ranks_by_legs(size)))
+
+    for engine in [ENGINE_SCALAR, ENGINE_NUMPY]:
+        for size in GROUP_SIZES:
+            if engine == ENGINE_SCALAR and size > SCALAR_MAX_GROUP_SIZE and not full:
+                continue
+            benchmarks.append((
+                'EloScorer.process_group', {'engine': engine, 'size': size},
+                lambda engine=engine, size=size: bench_process_group(engine, size)))
+
+    benchmarks.append(('translit.cyrillic_to_english', {'count': 1000}, lambda: bench_cyrillic_to_english(1000)))
+    benchmarks.append((
+        'LocationResolver.try_to_deduce_country', {'count': 100}, lambda: bench_try_to_deduce_country(100)))
+
+    if mongo_client:
+        for count in [100, 1000]:
+            benchmarks.append((
+                'AthleteStorage.get_scores_and_country', {'count': count},
+                lambda count=count: bench_get_scores_and_country(mongo_client, db_name, count)))
+    return benchmarks
+
+
+def get_key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline_results, ratio=REGRESSION_RATIO):
+    """
+    Returns (key, baseline median, median) of benchmarks with median slower than the baseline by more than ratio.
+    """
+    baseline_by_key = {get_key(result): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline = baseline_by_key.get(get_key(result))
+        if baseline and result['stats']['median'] > ratio * baseline['stats']['median']:
+            regressions.append((get_key(result), baseline['stats']['median'], result['stats']['median']))
+    return regressions
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro benchmarks of the scorer, transformer and api hot paths')
+
+    parser.add_argument('--filter', default='', help='run benchmarks with the name containing the filter')
+    parser.add_argument('--full', action='store_true', help='include the slowest scalar group sizes')
+    parser.add_argument('--results-dir', default='/tmp/bench')
+    parser.add_argument('--compare', default=None, help='json results of a previous run to compare with')
+    parser.add_argument('--mongo-uri', default=None, help='mongo used by the storage benchmarks, skipped otherwise')
+    parser.add_argument('--mongo-db', default='triscore-bench')
+
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(args.mongo_uri) if args.mongo_uri else None
+    results = []
+    for name, params, make_func in get_benchmarks(args.full, mongo_client, args.mongo_db):
+        if args.filter not in name:
+            continue
+        stats = measure(make_func())
+        logger.info(f'{name} {params} median: {1000. * stats["median"]:.3f}ms min: {1000. * stats["min"]:.3f}ms')
+        results.append({'name': name, 'params': params, 'stats': stats})
+
+    commit = get_commit()
+    os.makedirs(args.results_dir, exist_ok=True)
+    output_path = os.path.join(args.results_dir, f'bench-{commit}.json')
+    with open(output_path, 'w') as f:
+        json.dump({'commit': commit, 'python': platform.python_version(), 'results': results}, f, indent=2)
+    logger.info(f'results written to {output_path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key, baseline_median, median in compare(results, baseline['results']):
+            logger.warning(f'regression {key}: {1000. * baseline_median:.3f}ms -> {1000. * median:.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import bench.generators as generators
+import bench.run as run
+from data.ironman import transformer
+from data.ironman.parser import result_record
+from score.elo_scorer import ENGINE_NUMPY
+
+
+class TestGenerators:
+    def test_ironman_results_are_ranked(self):
+        results = generators.make_ironman_results(seed=1, size=50)
+        records = [result_record.from_result(result) for result in results]
+        count_by_age_group, count_by_gender = generators.get_counts(results)
+        _, _, overall_rank, _, _, _ = transformer.get_ranks_by_legs(records, count_by_age_group, count_by_gender)
+        assert len(overall_rank['Finish']) == len(results)
+        assert generators.make_ironman_results(seed=1, size=50) == results
+
+    def test_process_group(self):
+        process_group = run.bench_process_group(ENGINE_NUMPY, 20)
+        process_group()
+
+
+class TestCompare:
+    def test_regression(self):
+        baseline = [{'name': 'a', 'params': {'size': 1}, 'stats': {'median': 1.}}]
+        results = [{'name': 'a', 'params': {'size': 1}, 'stats': {'median': 1.5}}]
+        assert run.compare(results, baseline) == [('a{"size": 1}', 1., 1.5)]
+        assert run.compare(baseline, results) == []
+
+    def test_measure(self):
+        stats = run.measure(lambda: sum(range(100)), min_round_sec=0.001, rounds=2)
+        assert stats['rounds'] == 2 and stats['min'] > 0
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from base import log, dt
+from base.fetcher import Fetcher, MAX_WORKERS, RATE_PER_SEC
 from data.ironman import url
-from data.ironman.parser import race_parser
+from data.ironman.parser import race_parser, result_record
 from data.storage import DataStorage
 from pymongo import MongoClient
 import time
@@ -36,7 +38,7 @@ def ironman_race_date_filter(race):
     return not valid_race
 
 
-def load_races(mongo_client):
+def load_races(mongo_client, fetcher):
     LIMIT = 100
     FIRST_INDEX = 0
     LAST_INDEX = 50000
@@ -53,8 +55,8 @@ def load_races(mongo_client):
             list_filter=ironman_race_date_filter,
             dry_run=False,
             add_invalid=True,
-            data_load_timeout=1,
-            limit=-1)
+            limit=-1,
+            fetcher=fetcher)
         if updated_ids is None:
             logger.info(f'no races found url: {races_batch_url}: break')
             break
@@ -62,37 +64,53 @@ def load_races(mongo_client):
             logger.info(f'url: {races_batch_url} updated: {len(updated_ids)}')
 
 
-def load_results(mongo_client):
+def load_race_results(mongo_client, fetcher, races_storage, race):
+    race_name = race_parser.get_subevent_name(race)
+    race_date = race_parser.get_date(race)
+    subevent_id = race_parser.get_subevent_id(race)
+    logger.info(f'process race {race_name} date: {race_date} subevent_id: {subevent_id}')
+
+    results_storage = DataStorage(
+        mongo_client, db_name='ironman', collection_name=subevent_id)
+    race_results_url = url.get_race_results_url(subevent_id=subevent_id)
+    updated_ids = results_storage.update(
+        id_fields=['ContactId'],
+        list_url=race_results_url,
+        list_headers=url.API_HEADERS,
+        list_transformer=data_transformer,
+        dry_run=False,
+        limit=-1,
+        fetcher=fetcher)
+
+    if updated_ids is None:
+        logger.info(
+            f'no results found for race \'{race_name}\': mark as invalid')
+        races_storage.mark_invalid(where={'SubEventId': subevent_id})
+    else:
+        # the transformer rewrites a triscore race only when the hash of its results changes
+        content_hash = results_storage.get_content_hash(projection=result_record.PROJECTION)
+        races_storage.update_one(
+            where={'SubEventId': subevent_id}, field=DataStorage.CONTENT_HASH_FIELD, value=content_hash)
+        logger.info(
+            f'race \'{race_name}\' results were processed: {len(updated_ids)} items added: mark as processed')
+        races_storage.mark_processed(where={'SubEventId': subevent_id})
+
+
+def load_results(mongo_client, fetcher):
     races_storage = DataStorage(mongo_client, db_name='ironman', collection_name='races')
-    for race in races_storage.find(
-            where={DataStorage.INVALID_FIELD: False,
-                   DataStorage.PROCESSED_FIELD: False},
-            sort=[('Date', 1)]):
-        race_name = race_parser.get_subevent_name(race)
-        race_date = race_parser.get_date(race)
-        subevent_id = race_parser.get_subevent_id(race)
-        logger.info(f'process race {race_name} date: {race_date} subevent_id: {subevent_id}')
-
-        results_storage = DataStorage(
-            mongo_client, db_name='ironman', collection_name=subevent_id)
-        race_results_url = url.get_race_results_url(subevent_id=subevent_id)
-        updated_ids = results_storage.update(
-            id_fields=['ContactId'],
-            list_url=race_results_url,
-            list_headers=url.API_HEADERS,
-            list_transformer=data_transformer,
-            dry_run=False,
-            data_load_timeout=1,
-            limit=-1)
+    races = list(races_storage.find(
+        where={DataStorage.INVALID_FIELD: False,
+               DataStorage.PROCESSED_FIELD: False},
+        sort=[('Date', 1)]))
 
-        if updated_ids is None:
-            logger.info(
-                f'no results found for race \'{race_name}\': mark as invalid')
-            races_storage.mark_invalid(where={'SubEventId': subevent_id})
-        else:
-            logger.info(
-                f'race \'{race_name}\' results were processed: {len(updated_ids)} items added: mark as processed')
-            races_storage.mark_processed(where={'SubEventId': subevent_id})
+    # the fetcher limits the request rate and the requests in flight of all the races together
+    with ThreadPoolExecutor(max_workers=fetcher.max_workers) as executor:
+        futures = [
+            executor.submit(load_race_results, mongo_client, fetcher, races_storage, race)
+            for race in races
+        ]
+        for future in futures:
+            future.result()
 
 
 def main():
@@ -101,13 +119,16 @@ def main():
     parser.add_argument('-u', '--username', default='data-loader')
     parser.add_argument('-p', '--password', required=True)
     parser.add_argument('-t', '--timeout', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='max requests in flight')
+    parser.add_argument('--rate', type=float, default=RATE_PER_SEC, help='max requests per second to the api')
     args = parser.parse_args()
 
     mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
+    fetcher = Fetcher(max_workers=args.workers, rate_per_sec=args.rate)
 
     def load_data():
-        load_races(mongo_client)
-        load_results(mongo_client)
+        load_races(mongo_client, fetcher)
+        load_results(mongo_client, fetcher)
 
     if args.timeout is None:
         load_data()
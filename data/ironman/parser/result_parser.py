@@ -10,7 +10,7 @@ def get_age_group(result):
 
 
 def get_gender(result, default='M'):
-    contact = result['Contact']
+    contact = result.get('Contact')
     if not contact:
         return default
 
@@ -30,7 +30,7 @@ def is_female(result):
 
 
 def get_athlete_name(result, default=''):
-    if not result['Contact']:
+    if not result.get('Contact'):
         return default
     return result['Contact']['FullName']
 
@@ -44,11 +44,13 @@ def get_contact_id(result):
 
 
 def get_finish_status(result, log=False):
-    finish_time = get_leg_time(result, FINISH_LEG)
+    return get_status(get_leg_time(result, FINISH_LEG), result['EventStatus'], log)
+
+
+def get_status(finish_time, event_status, log=False):
     if finish_time > 0 and finish_time < IRONMAN_NOT_FINISHED_TIME:
         return EVENT_STATUS_FINISH
 
-    event_status = result['EventStatus']
     if event_status and event_status != EVENT_STATUS_FINISH:
         return event_status
 
@@ -0,0 +1,48 @@
+from data.ironman.parser import result_parser
+from data.ironman.parser.constants import LEG_NAMES, FINISH_LEG
+
+
+LEG_TIME_FIELDS = [f'{leg}Time' for leg in LEG_NAMES]
+FINISH_INDEX = LEG_NAMES.index(FINISH_LEG)
+
+# the fields of a raw ironman result read by the transformer
+PROJECTION = dict.fromkeys([
+    'ContactId', 'Contact.FullName', 'Contact.Gender', 'AgeGroup', 'BibNumber', 'CountryRepresentingISONumeric',
+    'EventStatus'] + LEG_TIME_FIELDS, 1)
+PROJECTION['_id'] = 0
+
+
+class ResultRecord:
+    """
+    Compact ironman result, leg times are ordered as LEG_NAMES.
+    """
+    __slots__ = ['contact_id', 'athlete_name', 'gender', 'age_group', 'bib', 'country_iso_num', 'event_status', 'times']
+
+    def __init__(self, contact_id, athlete_name, gender, age_group, bib, country_iso_num, event_status, times):
+        self.contact_id = contact_id
+        self.athlete_name = athlete_name
+        self.gender = gender
+        self.age_group = age_group
+        self.bib = bib
+        self.country_iso_num = country_iso_num
+        self.event_status = event_status
+        self.times = times
+
+    @property
+    def finish_time(self):
+        return self.times[FINISH_INDEX]
+
+    def get_finish_status(self, log=False):
+        return result_parser.get_status(self.finish_time, self.event_status, log=log)
+
+
+def from_result(result):
+    return ResultRecord(
+        contact_id=result_parser.get_contact_id(result),
+        athlete_name=result_parser.get_athlete_name(result),
+        gender=result_parser.get_gender(result),
+        age_group=result_parser.get_age_group(result),
+        bib=result_parser.get_bib_number(result),
+        country_iso_num=result_parser.get_country_representing_iso_numeric(result),
+        event_status=result['EventStatus'],
+        times=[result[field] for field in LEG_TIME_FIELDS])
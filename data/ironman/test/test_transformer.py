@@ -0,0 +1,84 @@
+from data.ironman import transformer
+from data.ironman.parser import constants, result_record
+from race import builder
+
+
+def make_result(contact_id, age_group, gender, finish_time):
+    result = {
+        'ContactId': contact_id,
+        'AgeGroup': age_group,
+        'Contact': {'FullName': contact_id, 'Gender': gender},
+        'BibNumber': contact_id,
+        'CountryRepresentingISONumeric': 643,
+        'EventStatus': constants.EVENT_STATUS_FINISH,
+    }
+    for leg in constants.LEG_NAMES:
+        result[f'{leg}Time'] = finish_time
+    return result_record.from_result(result)
+
+
+class TestRanksByLegs:
+    def test_ties_and_undefined_times(self):
+        results = [
+            make_result('a', 'M30-34', 'M', 100),
+            make_result('b', 'M30-34', 'M', 300),
+            make_result('c', 'F30-34', 'F', 100),
+            make_result('d', 'M30-34', 'M', 100),
+            make_result('e', 'M35-39', 'M', builder.MAX_TIME),
+        ]
+        count_by_age_group, count_by_gender = transformer.get_group_counts(results)
+        assert count_by_age_group == {'M30-34': 3, 'F30-34': 1, 'M35-39': 1}
+        assert count_by_gender == {'M': 4, 'F': 1}
+        age_rank, gender_rank, overall_rank, time_age_rank, time_gender_rank, time_overall_rank = \
+            transformer.get_ranks_by_legs(results, count_by_age_group, count_by_gender)
+
+        assert age_rank['Finish'] == [1, 3, 1, 1, 1]
+        assert gender_rank['Finish'] == [1, 3, 1, 1, 4]
+        assert overall_rank['Finish'] == [1, 4, 1, 1, 5]
+        assert time_age_rank['Finish'] == [1., 3., 1., 1., 1]
+        assert time_overall_rank['Finish'] == [1., 5., 1., 1., 5]
+        assert type(time_overall_rank['Finish'][4]) == int
+
+
+class TestRecords:
+    def test_filter_duplicates_and_fix_times(self):
+        records = [
+            make_result('a', 'M30-34', 'M', 100),
+            make_result('a', 'M30-34', 'M', 200),
+            make_result('b', 'M30-34', 'M', 0),
+        ]
+        records = transformer.fix_undefined_times(transformer.filter_result_duplicates(records))
+        assert [(record.contact_id, record.finish_time) for record in records] == [('a', 200), ('b', builder.MAX_TIME)]
+        assert records[1].get_finish_status() == constants.EVENT_STATUS_DNF
+
+    def test_missing_contact(self):
+        result = {field: 0 for field in result_record.PROJECTION}
+        record = result_record.from_result(result)
+        assert record.gender == constants.GENDER_MALE and record.athlete_name == ''
+
+
+class TestShards:
+    def test_same_race_in_one_shard(self):
+        races = [
+            {'SubEventId': str(i), 'Series': f'IRONMAN {i % 5}', 'Date': '2020-01-01'}
+            for i in range(20)
+        ]
+        shards = transformer.get_shards(races, shard_size=3)
+        assert sorted(race['SubEventId'] for shard in shards for race in shard) == sorted(str(i) for i in range(20))
+        for shard in shards:
+            series = set(race['Series'] for race in shard)
+            assert all(race['Series'] not in series for other in shards if other is not shard for race in other)
+
+
+class FakeRaceStorage:
+    def race_processed(self, name, date):
+        return True
+
+    def get_content_hash(self, name, date):
+        return 'hash'
+
+
+class TestContentHash:
+    def test_skip_unchanged_race(self):
+        race = {'SubEventId': '1', 'Series': 'IRONMAN', 'Date': '2020-01-01', 'ContentHash': 'hash'}
+        assert transformer.transform_race(None, FakeRaceStorage(), race, dry_run=False) == (transformer.RACE_SKIPPED, 0)
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
 from base import dt, log
+from base.count_cache import CountCache
+from base.generation import DataGeneration
 from base.location.resolver import LocationResolver
 from data.storage import DataStorage
-from data.ironman.parser import constants, race_parser, result_parser
+from data.ironman.parser import constants, race_parser, result_record
 from decimal import *
+import numpy as np
 from pymongo import MongoClient
 from race import builder
-from race.storage import RaceStorage
+from race.storage import RaceStorage, CONTENT_HASH_FIELD
 
 
 logger = log.setup_logger(__file__, debug=False)
@@ -21,6 +26,13 @@ IRONMAN_EVENT_STATUS_TO_TRISCORE = {
     constants.EVENT_STATUS_FINISH: builder.FINISH_STATUS_OK
 }
 
+RACE_SKIPPED = 'skipped'
+RACE_DRY_RUN = 'dry_run'
+RACE_ADDED = 'added'
+RACE_UPDATED = 'updated'
+SHARD_SIZE = 8
+RESULTS_BATCH_SIZE = 1000
+
 LEG_IRONMAN_TO_TRISCORE = {
     constants.SWIM_LEG: builder.SWIM_LEG,
     constants.T1_LEG: builder.T1_LEG,
@@ -51,19 +63,15 @@ def get_distance_info(race):
     return builder.build_distance_info(total_distance, swim_type, bike_type, run_type)
 
 
-def get_sorted_results(race_results, sort_by):
-    return sorted(race_results, key=lambda result: result[sort_by])
-
-
-def get_stats(race_results):
-    total_count = len(race_results)
+def get_stats(records):
+    total_count = len(records)
     success_count = 0
     male_count = 0
     female_count = 0
-    for race_result in race_results:
-        success_count += result_parser.is_finished(race_result)
-        male_count += result_parser.is_male(race_result)
-        female_count += result_parser.is_female(race_result)
+    for record in records:
+        success_count += record.get_finish_status() == constants.EVENT_STATUS_FINISH
+        male_count += record.gender == constants.GENDER_MALE
+        female_count += record.gender == constants.GENDER_FEMALE
 
     return builder.build_stats(
         total=total_count,
@@ -72,203 +80,287 @@ def get_stats(race_results):
         female=female_count)
 
 
-def get_ranks_by_legs(race_results, count_by_age_group, count_by_gender):
-    age_rank = {}
-    gender_rank = {}
-    overall_rank = {}
-
-    time_age_rank = {}
-    time_gender_rank = {}
-    time_overall_rank = {}
-
-    LAST_EQUAL_RANK = '__last_equal_rank'
-    LAST_RANK = '__last_rank'
-    LAST_TIME = '__last_time'
-    total_count = len(race_results)
-
-    for leg in constants.LEG_NAMES:
-        min_leg_time = {}
-        max_leg_time = {}
-
-        age_rank[leg] = {}
-        gender_rank[leg] = {}
-        overall_rank[leg] = {}
-
-        logger.debug(f'========= LEG: {leg}')
-
-        last_leg_time = 0
-        for race_result in get_sorted_results(race_results, sort_by=f'{leg}Time'):
-            age = result_parser.get_age_group(race_result)
-            gender = result_parser.get_gender(race_result)
-            contact_id = result_parser.get_contact_id(race_result)
-            leg_time = result_parser.get_leg_time(race_result, leg)
-
-            if age not in min_leg_time:
-                min_leg_time[age] = builder.MAX_TIME
-                max_leg_time[age] = 0
-
-            if gender not in min_leg_time:
-                min_leg_time[gender] = builder.MAX_TIME
-                max_leg_time[gender] = 0
-
-            if 'overall' not in min_leg_time:
-                min_leg_time['overall'] = builder.MAX_TIME
-                max_leg_time['overall'] = 0
-
-            min_leg_time[age] = min(min_leg_time[age], leg_time)
-            min_leg_time[gender] = min(min_leg_time[gender], leg_time)
-            min_leg_time['overall'] = min(min_leg_time['overall'], leg_time)
-
-            assert leg_time >= last_leg_time, f'descending leg time: {leg_time} last: {last_leg_time} result: {race_result}'
-
-            if leg_time != builder.MAX_TIME:
-                max_leg_time[age] = max(max_leg_time[age], leg_time)
-                max_leg_time[gender] = max(max_leg_time[gender], leg_time)
-                max_leg_time['overall'] = max(
-                    max_leg_time['overall'], leg_time)
-
-                age_time_key = age + LAST_TIME
-                age_rank_key = age + LAST_RANK
-                age_equal_rank_key = age + LAST_EQUAL_RANK
-                if age_time_key not in age_rank[leg]:
-                    age_rank[leg][age_time_key] = 0
-                    age_rank[leg][age_rank_key] = 0
-                    age_rank[leg][age_equal_rank_key] = 1
-
-                gender_time_key = gender + LAST_TIME
-                gender_rank_key = gender + LAST_RANK
-                gender_equal_rank_key = gender + LAST_EQUAL_RANK
-                if gender_time_key not in gender_rank[leg]:
-                    gender_rank[leg][gender_time_key] = 0
-                    gender_rank[leg][gender_rank_key] = 0
-                    gender_rank[leg][gender_equal_rank_key] = 1
-
-                overall_time_key = 'overall' + LAST_TIME
-                overall_rank_key = 'overall' + LAST_RANK
-                overall_equal_rank_key = 'overall' + LAST_EQUAL_RANK
-                if overall_time_key not in overall_rank[leg]:
-                    overall_rank[leg][overall_time_key] = 0
-                    overall_rank[leg][overall_rank_key] = 0
-                    overall_rank[leg][overall_equal_rank_key] = 1
-
-                if leg_time > age_rank[leg][age_time_key]:
-                    age_rank[leg][age_rank_key] += age_rank[leg][age_equal_rank_key]
-                    age_rank[leg][age_time_key] = leg_time
-                    age_rank[leg][age_equal_rank_key] = 1
-                elif leg_time == age_rank[leg][age_time_key]:
-                    age_rank[leg][age_equal_rank_key] += 1
-
-                if leg_time > gender_rank[leg][gender_time_key]:
-                    gender_rank[leg][gender_rank_key] += gender_rank[leg][gender_equal_rank_key]
-                    gender_rank[leg][gender_time_key] = leg_time
-                    gender_rank[leg][gender_equal_rank_key] = 1
-                elif leg_time == gender_rank[leg][gender_time_key]:
-                    gender_rank[leg][gender_equal_rank_key] += 1
-
-                if leg_time > overall_rank[leg][overall_time_key]:
-                    overall_rank[leg][overall_rank_key] += overall_rank[leg][overall_equal_rank_key]
-                    overall_rank[leg][overall_time_key] = leg_time
-                    overall_rank[leg][overall_equal_rank_key] = 1
-                elif leg_time == overall_rank[leg][overall_time_key]:
-                    overall_rank[leg][overall_equal_rank_key] += 1
-
-                age_rank[leg][contact_id] = age_rank[leg][age_rank_key]
-                gender_rank[leg][contact_id] = gender_rank[leg][gender_rank_key]
-                overall_rank[leg][contact_id] = overall_rank[leg][overall_rank_key]
-            else:
-                age_rank[leg][contact_id] = count_by_age_group[age]
-                gender_rank[leg][contact_id] = count_by_gender[gender]
-                overall_rank[leg][contact_id] = total_count
-
-            last_leg_time = leg_time
-
-        time_age_rank[leg] = {}
-        time_gender_rank[leg] = {}
-        time_overall_rank[leg] = {}
-
-        for race_result in race_results:
-            age = result_parser.get_age_group(race_result)
-            gender = result_parser.get_gender(race_result)
-            contact_id = result_parser.get_contact_id(race_result)
-            leg_time = result_parser.get_leg_time(race_result, leg)
-            if leg_time != builder.MAX_TIME:
-                time_age_rank[leg][contact_id] = 1.
-                min_age_time = min_leg_time[age]
-                max_age_time = max_leg_time[age]
-                assert max_age_time != 0, f'invalid max_age_time: {max_age_time}'
-                if min_age_time != max_age_time:
-                    time_age_rank[leg][contact_id] += \
-                        1. * (count_by_age_group[age] - 1) * \
-                        (leg_time - min_age_time) / \
-                        (max_age_time - min_age_time)
-
-                time_gender_rank[leg][contact_id] = 1.
-                min_gender_time = min_leg_time[gender]
-                max_gender_time = max_leg_time[gender]
-                assert max_gender_time != 0, f'invalid max_gender_time: {max_gender_time}'
-                if min_gender_time != max_gender_time:
-                    time_gender_rank[leg][contact_id] += \
-                        1. * (count_by_gender[gender] - 1) * \
-                        (leg_time - min_gender_time) / \
-                        (max_gender_time - min_gender_time)
-
-                time_overall_rank[leg][contact_id] = 1.
-                min_overall_time = min_leg_time['overall']
-                max_overall_time = max_leg_time['overall']
-                assert max_overall_time != 0, f'invalid max_overall_time: {max_overall_time}'
-                if min_overall_time != max_overall_time:
-                    time_overall_rank[leg][contact_id] += \
-                        1. * (total_count - 1) * \
-                        (leg_time - min_overall_time) / \
-                        (max_overall_time - min_overall_time)
-            else:
-                time_age_rank[leg][contact_id] = count_by_age_group[age]
-                time_gender_rank[leg][contact_id] = count_by_gender[gender]
-                time_overall_rank[leg][contact_id] = total_count
-
+def get_partition_codes(values):
+    code_by_value = {}
+    codes = np.array([code_by_value.setdefault(value, len(code_by_value)) for value in values], dtype=np.int64)
+    return codes, list(code_by_value)
+
+
+def get_leg_ranks(leg_times, codes, partition_count, sizes):
+    """
+    Returns ranks and time normalized ranks of the leg times (results x legs) within partitions, results are
+    ranked among the results with a defined time: ties share the lowest rank, undefined times get the partition size.
+    """
+    defined = leg_times != builder.MAX_TIME
+    ranked = defined & (leg_times >= 0)
+    result_count = len(leg_times)
+    sizes = sizes[:, np.newaxis]
+
+    # (partition, time) keys of every leg sorted once, unranked times are moved behind every ranked time of
+    # their partition: the rank is the position of the first equal key within the partition
+    key_base = int(leg_times.max()) + 2 if leg_times.size else 1
+    keys = codes[:, np.newaxis] * key_base + np.where(ranked, leg_times, key_base - 1)
+    order = np.argsort(keys, axis=0, kind='stable')
+    sorted_keys = np.take_along_axis(keys, order, axis=0)
+    sorted_codes = codes[order]
+    positions = np.arange(result_count)[:, np.newaxis]
+    first_equal = np.maximum.accumulate(
+        np.where(np.diff(sorted_keys, axis=0, prepend=-1) != 0, positions, 0), axis=0)
+    partition_start = np.maximum.accumulate(
+        np.where(np.diff(sorted_codes, axis=0, prepend=-1) != 0, positions, 0), axis=0)
+    ranks = np.empty_like(keys)
+    np.put_along_axis(ranks, order, first_equal - partition_start + 1, axis=0)
+    ranks = np.where(leg_times > 0, ranks, 0)
+    ranks = np.where(defined, ranks, sizes)
+
+    leg_count = leg_times.shape[1]
+    min_times = np.full((partition_count, leg_count), builder.MAX_TIME, dtype=np.int64)
+    np.minimum.at(min_times, codes, leg_times)
+    max_times = np.zeros((partition_count, leg_count), dtype=np.int64)
+    np.maximum.at(max_times, codes, np.where(defined, leg_times, 0))
+    result_min_times = min_times[codes]
+    result_max_times = max_times[codes]
+    assert (result_max_times[defined] != 0).all(), f'invalid max time: {max_times}'
+
+    time_ranges = result_max_times - result_min_times
+    spread = defined & (time_ranges != 0)
+    time_ranks = np.ones(leg_times.shape)
+    time_ranks[spread] += \
+        np.broadcast_to(sizes - 1., leg_times.shape)[spread] * \
+        (leg_times[spread] - result_min_times[spread]) / time_ranges[spread]
+
+    # undefined times keep the integer partition size as their time rank
+    time_ranks = time_ranks.astype(object)
+    time_ranks[~defined] = np.broadcast_to(sizes, leg_times.shape)[~defined].astype(object)
+    return ranks, time_ranks
+
+
+def get_group_counts(records):
+    count_by_age_group = {}
+    count_by_gender = {}
+    for record in records:
+        count_by_age_group[record.age_group] = count_by_age_group.get(record.age_group, 0) + 1
+        count_by_gender[record.gender] = count_by_gender.get(record.gender, 0) + 1
+    return count_by_age_group, count_by_gender
+
+
+def get_ranks_by_legs(records, count_by_age_group, count_by_gender):
+    """
+    Returns age, gender and overall ranks and their time normalized versions of every leg as
+    {leg: [rank of records[i]]}.
+    """
+    total_count = len(records)
+    age_codes, age_groups = get_partition_codes([record.age_group for record in records])
+    gender_codes, genders = get_partition_codes([record.gender for record in records])
+    overall_codes = np.zeros(total_count, dtype=np.int64)
+
+    leg_times = np.array(
+        [record.times for record in records], dtype=np.int64).reshape(total_count, len(constants.LEG_NAMES))
+
+    rank_lists = []
+    time_rank_lists = []
+    for codes, sizes in [
+        (age_codes, [count_by_age_group[age] for age in age_groups]),
+        (gender_codes, [count_by_gender[gender] for gender in genders]),
+        (overall_codes, [total_count]),
+    ]:
+        ranks, time_ranks = get_leg_ranks(leg_times, codes, len(sizes), np.array(sizes, dtype=np.int64)[codes])
+        rank_lists.append(dict(zip(constants.LEG_NAMES, ranks.T.tolist())))
+        time_rank_lists.append(dict(zip(constants.LEG_NAMES, time_ranks.T.tolist())))
+
+    age_rank, gender_rank, overall_rank = rank_lists
+    time_age_rank, time_gender_rank, time_overall_rank = time_rank_lists
     return age_rank, gender_rank, overall_rank, time_age_rank, time_gender_rank, time_overall_rank
 
 
-def filter_result_duplicates(race_results):
+def load_records(mongo_client, subevent_id):
+    race_results_storage = DataStorage(mongo_client=mongo_client, db_name='ironman', collection_name=subevent_id)
+    # raw results are converted while streaming: only the projected fields of one batch are held as dicts
+    return [
+        result_record.from_result(race_result)
+        for race_result in race_results_storage.find(projection=result_record.PROJECTION, batch_size=RESULTS_BATCH_SIZE)
+    ]
+
+
+def filter_result_duplicates(records):
     last_contact_id = ''
-    filtered_race_results = []
-    for race_result in sorted(race_results, key=lambda result: (result['ContactId'], -result['FinishTime'])):
-        contact_id = result_parser.get_contact_id(race_result)
-        if contact_id == last_contact_id:
+    filtered_records = []
+    for record in sorted(records, key=lambda record: (record.contact_id, -record.finish_time)):
+        if record.contact_id == last_contact_id:
             logger.debug(
-                f'filter duplicated result {race_result}')
+                f'filter duplicated result {record.contact_id} {record.athlete_name}')
         else:
-            filtered_race_results.append(race_result)
+            filtered_records.append(record)
 
-        last_contact_id = contact_id
+        last_contact_id = record.contact_id
 
-    duplicates_filtered = len(race_results) - len(filtered_race_results)
+    duplicates_filtered = len(records) - len(filtered_records)
     logger.debug(f'filtered {duplicates_filtered} result duplicates')
-    return filtered_race_results
+    return filtered_records
 
 
-def fix_undefined_times(race_results):
-    for race_result in race_results:
-        logger.debug(race_result)
-        athlete_name = result_parser.get_athlete_name(race_result)
-
-        for leg in constants.LEG_NAMES:
-            leg_finish_time = int(result_parser.get_leg_time(race_result, leg))
+def fix_undefined_times(records):
+    for record in records:
+        for leg_index, leg in enumerate(constants.LEG_NAMES):
+            leg_finish_time = int(record.times[leg_index])
 
             set_finish_time_as_max = False
             if leg == constants.FINISH_LEG:
-                finish_status = result_parser.get_finish_status(race_result)
-                set_finish_time_as_max = finish_status != constants.EVENT_STATUS_FINISH
+                set_finish_time_as_max = record.get_finish_status() != constants.EVENT_STATUS_FINISH
 
             if set_finish_time_as_max or \
                     leg_finish_time <= 0 or \
                     leg_finish_time > builder.MAX_TIME:
-                leg_field = f'{leg}Time'
                 logger.debug(
-                    f'Fix athlete: {athlete_name} leg: {leg_field} '
-                    f'from {leg_finish_time} to {builder.MAX_TIME}: {race_result}')
-                race_result[leg_field] = builder.MAX_TIME
-    return race_results
+                    f'Fix athlete: {record.athlete_name} leg: {leg}Time '
+                    f'from {leg_finish_time} to {builder.MAX_TIME}')
+                record.times[leg_index] = builder.MAX_TIME
+    return records
+
+
+def transform_race(mongo_client, triscore_storage, race, dry_run, progress=''):
+    """
+    Returns (status, result count). The race results are written by RaceStorage.add_race which removes
+    the partially written race on failure. A processed race is transformed again only when the content hash
+    recorded by the loader differs from the hash of the written race, then RaceStorage.update_race switches
+    the race to the new results. A race written before but not processed is completed the same way, never removed first.
+    """
+    race_series = race_parser.get_series(race)
+    race_date = race_parser.get_date(race)
+    content_hash = race.get(DataStorage.CONTENT_HASH_FIELD)
+
+    update_existing = False
+    if triscore_storage.race_processed(race_series, race_date):
+        if content_hash is None or content_hash == triscore_storage.get_content_hash(race_series, race_date):
+            logger.info(f'skip processed race {race_series} {race_date}')
+            return RACE_SKIPPED, 0
+        logger.info(f'results changed for race {race_series} {race_date}')
+        update_existing = True
+
+    subevent_id = race_parser.get_subevent_id(race)
+
+    logger.info(
+        f'{progress} process race series: {race_series} date: {race_date} id: {subevent_id}')
+
+    race_results = load_records(mongo_client, subevent_id)
+    race_results = filter_result_duplicates(race_results)
+    race_results = fix_undefined_times(race_results)
+
+    if not update_existing and triscore_storage.has_race(name=race_series, date=race_date):
+        race_written_length = triscore_storage.get_race_length(name=race_series, date=race_date)
+        race_new_length = len(race_results)
+
+        # the race is rewritten in place: the written results stay readable until the new ones replace them
+        logger.warning(
+            f'rewrite unprocessed race'
+            f' race series: {race_series}'
+            f' date: {race_date}'
+            f' race_written_length: {race_written_length}'
+            f' race_new_length: {race_new_length}')
+        update_existing = True
+
+    # Race info
+    location_info = get_location_info(race)
+    distance_info = get_distance_info(race)
+    race_stats = get_stats(race_results)
+
+    race_info = builder.build_race_info(
+        name=race_series,
+        date=race_date,
+        brand=constants.IRONMAN_BRAND,
+        tri_type=race_parser.get_tri_type(race),
+        location_info=location_info,
+        distance_info=distance_info,
+        stats=race_stats)
+    if content_hash is not None:
+        race_info[CONTENT_HASH_FIELD] = content_hash
+    logger.debug(f'info: {race_info}')
+
+
+    # Rank by leg
+    count_by_age_group, count_by_gender = get_group_counts(race_results)
+    age_rank, gender_rank, overall_rank, time_age_rank, time_gender_rank, time_overall_rank = \
+        get_ranks_by_legs(
+            race_results, count_by_age_group, count_by_gender)
+
+    def get_legs(record, index):
+        legs = {}
+        for leg_index, ironman_leg_name in enumerate(constants.LEG_NAMES):
+            triscore_leg_name = LEG_IRONMAN_TO_TRISCORE[ironman_leg_name]
+            legs[triscore_leg_name] = builder.build_leg(
+                time=record.times[leg_index],
+                age_rank=age_rank[ironman_leg_name][index],
+                gender_rank=gender_rank[ironman_leg_name][index],
+                overall_rank=overall_rank[ironman_leg_name][index],
+                time_age_rank=time_age_rank[ironman_leg_name][index],
+                time_gender_rank=time_gender_rank[ironman_leg_name][index],
+                time_overall_rank=time_overall_rank[ironman_leg_name][index],
+            )
+        return legs
+
+    # Construct athlete results
+    athlete_results = []
+    last_finish_time = 0
+    last_finish_rank = 0
+    # finish time first, then the leg times in race order
+    sort_order = [result_record.FINISH_INDEX] + [
+        leg_index for leg_index in range(len(constants.LEG_NAMES)) if leg_index != result_record.FINISH_INDEX]
+    for i, (result_index, result) in enumerate(
+        sorted(enumerate(race_results),
+               key=lambda item: [item[1].times[leg_index] for leg_index in sort_order])):
+        athlete_id = result.contact_id
+        athlete_name = result.athlete_name
+        country_iso_num = result.country_iso_num
+        bib = result.bib
+        age_group = result.age_group
+        age_group_size = count_by_age_group[age_group]
+        gender = result.gender
+        gender_size = count_by_gender[gender]
+        overall_size = len(race_results)
+        finish_status = result.get_finish_status(log=True)
+        status = IRONMAN_EVENT_STATUS_TO_TRISCORE[finish_status]
+
+        legs = get_legs(result, result_index)
+        finish_time = legs[builder.FINISH_LEG]['t']
+        finish_rank = legs[builder.FINISH_LEG]['or']
+
+        assert finish_time >= last_finish_time, \
+            f'descending finish time: {finish_time} last: {last_finish_time}\nathlete: {athlete_result}'
+
+        assert finish_rank >= last_finish_rank, \
+            f'descending finish rank: {finish_rank} last: {last_finish_rank}\nathlete: {athlete_result}'
+
+        athlete_result = builder.build_athlete_result(
+            athlete_id=athlete_id,
+            athlete_name=athlete_name,
+            country_iso_num=country_iso_num,
+            bib=bib,
+            age_group=age_group,
+            age_group_size=age_group_size,
+            gender=gender,
+            gender_size=gender_size,
+            overall_size=overall_size,
+            status=status,
+            legs=legs)
+        logger.debug(f'result: {athlete_result}')
+        athlete_results.append(athlete_result)
+
+        last_finish_time = finish_time
+        last_finish_rank = finish_rank
+
+    if dry_run:
+        logger.info(
+            f'DRY_RUN: skip adding race: {race_info} results: {len(athlete_results)}')
+        return RACE_DRY_RUN, len(athlete_results)
+
+    if update_existing:
+        changed_count = triscore_storage.update_race(race_info, athlete_results)
+        logger.info(f'race {race_series} {race_date}: {changed_count} of {len(athlete_results)} results changed')
+        return RACE_UPDATED, len(athlete_results)
+
+    assert triscore_storage.add_race(
+        race_info, athlete_results), f'failed to add race: {race_info}'
+    return RACE_ADDED, len(athlete_results)
 
 
 def transform_ironman_to_triscore(mongo_client, limit, dry_run):
@@ -285,150 +377,88 @@ def transform_ironman_to_triscore(mongo_client, limit, dry_run):
     logger.info(f'{count} new races found')
 
     max_count = -1
+    changed_count = 0
     for i, race in enumerate(ironman_races):
         if i == max_count:
             logger.info(f'stopping by max count: {max_count}')
             break
 
-        race_series = race_parser.get_series(race)
-        race_date = race_parser.get_date(race)
+        status, _ = transform_race(mongo_client, triscore_storage, race, dry_run, progress=f'{i + 1}/{count}')
+        changed_count += status in [RACE_ADDED, RACE_UPDATED]
 
-        if triscore_storage.race_processed(race_series, race_date):
-            logger.info(f'skip processed race {race_series} {race_date}')
-            continue
+    if changed_count > 0:
+        triscore_storage.refresh_counts(CountCache(mongo_client))
+        DataGeneration(mongo_client).bump(source='transformer')
 
-        subevent_id = race_parser.get_subevent_id(race)
 
-        logger.info(
-            f'{i + 1}/{count} process race series: {race_series} date: {race_date} id: {subevent_id}')
-
-        race_results_storage = DataStorage(mongo_client=mongo_client, db_name='ironman', collection_name=subevent_id)
-        race_results = list(race_results_storage.find())
-        race_results = filter_result_duplicates(race_results)
-        race_results = fix_undefined_times(race_results)
-
-        if triscore_storage.has_race(name=race_series, date=race_date):
-            race_written_length = triscore_storage.get_race_length(name=race_series, date=race_date)
-            race_new_length = len(race_results)
-
-            logger.warning(
-                f'drop existing collection for'
-                f' race series: {race_series}'
-                f' date: {race_date}'
-                f' race_written_length: {race_written_length}'
-                f' race_new_length: {race_new_length}')
-            triscore_storage.remove_race(name=race_series, date=race_date)
-
-        # Race info
-        location_info = get_location_info(race)
-        distance_info = get_distance_info(race)
-        race_stats = get_stats(race_results)
-
-        race_info = builder.build_race_info(
-            name=race_series,
-            date=race_date,
-            brand=constants.IRONMAN_BRAND,
-            tri_type=race_parser.get_tri_type(race),
-            location_info=location_info,
-            distance_info=distance_info,
-            stats=race_stats)
-        logger.debug(f'info: {race_info}')
-
-
-        # Rank by leg
-        count_by_age_group = {}
-        for race_result in race_results:
-            age_group = result_parser.get_age_group(race_result)
-            if age_group not in count_by_age_group:
-                count_by_age_group[age_group] = 0
-            count_by_age_group[age_group] += 1
-
-        count_by_gender = {}
-        for race_result in race_results:
-            gender = result_parser.get_gender(race_result)
-            if gender not in count_by_gender:
-                count_by_gender[gender] = 0
-            count_by_gender[gender] += 1
-
-        age_rank, gender_rank, overall_rank, time_age_rank, time_gender_rank, time_overall_rank = \
-            get_ranks_by_legs(
-                race_results, count_by_age_group, count_by_gender)
-
-        def get_legs(race_result):
-            legs = {}
-            for ironman_leg_name in constants.LEG_NAMES:
-                triscore_leg_name = LEG_IRONMAN_TO_TRISCORE[ironman_leg_name]
-                contact_id = result_parser.get_contact_id(race_result)
-                legs[triscore_leg_name] = builder.build_leg(
-                    time=result_parser.get_leg_time(race_result, ironman_leg_name),
-                    age_rank=age_rank[ironman_leg_name][contact_id],
-                    gender_rank=gender_rank[ironman_leg_name][contact_id],
-                    overall_rank=overall_rank[ironman_leg_name][contact_id],
-                    time_age_rank=time_age_rank[ironman_leg_name][contact_id],
-                    time_gender_rank=time_gender_rank[ironman_leg_name][contact_id],
-                    time_overall_rank=time_overall_rank[ironman_leg_name][contact_id],
-                )
-            return legs
-
-        # Construct athlete results
-        athlete_results = []
-        last_finish_time = 0
-        last_finish_rank = 0
-        for i, result in enumerate(
-            sorted(race_results,
-                   key=lambda result: (
-                       result['FinishTime'],
-                       result['SwimTime'],
-                       result['Transition1Time'],
-                       result['BikeTime'],
-                       result['Transition2Time'],
-                       result['RunTime']))):
-            athlete_id = result_parser.get_contact_id(result)
-            athlete_name = result_parser.get_athlete_name(result)
-            country_iso_num = result_parser.get_country_representing_iso_numeric(result)
-            bib = result_parser.get_bib_number(result)
-            age_group = result_parser.get_age_group(result)
-            age_group_size = count_by_age_group[age_group]
-            gender = result_parser.get_gender(result)
-            gender_size = count_by_gender[gender]
-            overall_size = len(race_results)
-            finish_status = result_parser.get_finish_status(result, log=True)
-            status = IRONMAN_EVENT_STATUS_TO_TRISCORE[finish_status]
-
-            legs = get_legs(result)
-            finish_time = legs[builder.FINISH_LEG]['t']
-            finish_rank = legs[builder.FINISH_LEG]['or']
-
-            assert finish_time >= last_finish_time, \
-                f'descending finish time: {finish_time} last: {last_finish_time}\nresult: {result}\nathlete: {athlete_result}'
-
-            assert finish_rank >= last_finish_rank, \
-                f'descending finish rank: {finish_rank} last: {last_finish_rank}\nresult: {result}\nathlete: {athlete_result}'
-
-            athlete_result = builder.build_athlete_result(
-                athlete_id=athlete_id,
-                athlete_name=athlete_name,
-                country_iso_num=country_iso_num,
-                bib=bib,
-                age_group=age_group,
-                age_group_size=age_group_size,
-                gender=gender,
-                gender_size=gender_size,
-                overall_size=overall_size,
-                status=status,
-                legs=legs)
-            logger.debug(f'result: {athlete_result}')
-            athlete_results.append(athlete_result)
-
-            last_finish_time = finish_time
-            last_finish_rank = finish_rank
-
-        if dry_run:
+worker_state = {}
+
+
+def init_worker(username, password, auth_source):
+    # mongo clients are not fork safe: every worker process connects on its own
+    mongo_client = MongoClient(username=username, password=password, authSource=auth_source)
+    worker_state['mongo_client'] = mongo_client
+    worker_state['triscore_storage'] = RaceStorage(mongo_client=mongo_client, db_name='triscore')
+
+
+def transform_shard(races, dry_run):
+    return [
+        (race_parser.get_subevent_id(race),) + transform_race(
+            worker_state['mongo_client'], worker_state['triscore_storage'], race, dry_run)
+        for race in races
+    ]
+
+
+def get_shards(races, shard_size=SHARD_SIZE):
+    """
+    Splits races into shards of about shard_size races, races of the same series and date are kept in one shard
+    since they replace each other in the triscore storage.
+    """
+    races_by_key = {}
+    for race in races:
+        races_by_key.setdefault((race_parser.get_series(race), race_parser.get_date(race)), []).append(race)
+
+    shards = [[]]
+    for key_races in races_by_key.values():
+        if len(shards[-1]) >= shard_size:
+            shards.append([])
+        shards[-1].extend(key_races)
+    return [shard for shard in shards if shard]
+
+
+def transform_ironman_to_triscore_parallel(mongo_client, credentials, limit, dry_run, workers):
+    ironman_races_storage = DataStorage(mongo_client=mongo_client, db_name='ironman', collection_name='races')
+    RaceStorage(mongo_client=mongo_client, db_name='triscore', create_indices=True)
+
+    races = list(ironman_races_storage.find(
+        where={DataStorage.INVALID_FIELD: False, DataStorage.PROCESSED_FIELD: True},
+        sort=[('Date', 1)],
+        limit=limit))
+    count = len(races)
+    logger.info(f'{count} new races found workers: {workers}')
+
+    start = time.perf_counter()
+    done_count = 0
+    changed_count = 0
+    result_count = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=credentials) as executor:
+        futures = [executor.submit(transform_shard, shard, dry_run) for shard in get_shards(races)]
+        for future in as_completed(futures):
+            for subevent_id, status, race_result_count in future.result():
+                logger.debug(f'race {subevent_id}: {status} results: {race_result_count}')
+                done_count += 1
+                changed_count += status in [RACE_ADDED, RACE_UPDATED]
+                result_count += race_result_count
+
+            elapsed_sec = time.perf_counter() - start
             logger.info(
-                f'DRY_RUN: skip adding race: {race_info} results: {len(athlete_results)}')
-        else:
-            assert triscore_storage.add_race(
-                race_info, athlete_results), f'failed to add race: {race_info}'
+                f'{done_count}/{count} races changed: {changed_count}'
+                f' {done_count / elapsed_sec:.2f} races/s {result_count / elapsed_sec:.0f} results/s')
+
+    if changed_count > 0:
+        triscore_storage = RaceStorage(mongo_client=mongo_client, db_name='triscore')
+        triscore_storage.refresh_counts(CountCache(mongo_client))
+        DataGeneration(mongo_client).bump(source='transformer')
 
 
 def main():
@@ -439,12 +469,17 @@ def main():
     parser.add_argument('-l', '--limit', type=int, default=0)
     parser.add_argument('-t', '--timeout', type=int, default=None)
     parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--workers', type=int, default=0, help='transform races in worker processes')
     args = parser.parse_args()
 
     mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
 
     while True:
-        transform_ironman_to_triscore(mongo_client, args.limit, args.dry_run)
+        if args.workers > 0:
+            transform_ironman_to_triscore_parallel(
+                mongo_client, (args.username, args.password, args.database), args.limit, args.dry_run, args.workers)
+        else:
+            transform_ironman_to_triscore(mongo_client, args.limit, args.dry_run)
         if not dt.wait(args.timeout):
             break
 
@@ -1,9 +1,10 @@
+import hashlib
 import json
 from pathlib import Path
 from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
 
 from base import log, http
-from time import sleep
 
 logger = log.setup_logger(__file__, debug=False)
 
@@ -24,6 +25,10 @@ class DataStorage:
     DATA_FIELD = 'data'
     PROCESSED_FIELD = 'Processed'
     INVALID_FIELD = 'Invalid'
+    CONTENT_HASH_FIELD = 'ContentHash'
+    DUPLICATE_KEY_ERROR = 11000
+    EXISTS_BATCH_SIZE = 1000
+    INSERT_BATCH_SIZE = 1000
 
     def __init__(self, mongo_client, db_name, collection_name, indices=[]):
         self.cache_dir = Path(SCRIPT_DIR, self.CACHE_NAME, db_name, collection_name)
@@ -37,6 +42,19 @@ class DataStorage:
     def find_one(self, where={}, projection=None, sort=None):
         return self.data_collection.find_one(where, projection=projection, sort=sort)
 
+    def get_content_hash(self, projection, batch_size=1000):
+        """
+        Returns a hash of the documents projected on the fields, independent of the order of documents and fields.
+        """
+        rows = sorted(
+            json.dumps(doc, sort_keys=True, default=str)
+            for doc in self.find(projection=projection, batch_size=batch_size))
+        content_hash = hashlib.sha256()
+        for row in rows:
+            content_hash.update(row.encode('utf-8'))
+            content_hash.update(b'\n')
+        return content_hash.hexdigest()
+
     def update_one(self, where, field, value):
         return self.data_collection.update_one(
             where,
@@ -60,17 +78,19 @@ class DataStorage:
                list_filter=empty_filter,
                data_url_field=None,
                data_url_transformer=None,
+               data_headers=None,
                add_invalid=False,
                dry_run=True,
                limit=-1,
                skip_empty_data=True,
-               data_load_timeout=0):
+               fetcher=None):
 
         cached_list = http.CachedUrl(
             url=list_url,
             headers=list_headers,
             cache_dir=self.cache_dir,
-            timeout=list_update_frequency_sec)
+            timeout=list_update_frequency_sec,
+            fetcher=fetcher)
 
         list_data = cached_list.get()
         list_json = list_transformer(json.loads(list_data))
@@ -87,35 +107,35 @@ class DataStorage:
             indices = [(id_field, DESCENDING) for id_field in id_fields]
             self.data_collection.create_index(indices)
 
+        candidate_items = []
         for i, item in enumerate(list_json):
             if i == limit:
                 logger.info(f'stop by count limit: {limit}')
                 break
 
-            id_map = {id_field: item[id_field] for id_field in id_fields}
-            logger.debug(f'{i + 1}/{list_length} {id_map}')
+            logger.debug(f'{i + 1}/{list_length} {self._get_key(id_fields, item)}')
 
             if list_filter(item):
                 logger.debug(f'filter item')
                 continue
 
-            if self.data_collection.find_one(id_map):
-                logger.debug(f'skip existing item')
+            candidate_items.append(item)
+
+        seen_keys = self._get_existing_keys(id_fields, candidate_items)
+        new_items = []
+        for item in candidate_items:
+            key = self._get_key(id_fields, item)
+            if key in seen_keys:
+                logger.debug(f'skip existing item {key}')
                 continue
+            seen_keys.add(key)
+            new_items.append(item)
 
-            if data_url_transformer:
-                data_url = data_url_transformer(item)
-                data_json = http.get_json(data_url)
-                # logger.info(f'data_json: {data_json}')
-                data_to_insert = data_json[data_url_field] if data_url_field else data_json
-                if skip_empty_data and len(data_to_insert) == 0:
-                    logger.debug(f'skip empty data url: {data_url}')
-                    continue
-                item[self.DATA_FIELD] = data_to_insert
-                item[self.URL_FIELD] = data_url
-                if data_load_timeout > 0:
-                    sleep(data_load_timeout)
+        if data_url_transformer:
+            new_items = self._load_data(
+                new_items, data_url_field, data_url_transformer, data_headers, skip_empty_data, fetcher)
 
+        for item in new_items:
             item[self.PROCESSED_FIELD] = False
 
             if add_invalid:
@@ -123,8 +143,61 @@ class DataStorage:
 
             if dry_run:
                 logger.info(f'DRY RUN: item {item} inserted')
-            else:
-                insert_result = self.data_collection.insert_one(item)
-                inserted_ids.append(str(insert_result.inserted_id))
+
+        if not dry_run:
+            for start in range(0, len(new_items), self.INSERT_BATCH_SIZE):
+                inserted_ids += self._insert_items(new_items[start:start + self.INSERT_BATCH_SIZE])
 
         return inserted_ids
+
+    @staticmethod
+    def _get_key(id_fields, item):
+        return tuple(item[id_field] for id_field in id_fields)
+
+    def _get_existing_keys(self, id_fields, items):
+        existing_keys = set()
+        projection = {id_field: 1 for id_field in id_fields}
+        projection['_id'] = 0
+        for start in range(0, len(items), self.EXISTS_BATCH_SIZE):
+            batch = items[start:start + self.EXISTS_BATCH_SIZE]
+            if len(id_fields) == 1:
+                where = {id_fields[0]: {'$in': [item[id_fields[0]] for item in batch]}}
+            else:
+                where = {'$or': [{id_field: item[id_field] for id_field in id_fields} for item in batch]}
+            for doc in self.data_collection.find(where, projection=projection):
+                existing_keys.add(self._get_key(id_fields, doc))
+        return existing_keys
+
+    def _insert_items(self, items):
+        if len(items) == 0:
+            return []
+
+        failed_indices = set()
+        try:
+            self.data_collection.insert_many(items, ordered=False)
+        except BulkWriteError as error:
+            # a concurrent loader inserted some of the items first
+            if any(write_error['code'] != self.DUPLICATE_KEY_ERROR for write_error in error.details['writeErrors']):
+                raise
+            failed_indices = set(write_error['index'] for write_error in error.details['writeErrors'])
+            logger.debug(f'skip {len(failed_indices)} items inserted concurrently')
+        # insert_many sets the _id of the items before sending them
+        return [str(item['_id']) for i, item in enumerate(items) if i not in failed_indices]
+
+    def _load_data(self, items, data_url_field, data_url_transformer, data_headers, skip_empty_data, fetcher):
+        data_urls = [data_url_transformer(item) for item in items]
+        if fetcher:
+            data_jsons = fetcher.map_json(data_urls, data_headers)
+        else:
+            data_jsons = (http.get_json(data_url, data_headers) for data_url in data_urls)
+
+        loaded_items = []
+        for item, data_url, data_json in zip(items, data_urls, data_jsons):
+            data_to_insert = data_json[data_url_field] if data_url_field else data_json
+            if skip_empty_data and len(data_to_insert) == 0:
+                logger.debug(f'skip empty data url: {data_url}')
+                continue
+            item[self.DATA_FIELD] = data_to_insert
+            item[self.URL_FIELD] = data_url
+            loaded_items.append(item)
+        return loaded_items
@@ -0,0 +1,92 @@
+from data.storage import DataStorage
+from pymongo.errors import BulkWriteError
+import itertools
+import json
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.status_code = 200
+        self.text = text
+        self.headers = {}
+
+
+class FakeFetcher:
+    def __init__(self, items):
+        self.items = items
+
+    def get_response(self, url, headers=None):
+        return FakeResponse(json.dumps(self.items))
+
+
+class FakeCursor(list):
+    def skip(self, skip):
+        return self
+
+    def limit(self, limit):
+        return self
+
+
+class FakeCollection:
+    def __init__(self, docs=[], concurrent_ids=[]):
+        self.docs = list(docs)
+        self.concurrent_ids = concurrent_ids
+        self.find_calls = 0
+        self.object_ids = itertools.count()
+
+    def create_index(self, index, unique=False):
+        pass
+
+    def find(self, where, projection=None, sort=None, batch_size=None):
+        self.find_calls += 1
+        if not where:
+            return FakeCursor([dict(doc) for doc in self.docs])
+        if '$or' in where:
+            return [doc for doc in self.docs if any(all(doc[k] == v for k, v in w.items()) for w in where['$or'])]
+        field, condition = next(iter(where.items()))
+        return [doc for doc in self.docs if doc[field] in condition['$in']]
+
+    def insert_many(self, items, ordered=True):
+        write_errors = []
+        for i, item in enumerate(items):
+            item['_id'] = next(self.object_ids)
+            if item['id'] in self.concurrent_ids:
+                write_errors.append({'index': i, 'code': 11000})
+            else:
+                self.docs.append(item)
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors})
+
+
+def make_storage(collection, tmp_path):
+    storage = DataStorage({'db': {'items': collection}}, db_name='db', collection_name='items')
+    storage.cache_dir = tmp_path
+    return storage
+
+
+class TestUpdate:
+    def test_skip_existing_and_duplicates(self, tmp_path):
+        collection = FakeCollection(docs=[{'id': 1}, {'id': 3}])
+        storage = make_storage(collection, tmp_path)
+        items = [{'id': i} for i in [1, 2, 3, 4, 4]]
+        inserted_ids = storage.update(id_fields=['id'], list_url='http://a/list', dry_run=False, fetcher=FakeFetcher(items))
+        assert len(inserted_ids) == 2
+        assert sorted(doc['id'] for doc in collection.docs) == [1, 2, 3, 4]
+        assert collection.find_calls == 1
+
+    def test_tolerate_concurrent_inserts(self, tmp_path):
+        collection = FakeCollection(concurrent_ids=[2])
+        storage = make_storage(collection, tmp_path)
+        items = [{'id': i, 'd': 'x'} for i in [1, 2, 3]]
+        inserted_ids = storage.update(
+            id_fields=['id', 'd'], list_url='http://a/list', dry_run=False, fetcher=FakeFetcher(items))
+        assert inserted_ids == ['0', '2']
+
+
+class TestContentHash:
+    def test_order_independent(self, tmp_path):
+        storage = make_storage(FakeCollection(docs=[{'id': 1, 't': 10}, {'id': 2, 't': 20}]), tmp_path)
+        reordered_storage = make_storage(FakeCollection(docs=[{'t': 20, 'id': 2}, {'t': 10, 'id': 1}]), tmp_path)
+        changed_storage = make_storage(FakeCollection(docs=[{'id': 1, 't': 10}, {'id': 2, 't': 21}]), tmp_path)
+        assert storage.get_content_hash(projection=None) == reordered_storage.get_content_hash(projection=None)
+        assert storage.get_content_hash(projection=None) != changed_storage.get_content_hash(projection=None)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import argparse
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from base import log
+from base.generation import DataGeneration
+from race.storage import RaceStorage, get_layout, get_results_id, set_layout, ID_FIELD, RACE_ID_FIELD, RESULTS_ID_FIELD, \
+    RACE_RESULTS_COLLECTION, LAYOUT_COLLECTIONS, LAYOUT_SINGLE
+
+
+logger = log.setup_logger(__file__)
+
+DUPLICATE_KEY_ERROR = 11000
+BATCH_SIZE = 10000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Copies the results of every race collection into the race_results collection and switches '
+                    'the race storage layout. Races added while copying are copied too, but a transformer started '
+                    'before the switch keeps writing race collections: stop the transformers during the migration')
+
+    parser.add_argument('-d', '--database', default='triscore')
+    parser.add_argument('-u', '--username', default='triscore-writer')
+    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--drop-source', action='store_true',
+                        help='drop the race collections copied by a previous run, once the readers switched the layout')
+    parser.add_argument('--rollback', action='store_true', help='switch back to the race collections layout')
+
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
+    db = mongo_client[args.database]
+
+    if args.rollback:
+        set_layout(db, LAYOUT_COLLECTIONS)
+        DataGeneration(mongo_client).bump(source='migrate_results')
+        logger.info(f'layout: {LAYOUT_COLLECTIONS}')
+        return
+
+    if args.drop_source:
+        # readers still on the race collections layout would serve empty results
+        if get_layout(db) != LAYOUT_SINGLE:
+            parser.error('--drop-source requires the results to be migrated by a previous run')
+        drop_race_collections(db)
+        return
+
+    if get_layout(db) == LAYOUT_SINGLE:
+        logger.info('race results are already migrated')
+        return
+
+    # the single layout storage creates the race_results indices, readers keep the current layout until the switch
+    race_storage = RaceStorage(mongo_client=mongo_client, db_name=args.database, create_indices=True, layout=LAYOUT_SINGLE)
+    migrated_ids = set()
+    # races added by a loader while copying are picked up by the next scan
+    while migrate_races(db, race_storage, migrated_ids, args.batch_size) > 0:
+        pass
+
+    set_layout(db, LAYOUT_SINGLE)
+    # the api reads the layout again on the new data generation
+    DataGeneration(mongo_client).bump(source='migrate_results')
+    logger.info(f'layout: {LAYOUT_SINGLE}')
+
+    # races added between the last scan and the switch
+    migrate_races(db, race_storage, migrated_ids, args.batch_size)
+
+
+def migrate_races(db, race_storage, migrated_ids, batch_size):
+    """
+    Copies the races missing in migrated_ids and adds them to it. Returns the number of copied races.
+    """
+    race_ids = [
+        get_results_id(race_meta)
+        for race_meta in race_storage.races_meta.find({}, projection={ID_FIELD: 1, RESULTS_ID_FIELD: 1})]
+    race_ids = [race_id for race_id in race_ids if race_id not in migrated_ids]
+    collection_names = set(db.list_collection_names())
+
+    for i, race_id in enumerate(race_ids):
+        migrated_ids.add(race_id)
+        if race_id not in collection_names:
+            logger.warning(f'no results collection for race: {race_id}')
+            continue
+        copied_count = migrate_race(db[race_id], race_storage.race_results, ObjectId(race_id), batch_size)
+        logger.info(f'{i + 1}/{len(race_ids)} race: {race_id} results: {copied_count}')
+    return len(race_ids)
+
+
+def drop_race_collections(db):
+    """
+    Drops the race collections whose results are all in race_results. Returns the number of dropped collections.
+    """
+    race_results = db[RACE_RESULTS_COLLECTION]
+    collection_names = set(db.list_collection_names())
+    dropped_count = 0
+    for race_meta in db['meta'].find({}, projection={ID_FIELD: 1, RESULTS_ID_FIELD: 1}):
+        race_id = get_results_id(race_meta)
+        if race_id not in collection_names:
+            continue
+        source_count = db[race_id].count_documents({})
+        copied_count = race_results.count_documents({RACE_ID_FIELD: ObjectId(race_id)})
+        if copied_count != source_count:
+            logger.warning(f'keep race: {race_id} copied {copied_count} of {source_count} results')
+            continue
+        db[race_id].drop()
+        dropped_count += 1
+    logger.info(f'dropped {dropped_count} race collections')
+    return dropped_count
+
+
+def migrate_race(race_collection, race_results, race_id, batch_size):
+    """
+    Copies the results of one race, a rerun after a partial migration skips the results copied before.
+    Returns the number of results of the race in race_results.
+    """
+    results = []
+    for result in race_collection.find({}, projection={ID_FIELD: 0}, batch_size=batch_size):
+        result[RACE_ID_FIELD] = race_id
+        results.append(result)
+        if len(results) >= batch_size:
+            insert_batch(race_results, results)
+            results = []
+    insert_batch(race_results, results)
+
+    source_count = race_collection.count_documents({})
+    copied_count = race_results.count_documents({RACE_ID_FIELD: race_id})
+    assert copied_count == source_count, f'race {race_id}: copied {copied_count} of {source_count} results'
+    return copied_count
+
+
+def insert_batch(race_results, results):
+    if len(results) == 0:
+        return
+
+    try:
+        race_results.insert_many(results, ordered=False)
+    except BulkWriteError as error:
+        # results already copied violate the unique (race_id, id) index
+        if any(write_error['code'] != DUPLICATE_KEY_ERROR for write_error in error.details['writeErrors']):
+            raise
+
+
+if __name__ == '__main__':
+    main()
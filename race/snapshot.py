@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import numpy as np
+from pymongo import MongoClient
+
+from base import log
+import race.builder as race_builder
+import race.parser as race_parser
+from race.storage import RaceStorage, PROCESSED_FIELD, CONTENT_HASH_FIELD
+
+
+logger = log.setup_logger(__file__)
+
+META_FILE = 'meta.json'
+OFFSETS_FILE = 'offsets.npy'
+LEGS_FILE = 'legs.npy'
+COLUMN_EXTENSION = '.npy'
+FIELD_SEPARATOR = '.'
+
+COLUMN_INT = 'int'
+COLUMN_FLOAT = 'float'
+COLUMN_CODED = 'coded'
+# null of int columns, float columns use nan
+INT_NULL = np.iinfo(np.int64).min
+# marks the int values of a float column, time ranks are rounded ints or floats
+INT_MASK_SUFFIX = '.int'
+
+# result fields read by the scorer with their preferred column type, other fields are not exported
+RESULT_COLUMNS = [
+    ('id', COLUMN_CODED), ('n', COLUMN_CODED), ('c', COLUMN_CODED), ('b', COLUMN_CODED), ('st', COLUMN_CODED),
+    ('t', COLUMN_INT), ('a', COLUMN_CODED), ('as', COLUMN_INT), ('ar', COLUMN_INT),
+    ('g', COLUMN_CODED), ('gs', COLUMN_INT), ('gr', COLUMN_INT), ('tgr', COLUMN_FLOAT),
+    ('os', COLUMN_INT), ('or', COLUMN_INT), ('tor', COLUMN_FLOAT),
+]
+# legs are copied into the athlete history, a bit of the legs mask is set for every leg of the result
+LEGS = [race_builder.SWIM_LEG, race_builder.T1_LEG, race_builder.BIKE_LEG, race_builder.T2_LEG, race_builder.RUN_LEG]
+LEG_COLUMNS = [
+    ('t', COLUMN_INT), ('ar', COLUMN_INT), ('gr', COLUMN_INT), ('or', COLUMN_INT),
+    ('tar', COLUMN_FLOAT), ('tgr', COLUMN_FLOAT), ('tor', COLUMN_FLOAT),
+]
+
+
+def get_column_type(values, column_type):
+    """
+    Returns column_type if all not null values fit it, otherwise values are stored as codes of a values table.
+    """
+    if column_type == COLUMN_INT and all(value is None or type(value) is int for value in values):
+        return COLUMN_INT
+    if column_type == COLUMN_FLOAT and all(value is None or type(value) in (int, float) for value in values):
+        return COLUMN_FLOAT
+    return COLUMN_CODED
+
+
+def get_leg_column(leg, field):
+    return FIELD_SEPARATOR.join(['legs', leg, field])
+
+
+def encode_column(values, column_type):
+    """
+    Returns the column meta and its arrays by file name suffix.
+    """
+    column = {'type': get_column_type(values, column_type)}
+    arrays = {}
+    if column['type'] == COLUMN_INT:
+        arrays[''] = np.asarray([INT_NULL if value is None else value for value in values], dtype=np.int64)
+    elif column['type'] == COLUMN_FLOAT:
+        arrays[''] = np.asarray([np.nan if value is None else value for value in values], dtype=np.float64)
+        int_mask = np.asarray([type(value) is int for value in values], dtype=bool)
+        column['ints'] = bool(int_mask.any())
+        if column['ints']:
+            arrays[INT_MASK_SUFFIX] = int_mask
+    else:
+        code_by_value = {}
+        arrays[''] = np.asarray([code_by_value.setdefault(value, len(code_by_value)) for value in values], dtype=np.int32)
+        column['values'] = list(code_by_value)
+    return column, arrays
+
+
+def write_snapshot(snapshot_dir, races):
+    """
+    Writes races into a columnar snapshot of the result fields the scorer reads: one memory-mappable typed
+    array per field, the rows of a race are [offsets[i], offsets[i + 1]). A missing field is read as None.
+    races is an iterable of (race_info, results).
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    race_infos = []
+    offsets = [0]
+    values_by_column = {field: [] for field, _ in RESULT_COLUMNS}
+    values_by_column.update({get_leg_column(leg, field): [] for leg in LEGS for field, _ in LEG_COLUMNS})
+    legs_mask = []
+    for race_info, results in races:
+        race_infos.append(race_info)
+        for result in results:
+            for field, _ in RESULT_COLUMNS:
+                values_by_column[field].append(result.get(field))
+            result_legs = result.get('legs', {})
+            mask = 0
+            for bit, leg in enumerate(LEGS):
+                leg_result = result_legs.get(leg)
+                if leg_result is not None:
+                    mask |= 1 << bit
+                for field, _ in LEG_COLUMNS:
+                    values_by_column[get_leg_column(leg, field)].append(leg_result.get(field) if leg_result else None)
+            legs_mask.append(mask)
+        offsets.append(len(legs_mask))
+
+    column_types = dict(RESULT_COLUMNS)
+    column_types.update({get_leg_column(leg, field): column_type for leg in LEGS for field, column_type in LEG_COLUMNS})
+    columns = {}
+    for name, values in values_by_column.items():
+        columns[name], arrays = encode_column(values, column_types[name])
+        for suffix, array in arrays.items():
+            np.save(os.path.join(snapshot_dir, get_column_file(name + suffix)), array)
+
+    np.save(os.path.join(snapshot_dir, LEGS_FILE), np.asarray(legs_mask, dtype=np.uint8))
+    np.save(os.path.join(snapshot_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(snapshot_dir, META_FILE), 'w') as f:
+        json.dump({'races': race_infos, 'columns': columns}, f)
+
+    logger.info(f'snapshot written to {snapshot_dir} races: {len(race_infos)} results: {len(legs_mask)}')
+
+
+def get_column_file(name):
+    return name + COLUMN_EXTENSION
+
+
+class SnapshotRaceStorage:
+    """
+    Read only race storage over a columnar snapshot, used by the scorer instead of RaceStorage.
+    """
+
+    def __init__(self, snapshot_dir):
+        with open(os.path.join(snapshot_dir, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.races = meta['races']
+        self.offsets = np.load(os.path.join(snapshot_dir, OFFSETS_FILE))
+        self.legs_mask = np.load(os.path.join(snapshot_dir, LEGS_FILE), mmap_mode='r')
+        self.column_types = {}
+        self.columns = {}
+        self.values_by_column = {}
+        self.int_masks = {}
+        for name, column in meta['columns'].items():
+            self.column_types[name] = column['type']
+            self.columns[name] = np.load(os.path.join(snapshot_dir, get_column_file(name)), mmap_mode='r')
+            if column['type'] == COLUMN_CODED:
+                self.values_by_column[name] = column['values']
+            if column.get('ints'):
+                self.int_masks[name] = np.load(
+                    os.path.join(snapshot_dir, get_column_file(name + INT_MASK_SUFFIX)), mmap_mode='r')
+
+        self.index_by_key = {
+            (race_parser.get_race_date(race_info), race_parser.get_race_name(race_info)): i
+            for i, race_info in enumerate(self.races)
+        }
+
+    def get_races(self, skip=0, limit=0):
+        end = skip + limit if limit > 0 else len(self.races)
+        return [dict(race_info) for race_info in self.races[skip:end]]
+
+    def get_race_info(self, race_name, race_date):
+        race_index = self.index_by_key.get((race_date, race_name))
+        return dict(self.races[race_index]) if race_index is not None else {}
+
+    def get_race_athlete_ids(self, race_name, race_date):
+        race_index = self.index_by_key.get((race_date, race_name))
+        if race_index is None:
+            return []
+        start, end = self.offsets[race_index], self.offsets[race_index + 1]
+        if self.column_types['id'] != COLUMN_CODED:
+            return list(set(self.get_column_values('id', race_index)))
+        ids = self.values_by_column['id']
+        return [ids[code] for code in np.unique(self.columns['id'][start:end]).tolist()]
+
+    def get_race_results(self, race_name, race_date):
+        race_index = self.index_by_key.get((race_date, race_name))
+        if race_index is None:
+            logger.error(f'no race found in snapshot race_name: {race_name} race_date: {race_date}')
+            return []
+
+        fields = [field for field, _ in RESULT_COLUMNS]
+        results = [dict(zip(fields, row)) for row in zip(*[self.get_column_values(field, race_index) for field in fields])]
+
+        start, end = self.offsets[race_index], self.offsets[race_index + 1]
+        legs_mask = self.legs_mask[start:end].tolist()
+        leg_fields = [field for field, _ in LEG_COLUMNS]
+        for result in results:
+            result['legs'] = {}
+        for bit, leg in enumerate(LEGS):
+            leg_rows = zip(*[self.get_column_values(get_leg_column(leg, field), race_index) for field in leg_fields])
+            for result, mask, row in zip(results, legs_mask, leg_rows):
+                if mask & (1 << bit):
+                    result['legs'][leg] = dict(zip(leg_fields, row))
+        return results
+
+    def get_column_values(self, name, race_index):
+        """
+        Returns the values of a column for the rows of the race, nulls are None.
+        """
+        start, end = self.offsets[race_index], self.offsets[race_index + 1]
+        values = self.columns[name][start:end].tolist()
+        column_type = self.column_types[name]
+        if column_type == COLUMN_INT:
+            return [None if value == INT_NULL else value for value in values]
+        if column_type == COLUMN_FLOAT:
+            if name not in self.int_masks:
+                return [None if math.isnan(value) else value for value in values]
+            int_mask = self.int_masks[name][start:end].tolist()
+            return [None if math.isnan(value) else int(value) if is_int else value for value, is_int in zip(values, int_mask)]
+        column_values = self.values_by_column[name]
+        return [column_values[code] for code in values]
+
+    def __len__(self):
+        return len(self.races)
+
+
+def export_races(race_storage):
+    for race_info in race_storage.get_races():
+        if not race_info.get(PROCESSED_FIELD):
+            logger.warning(f'skip not processed race: {race_info["date"]} {race_info["name"]}')
+            continue
+        race_name = race_parser.get_race_name(race_info)
+        race_date = race_parser.get_race_date(race_info)
+        del race_info[PROCESSED_FIELD]
+        race_info.pop(CONTENT_HASH_FIELD, None)
+        # same order as the scorer reads results from mongo
+        yield race_info, list(race_storage.get_race_results(race_name=race_name, race_date=race_date, batch_size=1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports processed races into a columnar snapshot for the scorer')
+
+    parser.add_argument('-d', '--database', default='triscore')
+    parser.add_argument('-u', '--username', default='triscore-reader')
+    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument('-o', '--output', required=True)
+
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
+    race_storage = RaceStorage(mongo_client=mongo_client, db_name=args.database)
+    write_snapshot(args.output, export_races(race_storage))
+
+
+if __name__ == '__main__':
+    main()
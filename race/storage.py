@@ -1,26 +1,68 @@
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from base import log, translit
+from base.keyset import get_after_query
+from base.count_cache import get_capped_count, TEXT_COUNT_LIMIT
 
 logger = log.setup_logger(__file__)
 
 
 ID_FIELD = '_id'
 PROCESSED_FIELD = '_processed'
+CONTENT_HASH_FIELD = '_hash'
+# id of the results of a race rewritten by update_race, the meta id otherwise
+RESULTS_ID_FIELD = '_results'
+RACE_ID_FIELD = 'race_id'
+
+# results of every race in its own collection named by the race meta id
+LAYOUT_COLLECTIONS = 'collections'
+# results of all races in one collection keyed by the race meta id
+LAYOUT_SINGLE = 'single'
+LAYOUTS = [LAYOUT_COLLECTIONS, LAYOUT_SINGLE]
+RACE_RESULTS_COLLECTION = 'race_results'
+LAYOUT_COLLECTION = 'storage_layout'
+LAYOUT_ID = 'race_results'
+
+
+def get_layout(db):
+    layout = db[LAYOUT_COLLECTION].find_one({ID_FIELD: LAYOUT_ID})
+    return layout['value'] if layout else LAYOUT_COLLECTIONS
+
+
+def get_results_id(race_meta):
+    return str(race_meta.get(RESULTS_ID_FIELD, race_meta[ID_FIELD]))
+
+
+def set_layout(db, layout):
+    db[LAYOUT_COLLECTION].replace_one({ID_FIELD: LAYOUT_ID}, {ID_FIELD: LAYOUT_ID, 'value': layout}, upsert=True)
 
 
 class RaceStorage:
-    def __init__(self, mongo_client, db_name, create_indices=False):
+    def __init__(self, mongo_client, db_name, create_indices=False, layout=None):
         self.db = mongo_client[db_name]
         self.races_meta = self.db['meta']
+        # the layout is switched by race/migrate_results.py once all the results are copied
+        self.layout = layout or get_layout(self.db)
+        self.race_results = self.db[RACE_RESULTS_COLLECTION]
         if create_indices:
             RaceStorage._create_meta_indices(self.races_meta)
+            if self.layout == LAYOUT_SINGLE:
+                RaceStorage._create_results_indices(self.race_results)
 
-    def get_races(self, name='', country='', race_type='', sort_field='date', sort_order=1, skip=0, limit=0, projection={}, batch_size=10):
-        projection.update({ID_FIELD: 0})
-        sort = [(sort_field, sort_order)]
+    def get_races(self, name='', country='', race_type='', sort_field='date', sort_order=1, skip=0, limit=0, projection={}, batch_size=10, after=None):
+        projection.update({ID_FIELD: 0, CONTENT_HASH_FIELD: 0, RESULTS_ID_FIELD: 0})
+        # (name, date) is unique: yearly editions of a race share the name
+        keys = ['name'] if sort_field == 'date' else ['name', 'date']
+        sort = [(sort_field, sort_order)] + [(key, sort_order) for key in keys]
 
         query = self._get_athlete_and_country_query(
             name, country, race_type=race_type, country_field='location.c')
+        if after:
+            # keyset pagination: continue after the last seen (sort value, name, date)
+            after_value, (after_name, after_date) = after
+            after_keys = dict(name=after_name, date=after_date)
+            after_query = get_after_query(sort_field, sort_order, after_value, [(key, after_keys[key]) for key in keys])
+            query = {'$and': [query, after_query]} if query else after_query
         logger.info(f'query: \'{query}\'')
         return self.races_meta.find(
             query,
@@ -29,6 +71,39 @@ class RaceStorage:
             batch_size=batch_size
         ).skip(skip).limit(limit)
 
+    def count_filtered_races(self, name='', country='', race_type='', count_cache=None, limit=TEXT_COUNT_LIMIT):
+        """
+        Returns (count, exact). Filters without text search are counted exactly through the count cache,
+        text searches get a capped count.
+        """
+        query = self._get_athlete_and_country_query(
+            name, country, race_type=race_type, country_field='location.c')
+        if name and name.strip():
+            return get_capped_count(self.races_meta, query, limit=limit)
+        if count_cache:
+            return count_cache.get_count(self.races_meta, self.races_meta.name, query), True
+        return self.races_meta.count_documents(query), True
+
+    def count_race_results(self, race_name, race_date, athlete_filter='', country_filter='', age_group_filter='', limit=TEXT_COUNT_LIMIT):
+        race_meta = self._get_race_meta(name=race_name, date=race_date)
+        if not race_meta:
+            return 0, True
+
+        query = self._get_athlete_and_country_query(
+            athlete_filter, country_filter, age_group_filter=age_group_filter, country_field='c')
+        if not query and 'stats' in race_meta:
+            return race_meta['stats']['t'], True
+
+        race_collection, query = self._get_results(get_results_id(race_meta), query)
+        if athlete_filter and athlete_filter.strip():
+            return get_capped_count(race_collection, query, limit=limit)
+        return race_collection.count_documents(query), True
+
+    def refresh_counts(self, count_cache):
+        wheres = [{}]
+        wheres.extend({'type': race_type} for race_type in self.races_meta.distinct('type'))
+        count_cache.refresh(self.races_meta, self.races_meta.name, wheres)
+
     def count_races(self, name=None, date=None):
         f = {}
         if name:
@@ -42,6 +117,8 @@ class RaceStorage:
         if race_meta:
             del race_meta[ID_FIELD]
             del race_meta[PROCESSED_FIELD]
+            race_meta.pop(CONTENT_HASH_FIELD, None)
+            race_meta.pop(RESULTS_ID_FIELD, None)
             return race_meta
         return {}
 
@@ -52,10 +129,10 @@ class RaceStorage:
                 f'no race id found race_name: {race_name} race_date: {race_date}')
             return []
 
-        race_collection = self.db[race_id]
         query = self._get_athlete_and_country_query(
             athlete_filter, country_filter, age_group_filter=age_group_filter, country_field='c')
-        projection = {ID_FIELD: 0}
+        race_collection, query = self._get_results(race_id, query)
+        projection = {ID_FIELD: 0, RACE_ID_FIELD: 0} if self.layout == LAYOUT_SINGLE else {ID_FIELD: 0}
         sort = [(sort_field, sort_order)]
         return race_collection.find(
             query,
@@ -64,15 +141,32 @@ class RaceStorage:
             batch_size=batch_size
         ).skip(skip).limit(limit)
 
+    def get_race_athlete_ids(self, race_name, race_date):
+        race_id = self._get_race_id(race_name, race_date)
+        if not race_id:
+            return []
+        race_collection, query = self._get_results(race_id)
+        return race_collection.distinct('id', query)
+
     def update_athlete_id(self, race_date, race_name, source_athlete_id, target_athlete_id):
+        """
+        Returns False when the race is missing or already has a result of the target athlete: the unique
+        athlete id index keeps one result per athlete, so the source result is left as is.
+        """
         race_id = self._get_race_id(race_name, race_date)
         if not race_id:
             logger.warning(
                 f'no race found to update athlete id: {race_name} {race_date}')
             return False
 
-        race_collection = self.db[race_id]
-        return race_collection.update_one({'id': source_athlete_id}, {'$set': {'id': target_athlete_id}})
+        race_collection, query = self._get_results(race_id, {'id': source_athlete_id})
+        try:
+            return race_collection.update_one(query, {'$set': {'id': target_athlete_id}})
+        except DuplicateKeyError:
+            logger.warning(
+                f'skip athlete id update: {source_athlete_id} -> {target_athlete_id} '
+                f'target already in race: {race_name} {race_date}')
+            return False
 
     def add_race(self, info, results):
         race_name = info['name']
@@ -81,21 +175,55 @@ class RaceStorage:
         assert not self.has_race(
             race_name, race_date), f'race already exists {race_name} {race_date}'
 
+        race_id = ObjectId()
         try:
-            info.update({PROCESSED_FIELD: False})
-            inserted_id = self.races_meta.insert_one(info).inserted_id
-            race_collection = self.db[str(inserted_id)]
-            RaceStorage._create_data_indices(race_collection)
-            inserted_ids = race_collection.insert_many(results).inserted_ids
-            if len(inserted_ids) == len(results):
-                self.set_race_processed(race_name, race_date)
-                return True
-            else:
-                return False
+            self._insert_results(str(race_id), results)
+            # the meta is written last and already processed: a race is either complete or not visible at all
+            info.update({ID_FIELD: race_id, PROCESSED_FIELD: True})
+            self.races_meta.insert_one(info)
+            return True
         except Exception as exception:
             logger.error(f'failed to add race: {info} exception: {exception}')
+            self.races_meta.delete_one({ID_FIELD: race_id})
+            self._remove_results(str(race_id))
             return False
 
+    def update_race(self, info, results):
+        """
+        Writes the new results next to the current ones and switches the race meta to them in one update, so
+        readers see either the old or the new results. The race is marked processed, so a partially written race
+        is completed too. A race without changed rows gets only the new meta. Returns the number of changed rows.
+        """
+        race_name = info['name']
+        race_date = info['date']
+        race_meta = self._get_race_meta(race_name, race_date)
+        assert race_meta, f'race does not exist {race_name} {race_date}'
+
+        old_results_id = get_results_id(race_meta)
+        race_collection, race_query = self._get_results(old_results_id)
+        existing_by_id = {
+            result['id']: result
+            for result in race_collection.find(race_query, projection={ID_FIELD: 0, RACE_ID_FIELD: 0})
+        }
+        changed_count = sum(existing_by_id.pop(result['id'], None) != result for result in results)
+        changed_count += len(existing_by_id)
+
+        meta_update = dict(info, **{PROCESSED_FIELD: True})
+        if changed_count > 0:
+            results_id = ObjectId()
+            try:
+                self._insert_results(str(results_id), results)
+            except Exception:
+                self._remove_results(str(results_id))
+                raise
+            meta_update[RESULTS_ID_FIELD] = results_id
+
+        # the meta with the content hash is written last: an interrupted update is redone by the next run
+        self.races_meta.update_one({ID_FIELD: race_meta[ID_FIELD]}, {'$set': meta_update})
+        if changed_count > 0:
+            self._remove_results(old_results_id)
+        return changed_count
+
     def remove_race(self, name, date):
         race_id = self._get_race_id(name, date)
         if not race_id:
@@ -103,21 +231,26 @@ class RaceStorage:
             return False
 
         logger.info(f'remove race meta {name} {date} {race_id}')
-        self.races_meta.remove({ID_FIELD: ObjectId(race_id)})
+        self.races_meta.remove({'name': name, 'date': date})
         logger.info(f'drop race data {race_id}')
-        self.db[race_id].drop()
+        self._remove_results(race_id)
         return True
 
     def get_race_length(self, name, date):
         race_id = self._get_race_id(name, date)
         if not race_id:
             return 0
-        return self.db[race_id].count()
+        race_collection, query = self._get_results(race_id)
+        return race_collection.count_documents(query)
 
     def race_processed(self, name, date):
         race_meta = self._get_race_meta(name, date)
         return race_meta and race_meta[PROCESSED_FIELD]
 
+    def get_content_hash(self, name, date):
+        race_meta = self._get_race_meta(name, date)
+        return race_meta.get(CONTENT_HASH_FIELD) if race_meta else None
+
     def set_race_processed(self, name, date, processed=True):
         race_id = self._get_race_id(name, date)
         if not race_id:
@@ -160,9 +293,37 @@ class RaceStorage:
             query = conditions[0]
         return query
 
+    def _get_results(self, race_id, query=None):
+        """
+        Returns the collection with the results of the race and the query scoped to the race.
+        """
+        query = query or {}
+        if self.layout == LAYOUT_SINGLE:
+            return self.race_results, dict(query, **{RACE_ID_FIELD: ObjectId(race_id)})
+        return self.db[race_id], query
+
+    def _insert_results(self, race_id, results):
+        race_collection, race_query = self._get_results(race_id)
+        if self.layout == LAYOUT_SINGLE:
+            results = [dict(result, **race_query) for result in results]
+        else:
+            RaceStorage._create_data_indices(race_collection)
+        inserted_ids = race_collection.insert_many(results).inserted_ids
+        assert len(inserted_ids) == len(results), f'inserted {len(inserted_ids)} of {len(results)} results'
+
+    def _remove_results(self, race_id):
+        race_collection, query = self._get_results(race_id)
+        if self.layout == LAYOUT_SINGLE:
+            race_collection.delete_many(query)
+        else:
+            race_collection.drop()
+
     def _get_race_id(self, name, date):
+        """
+        Returns the id of the race results.
+        """
         race_meta = self._get_race_meta(name, date)
-        return str(race_meta[ID_FIELD]) if race_meta else None
+        return get_results_id(race_meta) if race_meta else None
 
     def _get_race_meta(self, name, date):
         return self.races_meta.find_one({'name': name, 'date': date})
@@ -197,6 +358,9 @@ class RaceStorage:
         meta_collection.create_index('stats.s')
         meta_collection.create_index('stats.p')
 
+        for sort_field in ['date', 'stats.t', 'stats.s', 'stats.p', 'location.c']:
+            meta_collection.create_index([(sort_field, -1), ('name', -1)])
+
     @staticmethod
     def _create_data_indices(data_collection):
         data_collection.create_index('id', unique=True)
@@ -209,3 +373,13 @@ class RaceStorage:
         data_collection.create_index('ar')
         data_collection.create_index('gr')
         data_collection.create_index('or')
+
+    @staticmethod
+    def _create_results_indices(results_collection):
+        results_collection.create_index([(RACE_ID_FIELD, 1), ('id', 1)], unique=True)
+        results_collection.create_index([(RACE_ID_FIELD, 1), ('n', 'text')])
+        results_collection.create_index('id')
+        for field in ['n', 'c', 'b', 'g', 'a', 'ar', 'gr', 'or']:
+            results_collection.create_index([(RACE_ID_FIELD, 1), (field, 1)])
+        results_collection.create_index([(RACE_ID_FIELD, 1), ('a', 1), ('ar', 1)])
+        results_collection.create_index([(RACE_ID_FIELD, 1), ('g', 1), ('gr', 1)])
@@ -0,0 +1,244 @@
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from race import migrate_results
+from race.storage import RaceStorage, LAYOUT_SINGLE, RACE_RESULTS_COLLECTION
+from types import SimpleNamespace
+
+
+def matches(doc, where):
+    for field, value in where.items():
+        if isinstance(value, dict) and '$in' in value:
+            if doc.get(field) not in value['$in']:
+                return False
+        elif doc.get(field) != value:
+            return False
+    return True
+
+
+def project(doc, projection):
+    return {k: v for k, v in doc.items() if projection.get(k, 1) != 0}
+
+
+class FakeCursor(list):
+    def skip(self, skip):
+        return self
+
+    def limit(self, limit):
+        return self
+
+
+class FakeCollection:
+    def __init__(self, fail_insert=False):
+        self.docs = []
+        self.fail_insert = fail_insert
+        self.dropped = False
+
+    def create_index(self, index, unique=False):
+        pass
+
+    def find(self, where, projection={'_id': 0}, sort=None, batch_size=None):
+        self.sort = sort
+        return FakeCursor(project(doc, projection) for doc in self.docs if matches(doc, where))
+
+    def count_documents(self, where):
+        return len(self.find(where))
+
+    def distinct(self, field, where):
+        return sorted(set(doc[field] for doc in self.find(where)))
+
+    def bulk_write(self, requests, ordered=True):
+        self.requests = requests
+        for request in requests:
+            self.delete_many(request._filter)
+            if isinstance(request, ReplaceOne):
+                self.docs.append(request._doc)
+
+    def update_one(self, where, update):
+        doc = next(doc for doc in self.docs if matches(doc, where))
+        if 'id' in update['$set'] and self.find_one({'race_id': doc.get('race_id'), 'id': update['$set']['id']}):
+            raise DuplicateKeyError('duplicate key', 11000)
+        doc.update(update['$set'])
+        return SimpleNamespace(modified_count=1)
+
+    def find_one(self, where):
+        return next((dict(doc) for doc in self.docs if matches(doc, where)), None)
+
+    def insert_one(self, doc):
+        self.docs.append(doc)
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail_insert:
+            raise RuntimeError('connection lost')
+        write_errors = []
+        for i, doc in enumerate(docs):
+            if self.find_one({'race_id': doc.get('race_id'), 'id': doc['id']}):
+                write_errors.append({'index': i, 'code': 11000})
+            else:
+                self.docs.append(doc)
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors})
+        return SimpleNamespace(inserted_ids=list(range(len(docs))))
+
+    def delete_one(self, where):
+        self.docs = [doc for doc in self.docs if doc['_id'] != where['_id']]
+
+    def remove(self, where):
+        self.delete_many(where)
+
+    def delete_many(self, where):
+        self.docs = [doc for doc in self.docs if not matches(doc, where)]
+
+    def drop(self):
+        self.dropped = True
+        self.docs = []
+
+
+class FakeDb(dict):
+    def __init__(self, fail_insert=False):
+        super().__init__()
+        self.fail_insert = fail_insert
+
+    def list_collection_names(self):
+        return [name for name, collection in self.items() if not collection.dropped]
+
+    def __missing__(self, name):
+        self[name] = FakeCollection(fail_insert=self.fail_insert and name != 'meta')
+        return self[name]
+
+
+class TestAddRace:
+    def test_processed_race(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        assert race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a'}, {'id': 'b'}])
+        assert race_storage.race_processed('Race', '2020-01-01')
+        assert db[race_storage._get_race_id('Race', '2020-01-01')].docs == [{'id': 'a'}, {'id': 'b'}]
+
+    def test_failed_race_is_not_written(self):
+        db = FakeDb(fail_insert=True)
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        assert not race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a'}])
+        assert not race_storage.has_race('Race', '2020-01-01')
+        assert all(not collection.docs for collection in db.values())
+
+    def test_update_changed_rows(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01', '_hash': 'a'}, [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}, {'id': 'c', 'or': 3}])
+        old_collection = db[race_storage._get_race_id('Race', '2020-01-01')]
+        changed_count = race_storage.update_race(
+            {'name': 'Race', 'date': '2020-01-01', '_hash': 'b'}, [{'id': 'a', 'or': 1}, {'id': 'c', 'or': 2}, {'id': 'd', 'or': 3}])
+        race_collection = db[race_storage._get_race_id('Race', '2020-01-01')]
+        assert changed_count == 3
+        # the new results are switched in, the old ones are dropped afterwards
+        assert race_collection is not old_collection
+        assert old_collection.dropped
+        assert sorted(race_collection.docs, key=lambda doc: doc['or']) == [{'id': 'a', 'or': 1}, {'id': 'c', 'or': 2}, {'id': 'd', 'or': 3}]
+        assert race_storage.get_content_hash('Race', '2020-01-01') == 'b'
+        assert race_storage.get_race_info('Race', '2020-01-01') == {'name': 'Race', 'date': '2020-01-01'}
+        assert race_storage.count_race_results('Race', '2020-01-01', athlete_filter='', age_group_filter='M') == (0, True)
+        race_collection.docs[0]['a'] = 'M'
+        assert race_storage.count_race_results('Race', '2020-01-01', age_group_filter='M') == (1, True)
+
+    def test_update_unchanged_rows(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01', '_hash': 'a'}, [{'id': 'a', 'or': 1}])
+        race_id = race_storage._get_race_id('Race', '2020-01-01')
+        assert race_storage.update_race({'name': 'Race', 'date': '2020-01-01', '_hash': 'b'}, [{'id': 'a', 'or': 1}]) == 0
+        assert race_storage._get_race_id('Race', '2020-01-01') == race_id
+        assert race_storage.get_content_hash('Race', '2020-01-01') == 'b'
+
+    def test_complete_unprocessed_race(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}])
+        race_storage.set_race_processed('Race', '2020-01-01', processed=False)
+        race_storage.update_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}])
+        assert race_storage.race_processed('Race', '2020-01-01')
+        assert race_storage.get_race_length('Race', '2020-01-01') == 2
+
+
+class TestGetRaces:
+    def test_sort_keys(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.get_races(sort_field='date', after=('2020-01-01', ['Race', '2020-01-01']))
+        assert db['meta'].sort == [('date', 1), ('name', 1)]
+        race_storage.get_races(sort_field='location.c', sort_order=-1)
+        assert db['meta'].sort == [('location.c', -1), ('name', -1), ('date', -1)]
+
+    def test_hide_content_hash(self):
+        race_storage = RaceStorage({'triscore': FakeDb()}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01', '_hash': 'a'}, [{'id': 'a'}])
+        assert all('_hash' not in race_info for race_info in race_storage.get_races())
+        assert '_hash' not in race_storage.get_race_info('Race', '2020-01-01')
+
+
+class TestSingleLayout:
+    def test_race_results(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore', layout=LAYOUT_SINGLE)
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}])
+        race_storage.add_race({'name': 'Other', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}])
+
+        assert sorted(db.keys()) == ['meta', RACE_RESULTS_COLLECTION]
+        assert list(race_storage.get_race_results('Race', '2020-01-01')) == [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}]
+        assert race_storage.get_race_athlete_ids('Other', '2020-01-01') == ['a']
+        assert race_storage.get_race_length('Race', '2020-01-01') == 2
+
+        race_storage.update_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'b', 'or': 1}])
+        assert list(race_storage.get_race_results('Race', '2020-01-01')) == [{'id': 'b', 'or': 1}]
+
+        race_storage.remove_race('Race', '2020-01-01')
+        assert race_storage.get_race_length('Other', '2020-01-01') == 1
+        assert len(db[RACE_RESULTS_COLLECTION].docs) == 1
+
+    def test_update_athlete_id(self):
+        race_storage = RaceStorage({'triscore': FakeDb()}, db_name='triscore', layout=LAYOUT_SINGLE)
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}])
+        assert not race_storage.update_athlete_id('2020-01-01', 'Race', 'a', 'b')
+        assert race_storage.update_athlete_id('2020-01-01', 'Race', 'a', 'c')
+        assert sorted(race_storage.get_race_athlete_ids('Race', '2020-01-01')) == ['b', 'c']
+
+
+class TestMigrateResults:
+    def test_rerun(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a', 'or': 1}, {'id': 'b', 'or': 2}])
+        race_id = race_storage._get_race_id('Race', '2020-01-01')
+
+        single_storage = RaceStorage({'triscore': db}, db_name='triscore', layout=LAYOUT_SINGLE)
+        for _ in range(2):
+            race_results = db[RACE_RESULTS_COLLECTION]
+            race_results.docs = race_results.docs[:1]
+            assert migrate_results.migrate_race(db[race_id], race_results, ObjectId(race_id), batch_size=1) == 2
+        assert list(single_storage.get_race_results('Race', '2020-01-01')) == list(race_storage.get_race_results('Race', '2020-01-01'))
+
+    def test_drop_copied_collections(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a'}, {'id': 'b'}])
+        race_storage.add_race({'name': 'Other', 'date': '2020-01-01'}, [{'id': 'a'}])
+        race_id = race_storage._get_race_id('Race', '2020-01-01')
+        other_id = race_storage._get_race_id('Other', '2020-01-01')
+        migrate_results.migrate_race(db[race_id], db[RACE_RESULTS_COLLECTION], ObjectId(race_id), batch_size=10)
+
+        assert migrate_results.drop_race_collections(db) == 1
+        assert db[race_id].dropped
+        assert not db[other_id].dropped
+
+    def test_races_added_while_copying(self):
+        db = FakeDb()
+        race_storage = RaceStorage({'triscore': db}, db_name='triscore')
+        single_storage = RaceStorage({'triscore': db}, db_name='triscore', layout=LAYOUT_SINGLE)
+        race_storage.add_race({'name': 'Race', 'date': '2020-01-01'}, [{'id': 'a'}])
+        migrated_ids = set()
+        assert migrate_results.migrate_races(db, single_storage, migrated_ids, batch_size=10) == 1
+
+        race_storage.add_race({'name': 'Other', 'date': '2020-01-01'}, [{'id': 'b'}])
+        assert migrate_results.migrate_races(db, single_storage, migrated_ids, batch_size=10) == 1
+        assert migrate_results.migrate_races(db, single_storage, migrated_ids, batch_size=10) == 0
+        assert single_storage.get_race_length('Other', '2020-01-01') == 1
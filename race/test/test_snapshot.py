@@ -0,0 +1,84 @@
+import race.builder as race_builder
+import race.snapshot as snapshot
+
+
+def make_result(athlete_id, finish_time, bib=1, legs=None):
+    return {
+        'id': athlete_id, 'n': f'Athlete {athlete_id}', 'c': 643, 'b': bib, 'st': race_builder.FINISH_STATUS_OK,
+        't': finish_time, 'a': 'M30-34', 'as': 2, 'ar': 1, 'tar': 0.5, 'g': 'M', 'gs': 2, 'gr': 1, 'tgr': 1.25,
+        'os': 2, 'or': 1, 'tor': 1.,
+        'legs': legs if legs is not None else {
+            race_builder.SWIM_LEG: race_builder.build_leg(3600, 1, 1, 1, 0.5, 0.75, 1.)
+        }
+    }
+
+
+RACES = [
+    ({'name': 'A', 'date': '2020-01-01', 'type': 'full', 'location': {'c': 643}}, [
+        make_result('a1', 30000),
+        make_result('a2', race_builder.MAX_TIME, bib='12A', legs={}),
+    ]),
+    ({'name': 'B', 'date': '2020-02-01', 'type': 'half', 'location': {}}, [
+        # older results have no time ranks
+        {k: v for k, v in make_result('a2', 20000, bib=None).items() if k != 'tar'},
+    ]),
+]
+
+
+def get_scorer_fields(result):
+    fields = {field: result.get(field) for field, _ in snapshot.RESULT_COLUMNS}
+    fields['legs'] = result['legs']
+    return fields
+
+
+class TestSnapshot:
+    def test_round_trip(self, tmp_path):
+        snapshot.write_snapshot(str(tmp_path), RACES)
+        race_storage = snapshot.SnapshotRaceStorage(str(tmp_path))
+
+        assert race_storage.get_races() == [race_info for race_info, _ in RACES]
+        assert race_storage.get_races(skip=1) == [RACES[1][0]]
+        assert race_storage.get_race_info('B', '2020-02-01') == RACES[1][0]
+        for race_info, results in RACES:
+            assert race_storage.get_race_results(race_info['name'], race_info['date']) == [
+                get_scorer_fields(result) for result in results]
+        assert sorted(race_storage.get_race_athlete_ids('A', '2020-01-01')) == ['a1', 'a2']
+
+    def test_scorer_fields_only(self, tmp_path):
+        snapshot.write_snapshot(str(tmp_path), RACES)
+        race_storage = snapshot.SnapshotRaceStorage(str(tmp_path))
+
+        result = race_storage.get_race_results('A', '2020-01-01')[0]
+        assert 'tar' not in result
+        assert 'tar' in result['legs'][race_builder.SWIM_LEG]
+        assert race_storage.column_types['t'] == snapshot.COLUMN_INT
+        assert race_storage.column_types['tgr'] == snapshot.COLUMN_FLOAT
+        # bibs are numbers and strings
+        assert race_storage.column_types['b'] == snapshot.COLUMN_CODED
+
+    def test_missing_field(self, tmp_path):
+        race_info = {'name': 'C', 'date': '2020-03-01', 'type': 'full', 'location': {}}
+        result = {k: v for k, v in make_result('a3', 20000).items() if k != 'gr'}
+        snapshot.write_snapshot(str(tmp_path), [(race_info, [make_result('a1', 10000), result])])
+        race_storage = snapshot.SnapshotRaceStorage(str(tmp_path))
+
+        assert race_storage.column_types['gr'] == snapshot.COLUMN_INT
+        assert [result['gr'] for result in race_storage.get_race_results('C', '2020-03-01')] == [1, None]
+
+    def test_float_column_ints(self, tmp_path):
+        race_info = {'name': 'C', 'date': '2020-03-01', 'type': 'full', 'location': {}}
+        results = [dict(make_result('a1', 10000), tgr=1), dict(make_result('a2', 20000), tgr=1.5)]
+        snapshot.write_snapshot(str(tmp_path), [(race_info, results)])
+        race_storage = snapshot.SnapshotRaceStorage(str(tmp_path))
+
+        assert race_storage.column_types['tgr'] == snapshot.COLUMN_FLOAT
+        tgrs = [result['tgr'] for result in race_storage.get_race_results('C', '2020-03-01')]
+        assert tgrs == [1, 1.5] and type(tgrs[0]) is int
+
+    def test_column_types(self):
+        assert snapshot.get_column_type([1, None], snapshot.COLUMN_INT) == snapshot.COLUMN_INT
+        assert snapshot.get_column_type([1., None], snapshot.COLUMN_FLOAT) == snapshot.COLUMN_FLOAT
+        assert snapshot.get_column_type([1, 2.5], snapshot.COLUMN_INT) == snapshot.COLUMN_CODED
+        assert snapshot.get_column_type([1, 2.5], snapshot.COLUMN_FLOAT) == snapshot.COLUMN_FLOAT
+        assert snapshot.get_column_type(['1', 2.5], snapshot.COLUMN_FLOAT) == snapshot.COLUMN_CODED
+        assert snapshot.get_column_type([1, 2], snapshot.COLUMN_CODED) == snapshot.COLUMN_CODED
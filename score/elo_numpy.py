@@ -0,0 +1,53 @@
+import numpy as np
+
+
+MIN_SCORE = 1.
+MAX_SCORE = 8000.
+SCORE_RESOLUTION = 1.
+
+
+def get_win_probability_matrix(scores, other_scores):
+    # probability[..., i, j] = probability of other_scores[..., j] to win against scores[..., i]
+    diff = (scores[..., :, np.newaxis] - other_scores[..., np.newaxis, :]) / 400.
+    return 1. / (1. + np.power(10., diff))
+
+
+def get_seeds(scores, finished_scores, self_indices):
+    """
+    Vectorized version of EloScorer.get_seed.
+
+    scores: ratings to compute seeds for, shape (m,) or (c, m) for c rating configurations
+    finished_scores: pre-race ratings of the finished athletes, shape (k,) or (c, k)
+    self_indices: index of each athlete in finished_scores or -1 if not finished, shape (m,)
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    finished_scores = np.asarray(finished_scores, dtype=np.float64)
+    self_indices = np.asarray(self_indices, dtype=np.int64)
+
+    probability = get_win_probability_matrix(scores, finished_scores)
+    rows = np.nonzero(self_indices >= 0)[0]
+    probability[..., rows, self_indices[rows]] = 0.
+    return 1. + probability.sum(axis=-1)
+
+
+def get_scores_to_ranks(ranks, finished_scores, self_indices, own_scores, resolution=SCORE_RESOLUTION):
+    """
+    Vectorized version of EloScorer.get_score_to_rank: batched bisection over all athletes at once.
+    """
+    ranks = np.asarray(ranks, dtype=np.float64)
+    own_scores = np.asarray(own_scores, dtype=np.float64)
+
+    if np.shape(finished_scores)[-1] <= 1:
+        return np.broadcast_to(own_scores, ranks.shape).copy()
+
+    left = np.full(ranks.shape, MIN_SCORE)
+    right = np.full(ranks.shape, MAX_SCORE)
+
+    # all intervals have the same width, so every athlete takes the same number of steps
+    while right.flat[0] - left.flat[0] > resolution:
+        mid = (left + right) / 2.
+        below_rank = get_seeds(mid, finished_scores, self_indices) < ranks
+        right = np.where(below_rank, mid, right)
+        left = np.where(below_rank, left, mid)
+
+    return left
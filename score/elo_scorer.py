@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 import math
+import numpy as np
 
-from base import log
+from base import log, tracing
 import race.parser as race_parser
 import race.builder as race_builder
 import re
+import score.elo_numpy as elo_numpy
 
 logger = log.setup_logger(__file__, debug=False)
 
@@ -13,36 +15,148 @@ MIN_GROUP_SIZE = 10
 FEMALE_AGE_GROUP_REGEX = re.compile('F\d+-\d+')
 MALE_AGE_GROUP_REGEX = re.compile('M\d+-\d+')
 
+ENGINE_SCALAR = 'scalar'
+ENGINE_NUMPY = 'numpy'
+ENGINES = [ENGINE_SCALAR, ENGINE_NUMPY]
+
+PARALLEL_MIN_RESULTS = 500
+
+# checked in order: 'supersprint' has to be matched before 'sprint'
+RACE_TYPE_MULTIPLIERS = [
+    ('supersprint', 0.0625),
+    ('sprint', 0.125),
+    ('olympic', 0.25),
+    ('half', 0.5),
+    ('full', 1.),
+]
+
+
+def get_race_type_key(race_type):
+    for key, _ in RACE_TYPE_MULTIPLIERS:
+        if race_type.find(key) != -1:
+            return key
+    assert False, f'invalid race type: {race_type}'
+
+
+def get_race_type_multiplier(race_type, multiplier_by_key=dict(RACE_TYPE_MULTIPLIERS)):
+    return multiplier_by_key[get_race_type_key(race_type)]
+
+
 class EloScorer:
-    def __init__(self, athlete_storage):
+    def __init__(self, athlete_storage, engine=ENGINE_SCALAR, check_tolerance=None, race_score_storage=None, executor=None, parallel_min_results=PARALLEL_MIN_RESULTS, tracer=tracing.NULL_TRACER):
+        assert engine in ENGINES, f'invalid engine: {engine}'
         self.athlete_storage = athlete_storage
+        self.race_score_storage = race_score_storage
+        self.race_summaries = []
+        self.score_by_id = {}
+        self.race_count_by_id = {}
+        self.engine = engine
+        # when set, numpy results are verified against the scalar engine
+        self.check_tolerance = check_tolerance
+        # optional concurrent.futures executor, races smaller than parallel_min_results are scored in process
+        self.executor = executor
+        self.parallel_min_results = parallel_min_results
+        self.tracer = tracer
 
     def add_race(self, race_info, race_results):
+        self.race_summaries = []
         results_by_group = self.get_results_by_group(race_results)
         all_groups = results_by_group.keys()
 
+        all_results = [result for results in results_by_group.values() for result in results]
+        self.load_race_state(all_results)
+
         logger.info(f'all groups: {all_groups}')
         female_age_groups = sorted([g for g in all_groups if FEMALE_AGE_GROUP_REGEX.match(g)])
         male_age_groups = sorted([g for g in all_groups if MALE_AGE_GROUP_REGEX.match(g)])
         not_age_groups = [g for g in all_groups if (g not in female_age_groups and g not in male_age_groups)]
 
-        def process_age_group(sorted_age_groups):
-            print(f'process age groups: {sorted_age_groups}')
-            for i, age_group in enumerate(sorted_age_groups):
-                extended_group_results = list(results_by_group[age_group])
-                if i > 0:
-                    extended_group_results.extend(results_by_group[sorted_age_groups[i - 1]])
-                if i + 1 < len(sorted_age_groups):
-                    extended_group_results.extend(results_by_group[sorted_age_groups[i + 1]])
-
-                sorted_results = sorted(extended_group_results, key=lambda r: r['t'])
-                logger.info(f'age_group: {age_group} actual size: {len(results_by_group[age_group])} extended_size: {len(extended_group_results)}')
-                self.process_group(age_group, sorted_results, race_info)
+        # extended groups see the new scores of their neighbours, so age groups of one gender are scored in order,
+        # different chains are scored independently unless an athlete is listed in more than one of them
+        chains = [
+            self.get_extended_groups(female_age_groups, results_by_group),
+            self.get_extended_groups(male_age_groups, results_by_group)
+        ]
+        chains.extend([(group, list(results_by_group[group]))] for group in not_age_groups)
+        chains = [chain for chain in chains if len(chain) > 0]
+
+        parallel = self.executor and len(chains) > 1 and len(all_results) >= self.parallel_min_results
+        if parallel and chains_share_athletes(chains):
+            # a worker would score the shared athlete from the pre-race state
+            logger.warning(f'chains share athletes, scoring race sequentially: {race_parser.get_race_name(race_info)}')
+            parallel = False
+
+        if parallel:
+            with self.tracer.span('process_chains_parallel', chains=len(chains)):
+                self.process_chains_parallel(chains, race_info)
+        else:
+            for chain in chains:
+                for age_group, results in chain:
+                    with self.tracer.span(f'process_group[{tracing.get_size_bucket(len(results))}]', age_group=age_group):
+                        self.process_group(age_group, results, race_info)
+
+        # group states are tracked in score_by_id, so the storage is updated once per race
+        with self.tracer.span('history_writes', summaries=len(self.race_summaries)):
+            self.athlete_storage.add_athlete_races(self.race_summaries)
+            if self.race_score_storage:
+                self.race_score_storage.add_race_scores(self.race_summaries)
+
+    def get_extended_groups(self, sorted_age_groups, results_by_group):
+        print(f'process age groups: {sorted_age_groups}')
+        extended_groups = []
+        for i, age_group in enumerate(sorted_age_groups):
+            extended_group_results = list(results_by_group[age_group])
+            if i > 0:
+                extended_group_results.extend(results_by_group[sorted_age_groups[i - 1]])
+            if i + 1 < len(sorted_age_groups):
+                extended_group_results.extend(results_by_group[sorted_age_groups[i + 1]])
+
+            sorted_results = sorted(extended_group_results, key=lambda r: r['t'])
+            logger.info(f'age_group: {age_group} actual size: {len(results_by_group[age_group])} extended_size: {len(extended_group_results)}')
+            extended_groups.append((age_group, sorted_results))
+        return extended_groups
+
+    def process_chains_parallel(self, chains, race_info):
+        futures = []
+        for chain in chains:
+            chain_ids = set(race_parser.get_athlete_id(result) for _, results in chain for result in results)
+            futures.append(self.executor.submit(
+                process_chain,
+                self.engine,
+                self.check_tolerance,
+                race_info,
+                chain,
+                {athlete_id: self.score_by_id[athlete_id] for athlete_id in chain_ids},
+                {athlete_id: self.race_count_by_id[athlete_id] for athlete_id in chain_ids}))
+
+        # merged in submission order, so summaries are the same as in the sequential mode
+        for future in futures:
+            chain_summaries = future.result()
+            self.race_summaries.extend(chain_summaries)
+            for athlete_id, race_summary in chain_summaries:
+                self.score_by_id[athlete_id] = race_summary['ns']
+                self.race_count_by_id[athlete_id] = race_summary['index']
+
+    def load_race_state(self, race_results):
+        # one query for pre-race state of all participants, shared by all groups of the race
+        athlete_ids = [race_parser.get_athlete_id(result) for result in race_results]
+        with self.tracer.span('fetch_scores', athletes=len(athlete_ids)):
+            self.score_by_id, self.race_count_by_id = self.athlete_storage.get_scores_and_race_counts(athlete_ids)
+
+        # an athlete listed twice in the race is created once, from the first result
+        new_athlete_by_id = {}
+        for result in race_results:
+            athlete_id = race_parser.get_athlete_id(result)
+            if athlete_id not in self.score_by_id and athlete_id not in new_athlete_by_id:
+                new_athlete_by_id[athlete_id] = self.make_new_athlete(result)
+        new_athletes = list(new_athlete_by_id.values())
+        if len(new_athletes) > 0:
+            with self.tracer.span('create_athletes', athletes=len(new_athletes)):
+                self.athlete_storage.add_athletes(new_athletes)
 
-        process_age_group(female_age_groups)
-        process_age_group(male_age_groups)
-        for group in not_age_groups:
-            self.process_group(group, list(results_by_group[group]), race_info)
+        for athlete in new_athletes:
+            self.score_by_id[athlete['id']] = athlete['s']
+            self.race_count_by_id[athlete['id']] = athlete['p']
 
     def get_results_by_group(self, race_results):
         results_by_group = {}
@@ -70,8 +184,6 @@ class EloScorer:
         race_type = race_parser.get_race_type(race_info)
         race_country_iso_num = race_parser.get_race_country_iso_num(race_info)
 
-        self.make_new_athletes(results)
-
         # fastest_time = 999999
         # slowest_time = 0
         prev_finish_time = 0
@@ -97,44 +209,43 @@ class EloScorer:
 
         # max_time_diff = (slowest_time - fastest_time)
 
-        athlete_ids = list(
-            map(lambda r: race_parser.get_athlete_id(r), results))
-
-        score_by_id = self.athlete_storage.get_score_by_id(athlete_ids)
-        races_count_by_id = self.athlete_storage.get_race_count_by_id(
-            athlete_ids)
+        score_by_id = self.score_by_id
+        races_count_by_id = self.race_count_by_id
+        summaries_start = len(self.race_summaries)
 
         race_type_multiplier = self.get_race_type_multiplier(race_type)
 
+        group_results = []
+        extended_age_ranks = []
         for i, result in enumerate(results):
             result_age_group = race_parser.get_age_group(result)
             if age_group != result_age_group:
                 # skip extended results
                 continue
 
+            finish_status = race_parser.get_finish_status(result)
+            is_finished = finish_status == race_builder.FINISH_STATUS_OK
+
+            group_results.append(result)
+            extended_age_ranks.append((i + 1) if is_finished else (len(finished_results) + 1))
+
+        with self.tracer.span(f'seeds[{tracing.get_size_bucket(result_count)}]', engine=self.engine):
+            extended_seed_ranks, need_scores = self.get_seeds_and_need_scores(
+                group_results, finished_results, extended_age_ranks, score_by_id)
+
+        for result, extended_age_rank, extended_seed_rank, need_score in \
+                zip(group_results, extended_age_ranks, extended_seed_ranks, need_scores):
             athlete_id = race_parser.get_athlete_id(result)
             finish_time = race_parser.get_finish_time(result)
             finish_status = race_parser.get_finish_status(result)
 
             is_started = finish_status != race_builder.FINISH_STATUS_DNS
-            is_finished = finish_status == race_builder.FINISH_STATUS_OK
 
             athlete_score = score_by_id[athlete_id]
             athlete_race_count = races_count_by_id[athlete_id]
 
-            extended_seed_rank = self.get_seed(finished_results, athlete_score, athlete_id, score_by_id)
-            extended_age_rank = (i + 1) if is_finished else (len(finished_results) + 1)
-            # extended_time_rank = extended_age_rank
-
             score_delta = 0
             if is_started:
-                # if is_finished and max_time_diff > 0:
-                #     relative_time = 1. * (finish_time - fastest_time) / max_time_diff
-                #     extended_time_rank = 1 + (result_count - 1) * relative_time
-
-                mid_rank = math.sqrt(extended_age_rank * extended_seed_rank)
-                need_score = self.get_score_to_rank(finished_results, mid_rank, athlete_id, score_by_id)
-                # logger.info(f'mid_rank: {mid_rank} need_score: {need_score}')
                 score_delta = round((need_score - athlete_score) * race_type_multiplier)
 
             new_score = athlete_score + score_delta
@@ -191,7 +302,73 @@ class EloScorer:
             logger.debug(f'athlete: {athlete_name} result: {result_section}')
             race_summary.update(result_section)
 
-            self.athlete_storage.add_athlete_race(athlete_id, race_summary)
+            self.race_summaries.append((athlete_id, race_summary))
+
+        # athletes of this group are seen with their new state by the next extended groups
+        for athlete_id, race_summary in self.race_summaries[summaries_start:]:
+            score_by_id[athlete_id] = race_summary['ns']
+            races_count_by_id[athlete_id] = race_summary['index']
+
+    def get_seeds_and_need_scores(self, group_results, finished_results, extended_age_ranks, score_by_id):
+        if self.engine == ENGINE_NUMPY:
+            seeds, need_scores = self.get_seeds_and_need_scores_numpy(
+                group_results, finished_results, extended_age_ranks, score_by_id)
+            if self.check_tolerance is not None:
+                self.check_seeds_and_need_scores(
+                    group_results, finished_results, extended_age_ranks, score_by_id, seeds, need_scores)
+            return seeds, need_scores
+
+        return self.get_seeds_and_need_scores_scalar(
+            group_results, finished_results, extended_age_ranks, score_by_id)
+
+    def get_seeds_and_need_scores_scalar(self, group_results, finished_results, extended_age_ranks, score_by_id):
+        seeds = []
+        need_scores = []
+        for result, extended_age_rank in zip(group_results, extended_age_ranks):
+            athlete_id = race_parser.get_athlete_id(result)
+            athlete_score = score_by_id[athlete_id]
+            extended_seed_rank = self.get_seed(finished_results, athlete_score, athlete_id, score_by_id)
+
+            need_score = athlete_score
+            if race_parser.get_finish_status(result) != race_builder.FINISH_STATUS_DNS:
+                mid_rank = math.sqrt(extended_age_rank * extended_seed_rank)
+                need_score = self.get_score_to_rank(finished_results, mid_rank, athlete_id, score_by_id)
+                # logger.info(f'mid_rank: {mid_rank} need_score: {need_score}')
+
+            seeds.append(extended_seed_rank)
+            need_scores.append(need_score)
+        return seeds, need_scores
+
+    def get_seeds_and_need_scores_numpy(self, group_results, finished_results, extended_age_ranks, score_by_id):
+        finished_ids = [race_parser.get_athlete_id(r) for r in finished_results]
+        finished_index_by_id = {athlete_id: i for i, athlete_id in enumerate(finished_ids)}
+        # the scalar engine skips every result of the athlete, get_seeds only the one at self_indices
+        assert len(finished_index_by_id) == len(finished_ids), f'duplicated finished athlete ids: {finished_ids}'
+        finished_scores = [score_by_id[athlete_id] for athlete_id in finished_ids]
+
+        group_ids = [race_parser.get_athlete_id(r) for r in group_results]
+        group_scores = [score_by_id[athlete_id] for athlete_id in group_ids]
+        self_indices = [finished_index_by_id.get(athlete_id, -1) for athlete_id in group_ids]
+
+        seeds = elo_numpy.get_seeds(group_scores, finished_scores, self_indices)
+        mid_ranks = np.sqrt(np.asarray(extended_age_ranks, dtype=float) * seeds)
+        need_scores = elo_numpy.get_scores_to_ranks(mid_ranks, finished_scores, self_indices, group_scores)
+        is_started = [race_parser.get_finish_status(r) != race_builder.FINISH_STATUS_DNS for r in group_results]
+        need_scores = np.where(is_started, need_scores, group_scores)
+
+        return seeds.tolist(), need_scores.tolist()
+
+    def check_seeds_and_need_scores(self, group_results, finished_results, extended_age_ranks, score_by_id, seeds, need_scores):
+        expected_seeds, expected_need_scores = self.get_seeds_and_need_scores_scalar(
+            group_results, finished_results, extended_age_ranks, score_by_id)
+
+        for result, seed, expected_seed, need_score, expected_need_score in \
+                zip(group_results, seeds, expected_seeds, need_scores, expected_need_scores):
+            athlete_id = race_parser.get_athlete_id(result)
+            assert abs(seed - expected_seed) <= self.check_tolerance, \
+                f'seed mismatch athlete_id: {athlete_id} numpy: {seed} scalar: {expected_seed}'
+            assert abs(need_score - expected_need_score) <= self.check_tolerance, \
+                f'need score mismatch athlete_id: {athlete_id} numpy: {need_score} scalar: {expected_need_score}'
 
     def get_seed(self, results, score, athlete_id, score_by_id):
         seed = 1.
@@ -223,40 +400,46 @@ class EloScorer:
 
 
     def get_race_type_multiplier(self, race_type):
-        if race_type.find('supersprint') != -1:
-            return 0.0625
-        elif race_type.find('sprint') != -1:
-            return 0.125
-        elif race_type.find('olympic') != -1:
-            return 0.25
-        elif race_type.find('half') != -1:
-            return 0.5
-        elif race_type.find('full') != -1:
-            return 1.
-        assert False, f'invalid race type: {race_type}'
+        return get_race_type_multiplier(race_type)
 
     def get_elo_win_probability(self, ra, rb):
         return 1. / (1. + pow(10., (rb - ra) / 400.))
 
 
-    def make_new_athletes(self, results):
-        for result in results:
-            athlete_id = race_parser.get_athlete_id(result)
-            if self.athlete_storage.athlete_exists(athlete_id):
-                continue
-
-            athlete = {
-                'id': athlete_id,
-                'n': race_parser.get_athlete_name(result),
-                'g': race_parser.get_gender(result),
-                'c': race_parser.get_result_country_iso_num(result),
-                'a': race_parser.get_age_group(result),
-                'p': 0,
-                's': START_SCORE,
-                'h': []
-            }
-
-            self.athlete_storage.add_athlete(athlete)
+    def make_new_athlete(self, result):
+        return {
+            'id': race_parser.get_athlete_id(result),
+            'n': race_parser.get_athlete_name(result),
+            'g': race_parser.get_gender(result),
+            'c': race_parser.get_result_country_iso_num(result),
+            'a': race_parser.get_age_group(result),
+            'p': 0,
+            's': START_SCORE,
+            'h': []
+        }
 
     def get_top_athletes(self, sort_order=-1, limit=0, with_history=False):
         return self.athlete_storage.get_top_athletes(sort_order=sort_order, limit=limit, with_history=with_history)
+
+
+def chains_share_athletes(chains):
+    seen_ids = set()
+    for chain in chains:
+        chain_ids = set(race_parser.get_athlete_id(result) for _, results in chain for result in results)
+        if not seen_ids.isdisjoint(chain_ids):
+            return True
+        seen_ids.update(chain_ids)
+    return False
+
+
+def process_chain(engine, check_tolerance, race_info, chain, score_by_id, race_count_by_id):
+    """
+    Scores a chain of groups in a worker process from the snapshot of its athletes' pre-race state.
+    Returns the race summaries in the order of the chain.
+    """
+    elo_scorer = EloScorer(None, engine=engine, check_tolerance=check_tolerance)
+    elo_scorer.score_by_id = score_by_id
+    elo_scorer.race_count_by_id = race_count_by_id
+    for age_group, results in chain:
+        elo_scorer.process_group(age_group, results, race_info)
+    return elo_scorer.race_summaries
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import resource
+import sys
+import time
+import numpy as np
+
+from base import log
+import race.builder as race_builder
+import race.parser as race_parser
+from race.snapshot import SnapshotRaceStorage
+from score.elo_scorer import EloScorer, ENGINES, ENGINE_SCALAR, get_race_type_key
+from score.storage import InMemoryAthleteStorage
+import score.synthetic as synthetic
+
+
+logger = log.setup_logger(__file__, debug=False)
+
+ALL_RACE_TYPES = 'all'
+MIN_PROBABILITY = 1e-15
+
+
+def get_pair_stats(scores, finish_times):
+    """
+    Compares pre-race scores with the finish order of all pairs of finishers.
+    Returns (concordant, discordant, score_ties, time_ties, log_loss_sum, pairs), log-loss is summed over pairs
+    without time ties and uses the elo win probability of the athlete who finished first.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    finish_times = np.asarray(finish_times, dtype=np.float64)
+    first, second = np.triu_indices(len(scores), k=1)
+
+    score_diffs = scores[first] - scores[second]
+    # positive when the first athlete of the pair finished ahead
+    time_diffs = finish_times[second] - finish_times[first]
+    ordered = time_diffs != 0
+    signs = np.sign(score_diffs) * np.sign(time_diffs)
+
+    win_scores = np.where(time_diffs > 0, scores[first], scores[second])[ordered]
+    lose_scores = np.where(time_diffs > 0, scores[second], scores[first])[ordered]
+    probabilities = 1. / (1. + np.power(10., (lose_scores - win_scores) / 400.))
+    log_loss_sum = -np.log(np.maximum(probabilities, MIN_PROBABILITY)).sum()
+
+    return (
+        int((signs > 0).sum()),
+        int((signs < 0).sum()),
+        int((score_diffs == 0).sum()),
+        int((~ordered).sum()),
+        float(log_loss_sum),
+        len(first),
+    )
+
+
+class RaceTypeStats:
+    def __init__(self):
+        self.races = 0
+        self.concordant = 0
+        self.discordant = 0
+        self.score_ties = 0
+        self.time_ties = 0
+        self.log_loss_sum = 0.
+        self.log_loss_pairs = 0
+        self.tau_sum = 0.
+        self.tau_races = 0
+
+    def add(self, pair_stats):
+        concordant, discordant, score_ties, time_ties, log_loss_sum, pairs = pair_stats
+        self.races += 1
+        self.concordant += concordant
+        self.discordant += discordant
+        self.score_ties += score_ties
+        self.time_ties += time_ties
+        self.log_loss_sum += log_loss_sum
+        self.log_loss_pairs += pairs - time_ties
+
+        # tau-b of the race, undefined when all scores or all times are equal
+        denominator = ((pairs - score_ties) * (pairs - time_ties)) ** 0.5
+        if denominator > 0:
+            self.tau_sum += (concordant - discordant) / denominator
+            self.tau_races += 1
+
+    def get_metrics(self):
+        # pairs with equal scores or equal times predict nothing
+        decided_pairs = self.concordant + self.discordant
+        return {
+            'races': self.races,
+            'pairs': decided_pairs,
+            'pairwise_accuracy': self.concordant / decided_pairs if decided_pairs else None,
+            'kendall_tau': self.tau_sum / self.tau_races if self.tau_races else None,
+            'log_loss': self.log_loss_sum / self.log_loss_pairs if self.log_loss_pairs else None,
+        }
+
+
+class Evaluation:
+    """
+    Replays races in date order and scores the prediction made by the ratings before each race.
+    """
+
+    def __init__(self, race_storage, engine=ENGINE_SCALAR, min_races=1):
+        self.race_storage = race_storage
+        self.athlete_storage = InMemoryAthleteStorage()
+        self.elo_scorer = EloScorer(self.athlete_storage, engine=engine)
+        # athletes with fewer previous races have no rating yet and are not compared
+        self.min_races = min_races
+        self.stats_by_type = {ALL_RACE_TYPES: RaceTypeStats()}
+        self.race_count = 0
+        self.result_count = 0
+        self.scoring_sec = 0.
+        self.total_sec = 0.
+
+    def run(self, limit=0):
+        start = time.perf_counter()
+        for race_info in self.race_storage.get_races(limit=limit):
+            race_name = race_parser.get_race_name(race_info)
+            race_date = race_parser.get_race_date(race_info)
+            race_results = list(self.race_storage.get_race_results(race_name=race_name, race_date=race_date))
+            self.add_race(race_info, race_results)
+        self.total_sec = time.perf_counter() - start
+        return self.get_metrics()
+
+    def add_race(self, race_info, race_results):
+        finished_results = [
+            result for result in race_results
+            if race_parser.get_finish_status(result) == race_builder.FINISH_STATUS_OK
+        ]
+        score_by_id, race_count_by_id = self.athlete_storage.get_scores_and_race_counts(
+            [race_parser.get_athlete_id(result) for result in finished_results])
+
+        rated_results = [
+            result for result in finished_results
+            if race_count_by_id.get(race_parser.get_athlete_id(result), 0) >= self.min_races
+        ]
+        if len(rated_results) > 1:
+            pair_stats = get_pair_stats(
+                [score_by_id[race_parser.get_athlete_id(result)] for result in rated_results],
+                [race_parser.get_finish_time(result) for result in rated_results])
+            race_type = get_race_type_key(race_parser.get_race_type(race_info))
+            self.stats_by_type.setdefault(race_type, RaceTypeStats()).add(pair_stats)
+            self.stats_by_type[ALL_RACE_TYPES].add(pair_stats)
+
+        start = time.perf_counter()
+        self.elo_scorer.add_race(race_info, race_results)
+        self.scoring_sec += time.perf_counter() - start
+        self.race_count += 1
+        self.result_count += len(race_results)
+
+    def get_metrics(self):
+        return {
+            'quality': {race_type: stats.get_metrics() for race_type, stats in self.stats_by_type.items()},
+            'speed': {
+                'races': self.race_count,
+                'results': self.result_count,
+                'scoring_sec': self.scoring_sec,
+                'total_sec': self.total_sec,
+                'races_per_sec': self.race_count / self.scoring_sec if self.scoring_sec else None,
+                'results_per_sec': self.result_count / self.scoring_sec if self.scoring_sec else None,
+                # ru_maxrss is in kilobytes on linux
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+            }
+        }
+
+
+def check_gates(metrics, min_pairwise_accuracy=None, max_log_loss=None, min_results_per_sec=None):
+    failures = []
+    quality = metrics['quality'][ALL_RACE_TYPES]
+    if min_pairwise_accuracy is not None and (quality['pairwise_accuracy'] or 0.) < min_pairwise_accuracy:
+        failures.append(f'pairwise accuracy {quality["pairwise_accuracy"]} < {min_pairwise_accuracy}')
+    if max_log_loss is not None and (quality['log_loss'] is None or quality['log_loss'] > max_log_loss):
+        failures.append(f'log loss {quality["log_loss"]} > {max_log_loss}')
+    results_per_sec = metrics['speed']['results_per_sec']
+    if min_results_per_sec is not None and (results_per_sec or 0.) < min_results_per_sec:
+        failures.append(f'results per sec {results_per_sec} < {min_results_per_sec}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how well ratings predict race results and how fast they are computed')
+
+    parser.add_argument('--snapshot', default=None, help='races snapshot written by race/snapshot.py, synthetic races otherwise')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--race-count', type=int, default=200)
+    parser.add_argument('--athlete-count', type=int, default=2000)
+    parser.add_argument('--race-size', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_SCALAR)
+    parser.add_argument('--min-races', type=int, default=1)
+    parser.add_argument('--output', default=None)
+
+    parser.add_argument('--min-pairwise-accuracy', type=float, default=None)
+    parser.add_argument('--max-log-loss', type=float, default=None)
+    parser.add_argument('--min-results-per-sec', type=float, default=None)
+
+    args = parser.parse_args()
+
+    if args.snapshot:
+        race_storage = SnapshotRaceStorage(args.snapshot)
+    else:
+        race_storage = synthetic.SyntheticRaceStorage(synthetic.make_season(
+            seed=args.seed, race_count=args.race_count, athlete_count=args.athlete_count, race_size=args.race_size))
+
+    metrics = Evaluation(race_storage, engine=args.engine, min_races=args.min_races).run(limit=args.limit)
+    logger.info(f'metrics:\n{json.dumps(metrics, indent=2)}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+
+    failures = check_gates(metrics, args.min_pairwise_accuracy, args.max_log_loss, args.min_results_per_sec)
+    for failure in failures:
+        logger.error(f'gate failed: {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
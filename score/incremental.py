@@ -0,0 +1,182 @@
+from base import log
+import race.parser as race_parser
+from score.elo_scorer import EloScorer, START_SCORE
+
+
+logger = log.setup_logger(__file__, debug=False)
+
+
+def get_race_key(race_info):
+    return (race_parser.get_race_date(race_info), race_parser.get_race_name(race_info))
+
+
+def get_races_to_score(race_storage, scoring_state):
+    """
+    Splits all races into new ones (after the watermark) and late ones (not scored, but before the watermark).
+    Both lists are ordered by (date, name). Raises ValueError for athletes scored without a watermark (before
+    incremental scoring was introduced): every race would be applied to them once more.
+    """
+    watermark = scoring_state.get_watermark()
+    if watermark is None and scoring_state.has_athletes():
+        raise ValueError('athletes are scored without a watermark, run a full replay before --incremental')
+    scored_races = scoring_state.get_scored_races()
+
+    new_races = []
+    late_races = []
+    for race_info in sorted(race_storage.get_races(), key=get_race_key):
+        race_key = get_race_key(race_info)
+        if race_key in scored_races:
+            continue
+        if watermark is None or race_key > watermark:
+            new_races.append(race_info)
+        else:
+            late_races.append(race_info)
+
+    logger.info(f'watermark: {watermark} new races: {len(new_races)} late races: {len(late_races)}')
+    return new_races, late_races
+
+
+def rewind_athlete(athlete, race_key):
+    kept_history = [h for h in athlete['h'] if (h['date'], h['race']) < race_key]
+    replay_keys = [(h['date'], h['race']) for h in athlete['h'] if (h['date'], h['race']) >= race_key]
+
+    athlete['h'] = kept_history
+    if len(kept_history) > 0:
+        last_race = kept_history[-1]
+        athlete['s'] = last_race['ns']
+        athlete['p'] = last_race['index']
+        athlete['a'] = last_race['a']
+        athlete['c'] = last_race['c']
+    else:
+        athlete['s'] = START_SCORE
+        athlete['p'] = 0
+
+    return replay_keys
+
+
+class RewindAthleteStorage:
+    """
+    Athlete storage used to replay races for the rewound athletes only.
+
+    Rewound athletes are kept in memory and get new race summaries, all other participants are frozen:
+    their pre-race score is taken from their own history and their state is never changed.
+    """
+
+    def __init__(self, athlete_storage, athlete_by_id):
+        self.athlete_storage = athlete_storage
+        self.athlete_by_id = athlete_by_id
+        self.frozen_by_id = {}
+
+    def set_race(self, race_name, race_date, athlete_ids):
+        other_ids = [athlete_id for athlete_id in athlete_ids if athlete_id not in self.athlete_by_id]
+        self.frozen_by_id = {}
+        if len(other_ids) == 0:
+            # an empty id list reads every athlete
+            return
+        race_summary_by_id = self.athlete_storage.get_race_summaries(race_name, race_date, other_ids)
+        for athlete in self.athlete_storage.get_athletes(other_ids):
+            race_summary = race_summary_by_id.get(athlete['id'])
+            if race_summary:
+                self.frozen_by_id[athlete['id']] = (race_summary['ps'], race_summary['index'] - 1)
+            else:
+                logger.warning(f'race summary not found athlete_id: {athlete["id"]} race: {race_name} date: {race_date}')
+                self.frozen_by_id[athlete['id']] = (athlete['s'], athlete['p'])
+
+    def get_score_by_id(self, athlete_ids):
+        return {
+            athlete_id: self.athlete_by_id[athlete_id]['s'] if athlete_id in self.athlete_by_id
+            else self.frozen_by_id[athlete_id][0] for athlete_id in athlete_ids
+        }
+
+    def get_race_count_by_id(self, athlete_ids):
+        return {
+            athlete_id: self.athlete_by_id[athlete_id]['p'] if athlete_id in self.athlete_by_id
+            else self.frozen_by_id[athlete_id][1] for athlete_id in athlete_ids
+        }
+
+    def get_scores_and_race_counts(self, athlete_ids):
+        known_ids = [athlete_id for athlete_id in athlete_ids if self.athlete_exists(athlete_id)]
+        return self.get_score_by_id(known_ids), self.get_race_count_by_id(known_ids)
+
+    def athlete_exists(self, athlete_id):
+        return athlete_id in self.athlete_by_id or athlete_id in self.frozen_by_id
+
+    def add_athlete(self, athlete):
+        athlete_id = athlete['id']
+        assert athlete_id not in self.athlete_by_id, f'duplicated athlete_id: {athlete_id}'
+        self.athlete_by_id[athlete_id] = athlete
+
+    def add_athletes(self, athletes):
+        for athlete in athletes:
+            self.add_athlete(athlete)
+
+    def add_athlete_race(self, athlete_id, race_summary):
+        if athlete_id not in self.athlete_by_id:
+            return
+
+        athlete = self.athlete_by_id[athlete_id]
+        athlete['c'] = race_summary['c']
+        athlete['s'] = race_summary['ns']
+        athlete['p'] = race_summary['index']
+        athlete['a'] = race_summary['a']
+        athlete['h'].append(race_summary)
+
+    def add_athlete_races(self, race_summaries):
+        for athlete_id, race_summary in race_summaries:
+            self.add_athlete_race(athlete_id, race_summary)
+
+
+def rewind_race(race_storage, athlete_storage, race_info, engine, race_score_storage=None):
+    """
+    Applies a late race: participants are rewound to the state before the race, then the late race and
+    all their later races are replayed for them.
+
+    This approximates a full replay: the other participants of the replayed races stay frozen with their
+    pre-race scores and results, although their opponents scores changed. The rewound athletes get the full
+    replay scores as long as their frozen opponents did not meet a rewound athlete earlier, the frozen ones keep
+    their old scores. The number of frozen results in the replayed races is logged as the size of the error.
+    """
+    race_name = race_parser.get_race_name(race_info)
+    race_date = race_parser.get_race_date(race_info)
+    race_key = get_race_key(race_info)
+
+    race_results = list(race_storage.get_race_results(race_name=race_name, race_date=race_date))
+    athlete_ids = [race_parser.get_athlete_id(result) for result in race_results]
+
+    athlete_by_id = {}
+    replay_keys = set([race_key])
+    for athlete in athlete_storage.get_athletes_with_history(athlete_ids):
+        athlete_by_id[athlete['id']] = athlete
+        replay_keys.update(rewind_athlete(athlete, race_key))
+
+    logger.info(f'rewind race: {race_date} {race_name} athletes: {len(athlete_by_id)} races to replay: {len(replay_keys)}')
+
+    rewind_storage = RewindAthleteStorage(athlete_storage, athlete_by_id)
+    elo_scorer = EloScorer(rewind_storage, engine=engine)
+
+    frozen_count = 0
+    for replay_date, replay_name in sorted(replay_keys):
+        if (replay_date, replay_name) == race_key:
+            replay_info = race_info
+            replay_results = race_results
+        else:
+            replay_info = race_storage.get_race_info(race_name=replay_name, race_date=replay_date)
+            replay_results = list(race_storage.get_race_results(race_name=replay_name, race_date=replay_date))
+
+        rewind_storage.set_race(
+            replay_name, replay_date, [race_parser.get_athlete_id(result) for result in replay_results])
+        frozen_count += len(rewind_storage.frozen_by_id)
+        elo_scorer.add_race(replay_info, replay_results)
+
+    logger.info(f'rewind race: {race_date} {race_name} frozen results in replayed races: {frozen_count}')
+
+    race_summaries = []
+    for athlete in athlete_by_id.values():
+        athlete_storage.replace_athlete(athlete)
+        race_summaries.extend(
+            (athlete['id'], h) for h in athlete['h'] if (h['date'], h['race']) >= race_key)
+
+    if race_score_storage:
+        race_score_storage.add_race_scores(race_summaries)
+
+    return len(athlete_by_id)
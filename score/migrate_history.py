@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import argparse
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from base import log
+from score.storage import AthleteStorage, build_athlete_race, ATHLETE_RACES_COLLECTION, FLUSH_BATCH_SIZE, HISTORY_SIZE
+
+
+logger = log.setup_logger(__file__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Moves the race history embedded in athlete documents to the athlete races collection')
+
+    parser.add_argument('-d', '--database', default='triscore')
+    parser.add_argument('-u', '--username', default='triscore-writer')
+    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument('--collection', default='athletes')
+    parser.add_argument('--races-collection', default=ATHLETE_RACES_COLLECTION)
+    parser.add_argument('--batch-size', type=int, default=FLUSH_BATCH_SIZE)
+
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
+    athlete_storage = AthleteStorage(
+        mongo_client=mongo_client,
+        db_name=args.database,
+        collection_name=args.collection,
+        races_collection_name=args.races_collection,
+        create_indices=True)
+
+    athlete_races = []
+    athlete_count = 0
+    for athlete in athlete_storage.scores_collection.find({}, projection={'_id': 0, 'id': 1, 'h': 1}):
+        athlete_id = athlete['id']
+        athlete_races.extend(build_athlete_race(athlete_id, race_summary) for race_summary in athlete['h'])
+        athlete_count += 1
+
+        if len(athlete_races) >= args.batch_size:
+            migrate_batch(athlete_storage, athlete_races)
+            athlete_races = []
+            logger.info(f'migrated {athlete_count} athletes')
+
+    migrate_batch(athlete_storage, athlete_races)
+    logger.info(f'migrated {athlete_count} athletes')
+
+
+def migrate_batch(athlete_storage, athlete_races):
+    if len(athlete_races) == 0:
+        return
+
+    athlete_ids = list(set(athlete_race['id'] for athlete_race in athlete_races))
+    try:
+        athlete_storage.races_collection.insert_many(athlete_races, ordered=False)
+    except BulkWriteError as error:
+        # rerun after a partial migration: rows already copied violate the unique (id, index) index
+        if any(write_error['code'] != DUPLICATE_KEY_ERROR for write_error in error.details['writeErrors']):
+            raise
+    athlete_storage.scores_collection.update_many(
+        {'id': {'$in': athlete_ids}},
+        [{'$set': {'h': {'$slice': ['$h', -HISTORY_SIZE]}}}])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from base import log
+import race.parser as race_parser
+from score.elo_scorer import EloScorer
+from score.storage import MockAthleteStorage
+
+
+logger = log.setup_logger(__file__, debug=False)
+
+MAX_PENDING_RACES = 64
+
+
+def get_race_waves(race_athlete_ids):
+    """
+    Splits races into waves of races without shared athletes.
+
+    race_athlete_ids are participant ids of races in the replay order. Each race goes to the wave after the last
+    wave of any of its athletes, so every athlete meets its races in the replay order and the races of one wave
+    can be scored concurrently. Returns waves as lists of race indices in the replay order.
+    """
+    wave_by_athlete_id = {}
+    waves = []
+    for race_index, athlete_ids in enumerate(race_athlete_ids):
+        wave = 1 + max((wave_by_athlete_id.get(athlete_id, -1) for athlete_id in athlete_ids), default=-1)
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(race_index)
+        for athlete_id in athlete_ids:
+            wave_by_athlete_id[athlete_id] = wave
+    return waves
+
+
+def score_race(engine, check_tolerance, race_info, race_results, athletes):
+    """
+    Scores one race in a worker process from the pre-race state of its participants and returns the race summaries.
+    """
+    athlete_storage = MockAthleteStorage()
+    athlete_storage.add_athletes(athletes)
+    elo_scorer = EloScorer(athlete_storage, engine=engine, check_tolerance=check_tolerance)
+    elo_scorer.add_race(race_info, race_results)
+    return elo_scorer.race_summaries
+
+
+class RaceScheduler:
+    """
+    Replays races concurrently on executor workers. The athletes state is kept by the athlete storage of the main
+    process: new athletes are created and pre-race scores are sent before a race is submitted, race summaries are
+    applied in the replay order when a wave is done, so the ratings are the same as in the sequential replay.
+    """
+
+    def __init__(self, race_storage, athlete_storage, executor, engine, check_tolerance=None, race_score_storage=None, max_pending_races=MAX_PENDING_RACES):
+        self.race_storage = race_storage
+        self.athlete_storage = athlete_storage
+        self.executor = executor
+        self.engine = engine
+        self.check_tolerance = check_tolerance
+        self.race_score_storage = race_score_storage
+        self.max_pending_races = max_pending_races
+        self.elo_scorer = EloScorer(athlete_storage, engine=engine)
+
+    def replay(self, races):
+        races = list(races)
+        race_athlete_ids = [
+            self.race_storage.get_race_athlete_ids(
+                race_name=race_parser.get_race_name(race_info), race_date=race_parser.get_race_date(race_info))
+            for race_info in races
+        ]
+        waves = get_race_waves(race_athlete_ids)
+        logger.info(f'races: {len(races)} waves: {len(waves)} max wave size: {max(map(len, waves), default=0)}')
+
+        for wave_index, wave in enumerate(waves):
+            for start in range(0, len(wave), self.max_pending_races):
+                futures = [self.submit_race(races[race_index]) for race_index in wave[start:start + self.max_pending_races]]
+                for future in futures:
+                    self.apply_race(future.result())
+            logger.info(f'wave {wave_index + 1}/{len(waves)} races: {len(wave)}')
+
+        return races
+
+    def submit_race(self, race_info):
+        race_name = race_parser.get_race_name(race_info)
+        race_date = race_parser.get_race_date(race_info)
+        race_results = list(self.race_storage.get_race_results(race_name=race_name, race_date=race_date))
+
+        # same participants as in EloScorer.add_race: results without age group are skipped
+        results_by_group = self.elo_scorer.get_results_by_group(race_results)
+        athlete_ids = [race_parser.get_athlete_id(result) for results in results_by_group.values() for result in results]
+        score_by_id, race_count_by_id = self.athlete_storage.get_scores_and_race_counts(athlete_ids)
+
+        new_athletes = [
+            self.elo_scorer.make_new_athlete(result) for results in results_by_group.values() for result in results
+            if race_parser.get_athlete_id(result) not in score_by_id
+        ]
+        if len(new_athletes) > 0:
+            self.athlete_storage.add_athletes(new_athletes)
+
+        athletes = [
+            {'id': athlete_id, 's': score, 'p': race_count_by_id[athlete_id], 'h': []}
+            for athlete_id, score in score_by_id.items()
+        ]
+        athletes.extend({'id': athlete['id'], 's': athlete['s'], 'p': athlete['p'], 'h': []} for athlete in new_athletes)
+
+        return self.executor.submit(score_race, self.engine, self.check_tolerance, race_info, race_results, athletes)
+
+    def apply_race(self, race_summaries):
+        self.athlete_storage.add_athlete_races(race_summaries)
+        if self.race_score_storage:
+            self.race_score_storage.add_race_scores(race_summaries)
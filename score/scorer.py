@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 import argparse
+import cProfile
+import io
 import os
+import pstats
+from concurrent.futures import ProcessPoolExecutor
 from pymongo import MongoClient
 
-from base import log, utils
+from base import log, tracing, utils
+from base.count_cache import CountCache
+from base.generation import DataGeneration
 import race.parser as race_parser
+from race.snapshot import SnapshotRaceStorage
 from race.storage import RaceStorage
-from score.storage import AthleteStorage, MockAthleteStorage
-from score.elo_scorer import EloScorer
+from score.storage import AthleteStorage, InMemoryAthleteStorage, MockAthleteStorage, RaceScoreStorage, ScoringStateStorage, \
+    FLUSH_BATCH_SIZE, STAGING_SUFFIX
+from score.elo_scorer import EloScorer, ENGINES, ENGINE_SCALAR, PARALLEL_MIN_RESULTS
+import score.incremental as incremental
+import score.scheduler as scheduler
 # import score.distribution as distribution
 
 
@@ -15,6 +25,8 @@ logger = log.setup_logger(__file__, debug=False)
 
 START_SCORE = 1500
 MIN_GROUP_SIZE = 10
+PROFILE_FILE = 'profile.pstats'
+PROFILE_TOP = 30
 
 
 def print_distribution(elo_scorer:EloScorer, log_dir, index=None, extension='.txt'):
@@ -69,43 +81,178 @@ def main():
 
     parser.add_argument('-d', '--database', default='triscore')
     parser.add_argument('-u', '--username', default='triscore-writer')
-    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument('-p', '--password', default=None, help='required unless a --snapshot is scored with --dry-run')
 
     parser.add_argument('--skip', type=int, default=0)
     parser.add_argument('--limit', type=int, default=0)
     parser.add_argument('--log-dir', default='/tmp/score')
 
     parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--in-memory', action='store_true')
+    parser.add_argument('--flush-batch-size', type=int, default=FLUSH_BATCH_SIZE)
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_SCALAR)
+    parser.add_argument('--check-tolerance', type=float, default=None)
+    parser.add_argument('--workers', type=int, default=0, help='score independent groups of a race in worker processes')
+    parser.add_argument('--parallel-min-results', type=int, default=PARALLEL_MIN_RESULTS)
+    parser.add_argument('--trace', action='store_true', help='write per stage timings and a chrome trace to --log-dir')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and write the stats to --log-dir')
+    parser.add_argument('--snapshot', default=None, help='read races from a snapshot written by race/snapshot.py')
+    parser.add_argument('--parallel-races', action='store_true', help='score races without shared athletes in worker processes')
 
     args = parser.parse_args()
 
-    mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database, connect=False)
+    if args.incremental and (args.skip > 0 or args.dry_run):
+        parser.error('--incremental cannot be used with --skip or --dry-run')
+    if args.parallel_races and (args.workers == 0 or args.incremental or not (args.in_memory or args.dry_run)):
+        parser.error('--parallel-races requires --workers and --in-memory or --dry-run, and cannot be used with --incremental')
+    if args.password is None and uses_mongo(args):
+        parser.error('--password is required unless a --snapshot is scored with --dry-run')
 
-    if args.dry_run:
+    if not args.profile:
+        score_races(args)
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(score_races, args)
+    finally:
+        write_profile(profiler, args.log_dir)
+
+
+def uses_mongo(args):
+    """
+    A dry run over a snapshot neither reads nor writes mongo, unless it resumes the athletes state after --skip.
+    """
+    loads_athletes = args.in_memory and (args.skip > 0 or args.incremental)
+    return not (args.snapshot and args.dry_run) or loads_athletes
+
+
+def write_profile(profiler, log_dir):
+    os.makedirs(log_dir, exist_ok=True)
+    profile_path = os.path.join(log_dir, PROFILE_FILE)
+    profiler.dump_stats(profile_path)
+
+    stats_stream = io.StringIO()
+    pstats.Stats(profiler, stream=stats_stream).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    logger.info(f'profile written to {profile_path}\n{stats_stream.getvalue()}')
+
+
+def score_races(args):
+    mongo_client = None
+    if uses_mongo(args):
+        mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database, connect=False)
+
+    full_replay = args.skip == 0 and not args.incremental
+    if args.in_memory:
+        athlete_storage = InMemoryAthleteStorage()
+        if args.skip > 0 or args.incremental:
+            logger.info('loading athletes state')
+            athlete_storage.load(AthleteStorage(mongo_client=mongo_client, collection_name='athletes'))
+    elif args.dry_run:
         athlete_storage = MockAthleteStorage()
     else:
         athlete_storage = \
                 AthleteStorage(mongo_client=mongo_client, collection_name='athletes', create_indices=True)
+        if full_replay:
+            # a full replay starts from no athletes, leftover athlete races would collide with the new ones
+            athlete_storage.reset()
 
-    elo_scorer = EloScorer(athlete_storage)
-    race_storage = RaceStorage(mongo_client=mongo_client, db_name='triscore')
+    # a full replay rebuilds race scores aside, /race-results reads the previous ones until the rename
+    stage_race_scores = full_replay
+    race_score_storage = None
+    if not args.dry_run:
+        race_score_storage = RaceScoreStorage(
+            mongo_client=mongo_client,
+            collection_name='race_scores' + (STAGING_SUFFIX if stage_race_scores else ''),
+            create_indices=True)
+        if full_replay:
+            race_score_storage.reset()
 
-    races = race_storage.get_races(skip=args.skip, limit=args.limit)
-    race_count = races.count()
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 0 else None
+    tracer = tracing.Tracer() if args.trace else tracing.NULL_TRACER
+    elo_scorer = EloScorer(
+        athlete_storage,
+        engine=args.engine,
+        check_tolerance=args.check_tolerance,
+        race_score_storage=race_score_storage,
+        executor=executor,
+        parallel_min_results=args.parallel_min_results,
+        tracer=tracer)
+    if args.snapshot:
+        race_storage = SnapshotRaceStorage(args.snapshot)
+    else:
+        race_storage = RaceStorage(mongo_client=mongo_client, db_name='triscore')
+    scoring_state = None
+    if not args.dry_run:
+        scoring_state = ScoringStateStorage(mongo_client=mongo_client, collection_name='athletes', create_indices=True)
+
+    if args.incremental:
+        races, late_races = incremental.get_races_to_score(race_storage, scoring_state)
+        for race_info in late_races:
+            incremental.rewind_race(
+                race_storage, athlete_storage, race_info, engine=args.engine, race_score_storage=race_score_storage)
+        if args.limit > 0:
+            races = races[:args.limit]
+        race_count = len(races)
+        scored_races = [incremental.get_race_key(race_info) for race_info in late_races]
+    else:
+        races = list(race_storage.get_races(skip=args.skip, limit=args.limit))
+        race_count = len(races)
+        scored_races = []
+        if full_replay and not args.dry_run:
+            scoring_state.reset()
+
+    if args.parallel_races:
+        race_scheduler = scheduler.RaceScheduler(
+            race_storage,
+            athlete_storage,
+            executor,
+            engine=args.engine,
+            check_tolerance=args.check_tolerance,
+            race_score_storage=race_score_storage)
+        scored_races.extend(incremental.get_race_key(race_info) for race_info in race_scheduler.replay(races))
+        races = []
 
     for i, race_info in enumerate(races):
         race_date = race_parser.get_race_date(race_info)
         race_name = race_parser.get_race_name(race_info)
         logger.info(f'{args.skip + i + 1}/{race_count}: {race_date} {race_name}')
 
-        race_results = race_storage.get_race_results(race_name=race_name, race_date=race_date)
-        elo_scorer.add_race(race_info, race_results)
+        with tracer.span('race', race=race_name, date=race_date):
+            with tracer.span('load_results'):
+                race_results = list(race_storage.get_race_results(race_name=race_name, race_date=race_date))
+            elo_scorer.add_race(race_info, race_results)
+        scored_races.append((race_date, race_name))
+
+        if not args.in_memory and not args.dry_run:
+            scoring_state.add_scored_races(scored_races)
+            scored_races = []
 
         if (args.skip + i) == 0 or (args.skip + i + 1) % 100 == 0:
             print_distribution(elo_scorer, args.log_dir, i + 1)
 
     print_distribution(elo_scorer, args.log_dir)
 
+    if executor:
+        executor.shutdown()
+    if args.trace:
+        logger.info(f'timings:\n{tracer.get_summary()}')
+        tracer.write(args.log_dir)
+
+    if args.dry_run:
+        return
+
+    if args.in_memory:
+        athlete_storage.flush(mongo_client, collection_name='athletes', batch_size=args.flush_batch_size)
+    if stage_race_scores:
+        race_score_storage.rename('race_scores')
+    scoring_state.add_scored_races(scored_races)
+
+    AthleteStorage(mongo_client=mongo_client, collection_name='athletes').refresh_counts(CountCache(mongo_client))
+    # bumped once every collection is in place, responses cached while they were renamed are dropped
+    DataGeneration(mongo_client).bump(source='scorer')
+
 
 if __name__ == '__main__':
     main()
@@ -1,32 +1,84 @@
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, DeleteMany, ReplaceOne, UpdateOne
 from base import log, translit
+from base.keyset import get_after_query
+from base.count_cache import get_capped_count, TEXT_COUNT_LIMIT
 
 
 logger = log.setup_logger(__file__, debug=True)
 
 NO_LIMIT = 1000 * 1000 * 1000
+FLUSH_BATCH_SIZE = 1000
+STAGING_SUFFIX = '-staging'
+WATERMARK_SUFFIX = '-watermark'
+SCORED_RACES_SUFFIX = '-scored'
+RACE_SCORE_FIELDS = ['ps', 'ns', 'da', 'esr', 'ear']
+ATHLETE_RACES_COLLECTION = 'athlete_races'
+# number of the last races kept in the athlete document, full history is in athlete races collection
+HISTORY_SIZE = 10
 
 
 class AthleteStorage:
-    def __init__(self, mongo_client,  db_name='triscore', collection_name='athletes', create_indices=False):
+    def __init__(self, mongo_client,  db_name='triscore', collection_name='athletes', create_indices=False, races_collection_name=ATHLETE_RACES_COLLECTION):
         self.scores_collection = mongo_client[db_name][collection_name]
+        self.races_collection = mongo_client[db_name][races_collection_name]
         if create_indices:
             self._create_indices()
 
-    def get_top_athletes(self, name='', country=None, age_group='', sort_field='s', sort_order=DESCENDING, skip=0, limit=0, batch_size=10, with_history=False):
-        projection = {'_id': 0, 'prefixes': 0}
-        if not with_history:
-             projection['h'] = 0
+    def get_top_athletes(self, name='', country=None, age_group='', sort_field='s', sort_order=DESCENDING, skip=0, limit=0, batch_size=10, with_history=False, after=None):
+        # the athlete keeps the last HISTORY_SIZE races, the full history is read from the races collection
+        projection = {'_id': 0, 'prefixes': 0, 'h': 0}
     
-        sort = [(sort_field, sort_order)]
+        sort = [(sort_field, sort_order), ('id', sort_order)]
+
+        where = self._get_where(country, age_group)
+        if after:
+            # keyset pagination: continue after the last seen (sort value, id)
+            after_value, (after_id,) = after
+            where.update(get_after_query(sort_field, sort_order, after_value, [('id', after_id)]))
 
+        query = self._get_query(name, where)
+
+        logger.info(f'query: \'{query}\' sort: {sort}')
+        cursor = self.scores_collection.find(
+            query,
+            sort=sort,
+            projection=projection,
+            batch_size=batch_size
+        ).skip(skip).limit(limit)
+        if not with_history:
+            return cursor
+        return self._add_history(list(cursor))
+
+    def count_athletes(self, name='', country=None, age_group='', count_cache=None, limit=TEXT_COUNT_LIMIT):
+        """
+        Returns (count, exact). Filters without text search are counted exactly through the count cache,
+        text searches get a capped count.
+        """
+        where = self._get_where(country, age_group)
+        if name and name.strip():
+            return get_capped_count(self.scores_collection, self._get_query(name, where), limit=limit)
+        if count_cache:
+            return count_cache.get_count(self.scores_collection, self.scores_collection.name, where), True
+        return self.scores_collection.count_documents(where), True
+
+    def refresh_counts(self, count_cache):
+        wheres = [{}]
+        wheres.extend({'c': country} for country in self.scores_collection.distinct('c'))
+        wheres.extend({'a': age_group} for age_group in self.scores_collection.distinct('a'))
+        count_cache.refresh(self.scores_collection, self.scores_collection.name, wheres)
+
+    @staticmethod
+    def _get_where(country, age_group):
         where = {}
         if country:
             where['c'] = int(country)
 
         if age_group and age_group.strip():
             where['a'] = age_group.strip()
+        return where
 
+    @staticmethod
+    def _get_query(name, where):
         query = {}
         if name and name.strip():
             options = [name.strip()]
@@ -47,14 +99,7 @@ class AthleteStorage:
                 query = text_query
         else:
             query = where
-
-        logger.info(f'query: \'{query}\' sort: {sort}')
-        return self.scores_collection.find(
-            query,
-            sort=sort,
-            projection=projection,
-            batch_size=batch_size
-        ).skip(skip).limit(limit)
+        return query
 
     def get_athlete(self, athlete_id, projection={}):
         where = {'id': athlete_id}
@@ -76,28 +121,71 @@ class AthleteStorage:
             score_by_id[athlete_id] = score
         return score_by_id
 
+    def get_country_by_id(self, athlete_ids=[]):
+        return {athlete['id']: athlete['c'] for athlete in self.get_athletes(athlete_ids, projection={'id': 1, 'c': 1})}
+
+    def get_athletes_with_history(self, athlete_ids=[]):
+        athletes = list(self.get_athletes(athlete_ids, projection={'_id': 0}))
+        return self._add_history(athletes, read_all=len(athlete_ids) == 0)
+
+    def _add_history(self, athletes, read_all=False):
+        """
+        Sets the full history of every athlete from the races collection.
+        """
+        athlete_by_id = {athlete['id']: athlete for athlete in athletes}
+        for athlete in athletes:
+            athlete['h'] = []
+
+        where = {} if read_all else {'id': {'$in': list(athlete_by_id)}}
+        for race_summary in self.races_collection.find(where, projection={'_id': 0}, sort=[('id', ASCENDING), ('index', ASCENDING)]):
+            athlete_id = race_summary.pop('id')
+            if athlete_id in athlete_by_id:
+                athlete_by_id[athlete_id]['h'].append(race_summary)
+        return athletes
+
+    def get_athlete_history(self, athlete_id, sort_order=ASCENDING, skip=0, limit=0):
+        return self.races_collection.find(
+            {'id': athlete_id},
+            sort=[('index', sort_order)],
+            projection={'_id': 0, 'id': 0}
+        ).skip(skip).limit(limit)
+
+    def count_athlete_history(self, athlete_id):
+        return self.races_collection.count_documents({'id': athlete_id})
+
+    def get_race_summaries(self, race_name, race_date, athlete_ids=[]):
+        where = {'race': race_name, 'date': race_date}
+        if len(athlete_ids) > 0:
+            where['id'] = {'$in': athlete_ids}
+        return {
+            race_summary.pop('id'): race_summary for race_summary in self.races_collection.find(where, projection={'_id': 0})
+        }
+
     def get_scores_and_country(self, race_name, race_date, athlete_ids=[]):
+        race_summary_by_id = self.get_race_summaries(race_name, race_date, athlete_ids)
+
         score_by_id = {}
-        for athlete in self.get_athletes(athlete_ids, projection={'id': 1, 'c': 1, 's': 1, 'h': 1}):
+        for athlete in self.get_athletes(athlete_ids, projection={'id': 1, 'c': 1}):
             athlete_id = athlete['id']
 
-            found = False
-            for race in athlete['h']:
-                rn = race['race']
-                rd = race['date']
-                if rn == race_name and rd == race_date:
-                    score = {'ps': race['ps'],
-                             'ns': race['ns'], 'c': athlete['c']}
-                    score_by_id[athlete_id] = score
-                    found = True
-                    break
-            if not found:
+            if athlete_id in race_summary_by_id:
+                race = race_summary_by_id[athlete_id]
+                score_by_id[athlete_id] = {'ps': race['ps'], 'ns': race['ns'], 'c': athlete['c']}
+            else:
                 logger.warning(
                     f'score not found athlete_id: {athlete_id} race: {race_name} date: {race_date}')
                 score_by_id[athlete_id] = {'ps': 0, 'ns': 0}
 
         return score_by_id
 
+    def get_scores_and_race_counts(self, athlete_ids=[]):
+        score_by_id = {}
+        race_count_by_id = {}
+        for athlete in self.get_athletes(athlete_ids, projection={'id': 1, 's': 1, 'p': 1}):
+            score_by_id[athlete['id']] = athlete['s']
+            race_count_by_id[athlete['id']] = athlete['p']
+        return score_by_id, race_count_by_id
+
     def get_race_count_by_id(self, athlete_ids=[]):
         race_count_by_id = {}
         for athlete in self.get_athletes(athlete_ids, projection={'id': 1, 'p': 1}):
@@ -112,19 +200,66 @@ class AthleteStorage:
     def add_athlete(self, athlete):
         return self.scores_collection.insert_one(athlete)
 
-    def add_athlete_race(self, athlete_id, race_summary):
-        country_code = race_summary['c']
-        score = race_summary['ns']
-        age_group = race_summary['a']
-        race_count = race_summary['index']
+    def add_athletes(self, athletes):
+        return self.scores_collection.insert_many(athletes, ordered=True)
 
-        return self.scores_collection.update_one(
-            {'id': athlete_id},
-            {
-                '$set': {'c': country_code, 's': score, 'p': race_count, 'a': age_group},
-                '$push': {'h': race_summary}
-            }
-        )
+    def add_athlete_race(self, athlete_id, race_summary):
+        return self.add_athlete_races([(athlete_id, race_summary)])
+
+    def add_athlete_races(self, race_summaries):
+        if len(race_summaries) == 0:
+            return None
+
+        requests = []
+        for athlete_id, race_summary in race_summaries:
+            country_code = race_summary['c']
+            score = race_summary['ns']
+            age_group = race_summary['a']
+            race_count = race_summary['index']
+
+            requests.append(UpdateOne(
+                {'id': athlete_id},
+                {
+                    '$set': {'c': country_code, 's': score, 'p': race_count, 'a': age_group},
+                    '$push': {'h': {'$each': [race_summary], '$slice': -HISTORY_SIZE}}
+                }
+            ))
+
+        # upserts keyed by the unique (id, index): a race applied again after an interrupted run is overwritten
+        self.races_collection.bulk_write([
+            ReplaceOne(
+                {'id': athlete_id, 'index': race_summary['index']},
+                build_athlete_race(athlete_id, race_summary),
+                upsert=True)
+            for athlete_id, race_summary in race_summaries
+        ], ordered=False)
+        return self.scores_collection.bulk_write(requests, ordered=False)
+
+    def replace_athlete(self, athlete):
+        athlete_id = athlete['id']
+        history = athlete['h']
+
+        # upserts keyed by the unique (id, index): the races of the athlete are never missing or duplicated
+        requests = [
+            ReplaceOne(
+                {'id': athlete_id, 'index': race_summary['index']},
+                build_athlete_race(athlete_id, race_summary),
+                upsert=True)
+            for race_summary in history
+        ]
+        requests.append(DeleteMany({'id': athlete_id, 'index': {'$nin': [race_summary['index'] for race_summary in history]}}))
+        self.races_collection.bulk_write(requests, ordered=False)
+
+        athlete = dict(athlete, h=history[-HISTORY_SIZE:])
+        return self.scores_collection.replace_one({'id': athlete_id}, athlete, upsert=True)
+
+    def reset(self):
+        """
+        Drops the athletes and their races before a full replay.
+        """
+        self.scores_collection.drop()
+        self.races_collection.drop()
+        self._create_indices()
 
     def update_athlete_field(self, athlete_id, field, value):
         return self.scores_collection.update_one(
@@ -154,20 +289,144 @@ class AthleteStorage:
         self.scores_collection.create_index('a')
         self.scores_collection.create_index('p')
         self.scores_collection.create_index('s')
+        self.scores_collection.create_index([('s', DESCENDING), ('id', DESCENDING)])
+        self.scores_collection.create_index([('p', DESCENDING), ('id', DESCENDING)])
+        self.scores_collection.create_index([('c', ASCENDING), ('s', DESCENDING), ('id', DESCENDING)])
+        self.scores_collection.create_index([('a', ASCENDING), ('s', DESCENDING), ('id', DESCENDING)])
+
+        self.races_collection.create_index([('id', ASCENDING), ('index', ASCENDING)], unique=True)
+        self.races_collection.create_index([('race', ASCENDING), ('date', ASCENDING)])
         # self.scores_collection.create_index(
         #     [('p', DESCENDING), ('s', DESCENDING)])
         # self.scores_collection.create_index(
         #     [('c', DESCENDING), ('s', DESCENDING)])
 
 
+class ScoringStateStorage:
+    """
+    Keeps the scoring watermark (the last applied race) and the log of scored races next to the athletes collection.
+    """
+
+    WATERMARK_ID = 'watermark'
+
+    def __init__(self, mongo_client, db_name='triscore', collection_name='athletes', create_indices=False):
+        db = mongo_client[db_name]
+        self.athletes_collection = db[collection_name]
+        self.watermark_collection = db[collection_name + WATERMARK_SUFFIX]
+        self.scored_races_collection = db[collection_name + SCORED_RACES_SUFFIX]
+        if create_indices:
+            self._create_indices()
+
+    def get_watermark(self):
+        watermark = self.watermark_collection.find_one({'_id': self.WATERMARK_ID})
+        return (watermark['date'], watermark['name']) if watermark else None
+
+    def has_athletes(self):
+        return self.athletes_collection.find_one({}, projection={'_id': 1}) is not None
+
+    def get_scored_races(self):
+        return set(
+            (race['date'], race['name']) for race in self.scored_races_collection.find({}, projection={'_id': 0})
+        )
+
+    def add_scored_races(self, races):
+        if len(races) == 0:
+            return
+
+        for race_date, race_name in races:
+            self.scored_races_collection.update_one(
+                {'name': race_name, 'date': race_date},
+                {'$set': {'name': race_name, 'date': race_date}},
+                upsert=True)
+
+        watermark = max(races)
+        current_watermark = self.get_watermark()
+        if current_watermark is None or watermark > current_watermark:
+            race_date, race_name = watermark
+            self.watermark_collection.replace_one(
+                {'_id': self.WATERMARK_ID},
+                {'date': race_date, 'name': race_name},
+                upsert=True)
+
+    def add_scored_race(self, race_name, race_date):
+        self.add_scored_races([(race_date, race_name)])
+
+    def reset(self):
+        self.watermark_collection.delete_many({})
+        self.scored_races_collection.delete_many({})
+
+    def _create_indices(self):
+        self.scored_races_collection.create_index([('name', 1), ('date', 1)], unique=True)
+
+
+class RaceScoreStorage:
+    """
+    Per race snapshot of athlete scores keyed by (race, date, id), so race results can be joined with scores
+    without scanning athlete histories.
+    """
+
+    def __init__(self, mongo_client, db_name='triscore', collection_name='race_scores', create_indices=False):
+        self.db = mongo_client[db_name]
+        self.collection_name = collection_name
+        self.race_scores_collection = self.db[collection_name]
+        if create_indices:
+            self._create_indices()
+
+    def get_score_by_id(self, race_name, race_date, athlete_ids=[]):
+        where = {'race': race_name, 'date': race_date}
+        if len(athlete_ids) > 0:
+            where['id'] = {'$in': athlete_ids}
+
+        score_by_id = {}
+        for race_score in self.race_scores_collection.find(where, projection={'_id': 0, 'id': 1, 'ps': 1, 'ns': 1}):
+            score_by_id[race_score['id']] = {'ps': race_score['ps'], 'ns': race_score['ns']}
+        return score_by_id
+
+    def add_race_scores(self, race_summaries):
+        if len(race_summaries) == 0:
+            return None
+
+        requests = []
+        for athlete_id, race_summary in race_summaries:
+            race_score = build_race_score(athlete_id, race_summary)
+            requests.append(ReplaceOne(
+                {'race': race_score['race'], 'date': race_score['date'], 'id': athlete_id},
+                race_score,
+                upsert=True))
+        return self.race_scores_collection.bulk_write(requests, ordered=False)
+
+    def reset(self):
+        self.race_scores_collection.drop()
+        self._create_indices()
+
+    def rename(self, collection_name):
+        self.race_scores_collection.rename(collection_name, dropTarget=True)
+
+    def _create_indices(self):
+        self.race_scores_collection.create_index([('race', 1), ('date', 1), ('id', 1)], unique=True)
+
+
+def build_race_score(athlete_id, race_summary):
+    race_score = {
+        'race': race_summary['race'],
+        'date': race_summary['date'],
+        'id': athlete_id,
+    }
+    race_score.update({field: race_summary[field] for field in RACE_SCORE_FIELDS})
+    return race_score
+
+
 class MockAthleteStorage:
     def __init__(self):
         self.athlete_by_id = {}
 
-    def get_top_athletes(self, limit=0):
+    def get_top_athletes(self, sort_order=DESCENDING, limit=0, with_history=False):
         list_limit = limit if limit != 0 else NO_LIMIT
-        return sorted(
-            list(self.athlete_by_id.values()), key=lambda item: -item['s'])[0:list_limit]
+        athletes = sorted(
+            list(self.athlete_by_id.values()), key=lambda item: sort_order * item['s'])[0:list_limit]
+        if with_history:
+            return athletes
+        return [{k: v for k, v in athlete.items() if k != 'h'} for athlete in athletes]
 
     def get_athletes(self, athlete_ids):
         athletes = []
@@ -176,6 +435,20 @@ class MockAthleteStorage:
             athletes.append(self.athlete_by_id[athlete_id])
         return athletes
 
+    def get_athletes_with_history(self, athlete_ids=[]):
+        if len(athlete_ids) == 0:
+            return list(self.athlete_by_id.values())
+        return self.get_athletes(athlete_ids)
+
+    def get_race_summaries(self, race_name, race_date, athlete_ids=[]):
+        race_summary_by_id = {}
+        for athlete in self.get_athletes(athlete_ids):
+            for race_summary in athlete['h']:
+                if race_summary['race'] == race_name and race_summary['date'] == race_date:
+                    race_summary_by_id[athlete['id']] = race_summary
+                    break
+        return race_summary_by_id
+
     def get_score_by_id(self, athlete_ids):
         return {
             athlete_id: self.athlete_by_id[athlete_id]['s'] for athlete_id in athlete_ids
@@ -186,6 +459,10 @@ class MockAthleteStorage:
             athlete_id: self.athlete_by_id[athlete_id]['p'] for athlete_id in athlete_ids
         }
 
+    def get_scores_and_race_counts(self, athlete_ids):
+        athletes = [self.athlete_by_id[athlete_id] for athlete_id in athlete_ids if athlete_id in self.athlete_by_id]
+        return {athlete['id']: athlete['s'] for athlete in athletes}, {athlete['id']: athlete['p'] for athlete in athletes}
+
     def athlete_exists(self, athlete_id):
         return athlete_id in self.athlete_by_id
 
@@ -194,6 +471,10 @@ class MockAthleteStorage:
         assert athlete_id not in self.athlete_by_id, f'duplicated athlete_id: {athlete_id}'
         self.athlete_by_id[athlete_id] = athlete
 
+    def add_athletes(self, athletes):
+        for athlete in athletes:
+            self.add_athlete(athlete)
+
     def add_athlete_race(self, athlete_id, race_summary):
         assert athlete_id in self.athlete_by_id, f'athlete_id not found: {athlete_id}'
 
@@ -203,3 +484,174 @@ class MockAthleteStorage:
         # TODO: uncomment
         # self.athlete_by_id[athlete_id]['c'] = race_summary['c']
         self.athlete_by_id[athlete_id]['h'].append(race_summary)
+
+    def add_athlete_races(self, race_summaries):
+        for athlete_id, race_summary in race_summaries:
+            self.add_athlete_race(athlete_id, race_summary)
+
+
+def build_athlete_race(athlete_id, race_summary):
+    athlete_race = {'id': athlete_id}
+    athlete_race.update(race_summary)
+    return athlete_race
+
+
+class InMemoryAthleteStorage:
+    """
+    Keeps the whole athletes state in memory while races are scored and writes it to mongo once with flush().
+
+    The state is kept in columns indexed by the athlete position: scores and race counts are read for every
+    race, the other athlete fields are kept apart and race summaries are stored as value tuples sharing their
+    field names. Athlete documents are only built when they are read.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.scores = []
+        self.race_counts = []
+        self.profiles = []
+        self.histories = []
+        self.index_by_id = {}
+        self.summary_fields = {}
+
+    def load(self, athlete_storage):
+        for athlete in athlete_storage.get_athletes_with_history():
+            self.add_athlete(athlete)
+
+    def get_top_athletes(self, sort_order=DESCENDING, limit=0, with_history=False):
+        list_limit = limit if limit != 0 else NO_LIMIT
+        indices = sorted(range(len(self.ids)), key=lambda index: sort_order * self.scores[index])[0:list_limit]
+        return [self._get_athlete(index, with_history) for index in indices]
+
+    def get_athletes(self, athlete_ids):
+        return [self._get_athlete(self.index_by_id[athlete_id]) for athlete_id in athlete_ids if athlete_id in self.index_by_id]
+
+    def get_athletes_with_history(self, athlete_ids=[]):
+        if len(athlete_ids) == 0:
+            return [self._get_athlete(index) for index in range(len(self.ids))]
+        return self.get_athletes(athlete_ids)
+
+    def get_race_summaries(self, race_name, race_date, athlete_ids=[]):
+        race_summary_by_id = {}
+        for athlete_id in athlete_ids:
+            if athlete_id not in self.index_by_id:
+                continue
+            for packed_summary in self.histories[self.index_by_id[athlete_id]]:
+                race_summary = unpack_race_summary(packed_summary)
+                if race_summary['race'] == race_name and race_summary['date'] == race_date:
+                    race_summary_by_id[athlete_id] = race_summary
+                    break
+        return race_summary_by_id
+
+    def get_score_by_id(self, athlete_ids):
+        return {
+            athlete_id: self.scores[self.index_by_id[athlete_id]] for athlete_id in athlete_ids
+        }
+
+    def get_race_count_by_id(self, athlete_ids):
+        return {
+            athlete_id: self.race_counts[self.index_by_id[athlete_id]] for athlete_id in athlete_ids
+        }
+
+    def get_scores_and_race_counts(self, athlete_ids):
+        known_ids = [athlete_id for athlete_id in athlete_ids if athlete_id in self.index_by_id]
+        return self.get_score_by_id(known_ids), self.get_race_count_by_id(known_ids)
+
+    def athlete_exists(self, athlete_id):
+        return athlete_id in self.index_by_id
+
+    def add_athlete(self, athlete):
+        athlete_id = athlete['id']
+        assert athlete_id not in self.index_by_id, f'duplicated athlete_id: {athlete_id}'
+        self.index_by_id[athlete_id] = len(self.ids)
+        self.ids.append(athlete_id)
+        self.scores.append(None)
+        self.race_counts.append(None)
+        self.profiles.append(None)
+        self.histories.append(None)
+        self._set_athlete(self.index_by_id[athlete_id], athlete)
+
+    def add_athletes(self, athletes):
+        for athlete in athletes:
+            self.add_athlete(athlete)
+
+    def add_athlete_race(self, athlete_id, race_summary):
+        assert athlete_id in self.index_by_id, f'athlete_id not found: {athlete_id}'
+
+        index = self.index_by_id[athlete_id]
+        self.profiles[index]['c'] = race_summary['c']
+        self.profiles[index]['a'] = race_summary['a']
+        self.scores[index] = race_summary['ns']
+        self.race_counts[index] = race_summary['index']
+        self.histories[index].append(self._pack_race_summary(race_summary))
+
+    def add_athlete_races(self, race_summaries):
+        for athlete_id, race_summary in race_summaries:
+            self.add_athlete_race(athlete_id, race_summary)
+
+    def replace_athlete(self, athlete):
+        athlete_id = athlete['id']
+        if athlete_id not in self.index_by_id:
+            self.add_athlete(athlete)
+        else:
+            self._set_athlete(self.index_by_id[athlete_id], athlete)
+
+    def flush(self, mongo_client, db_name='triscore', collection_name='athletes', races_collection_name=ATHLETE_RACES_COLLECTION, batch_size=FLUSH_BATCH_SIZE):
+        """
+        Writes athletes and their histories to staging collections and renames them over the target ones,
+        so readers never see a partially written collection.
+
+        The two renames are not atomic: in between, readers see the new histories with the old athletes.
+        The caller bumps the data generation after flush() returns, so cached responses built in this window
+        are dropped once both collections are in place.
+        """
+        staging_storage = AthleteStorage(
+            mongo_client=mongo_client,
+            db_name=db_name,
+            collection_name=collection_name + STAGING_SUFFIX,
+            races_collection_name=races_collection_name + STAGING_SUFFIX)
+        staging_storage.scores_collection.drop()
+        staging_storage.races_collection.drop()
+
+        athlete_count = len(self.ids)
+        for start in range(0, athlete_count, batch_size):
+            batch = [self._get_athlete(index) for index in range(start, min(start + batch_size, athlete_count))]
+            staging_storage.scores_collection.insert_many(
+                [dict(athlete, h=athlete['h'][-HISTORY_SIZE:]) for athlete in batch], ordered=True)
+
+            athlete_races = [
+                build_athlete_race(athlete['id'], race_summary) for athlete in batch for race_summary in athlete['h']
+            ]
+            for races_start in range(0, len(athlete_races), batch_size):
+                staging_storage.races_collection.insert_many(
+                    athlete_races[races_start:races_start + batch_size], ordered=True)
+            logger.info(f'flushed {start + len(batch)}/{athlete_count} athletes')
+
+        staging_storage._create_indices()
+
+        logger.info(f'rename staging collections to {collection_name} and {races_collection_name}')
+        staging_storage.races_collection.rename(races_collection_name, dropTarget=True)
+        staging_storage.scores_collection.rename(collection_name, dropTarget=True)
+
+    def _get_athlete(self, index, with_history=True):
+        athlete = {'id': self.ids[index], 's': self.scores[index], 'p': self.race_counts[index]}
+        athlete.update(self.profiles[index])
+        if with_history:
+            athlete['h'] = [unpack_race_summary(packed_summary) for packed_summary in self.histories[index]]
+        return athlete
+
+    def _set_athlete(self, index, athlete):
+        self.scores[index] = athlete['s']
+        self.race_counts[index] = athlete['p']
+        self.profiles[index] = {k: v for k, v in athlete.items() if k not in ('id', 's', 'p', 'h')}
+        self.histories[index] = [self._pack_race_summary(race_summary) for race_summary in athlete['h']]
+
+    def _pack_race_summary(self, race_summary):
+        fields = tuple(race_summary)
+        fields = self.summary_fields.setdefault(fields, fields)
+        return fields, tuple(race_summary.values())
+
+
+def unpack_race_summary(packed_summary):
+    fields, values = packed_summary
+    return dict(zip(fields, values))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import numpy as np
+from pymongo import MongoClient
+
+from base import log
+import race.builder as race_builder
+import race.parser as race_parser
+from race.snapshot import SnapshotRaceStorage
+from race.storage import RaceStorage
+from score.elo_scorer import START_SCORE, FEMALE_AGE_GROUP_REGEX, MALE_AGE_GROUP_REGEX, RACE_TYPE_MULTIPLIERS, \
+    get_race_type_key
+import score.elo_numpy as elo_numpy
+
+
+logger = log.setup_logger(__file__, debug=False)
+
+# number of neighbour age groups added on each side of an age group
+DEFAULT_EXTENSION = 1
+DEFAULT_CONFIG = {
+    'name': 'default',
+    'start_score': START_SCORE,
+    'multipliers': dict(RACE_TYPE_MULTIPLIERS),
+    'extension': DEFAULT_EXTENSION,
+}
+INITIAL_CAPACITY = 1024
+
+
+def make_config(config):
+    full_config = dict(DEFAULT_CONFIG)
+    full_config.update(config)
+    full_config['multipliers'] = dict(DEFAULT_CONFIG['multipliers'], **config.get('multipliers', {}))
+    return full_config
+
+
+def load_configs(path):
+    with open(path) as f:
+        return [make_config(config) for config in json.load(f)]
+
+
+def get_extended_groups(sorted_age_groups, results_by_group, extension):
+    extended_groups = []
+    for i, age_group in enumerate(sorted_age_groups):
+        neighbour_groups = sorted_age_groups[max(0, i - extension):i + extension + 1]
+        extended_group_results = list(results_by_group[age_group])
+        for neighbour_group in neighbour_groups:
+            if neighbour_group != age_group:
+                extended_group_results.extend(results_by_group[neighbour_group])
+        extended_groups.append((age_group, sorted(extended_group_results, key=lambda r: r['t'])))
+    return extended_groups
+
+
+class SweepScorer:
+    """
+    Scores races for many rating configurations at once. Scores are kept in a (configurations, athletes) array
+    and every group is scored for all configurations sharing its extension rule with one vectorized pass,
+    the same math as the numpy engine of EloScorer.
+    """
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.start_scores = np.asarray([config['start_score'] for config in configs], dtype=np.float64)
+        self.multipliers = {
+            key: np.asarray([config['multipliers'][key] for config in configs], dtype=np.float64)
+            for key, _ in RACE_TYPE_MULTIPLIERS
+        }
+        self.rows_by_extension = {}
+        for row, config in enumerate(configs):
+            self.rows_by_extension.setdefault(config['extension'], []).append(row)
+
+        self.index_by_id = {}
+        self.scores = np.empty((len(configs), INITIAL_CAPACITY), dtype=np.float64)
+        self.race_counts = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.rank_errors = np.zeros(len(configs), dtype=np.float64)
+        self.rank_error_counts = np.zeros(len(configs), dtype=np.int64)
+
+    def get_athlete_index(self, athlete_id):
+        index = self.index_by_id.get(athlete_id)
+        if index is not None:
+            return index
+
+        index = len(self.index_by_id)
+        if index == self.scores.shape[1]:
+            self.scores = np.concatenate([self.scores, np.empty_like(self.scores)], axis=1)
+            self.race_counts = np.concatenate([self.race_counts, np.zeros_like(self.race_counts)])
+        self.scores[:, index] = self.start_scores
+        self.index_by_id[athlete_id] = index
+        return index
+
+    def add_race(self, race_info, race_results):
+        results_by_group = {}
+        for result in race_results:
+            age_group = race_parser.get_age_group(result)
+            if age_group is None:
+                continue
+            results_by_group.setdefault(age_group, []).append(result)
+            self.get_athlete_index(race_parser.get_athlete_id(result))
+
+        all_groups = results_by_group.keys()
+        female_age_groups = sorted([g for g in all_groups if FEMALE_AGE_GROUP_REGEX.match(g)])
+        male_age_groups = sorted([g for g in all_groups if MALE_AGE_GROUP_REGEX.match(g)])
+        not_age_groups = [g for g in all_groups if (g not in female_age_groups and g not in male_age_groups)]
+        multipliers = self.multipliers[get_race_type_key(race_parser.get_race_type(race_info))]
+
+        for extension, rows in self.rows_by_extension.items():
+            groups = get_extended_groups(female_age_groups, results_by_group, extension)
+            groups.extend(get_extended_groups(male_age_groups, results_by_group, extension))
+            groups.extend((group, results_by_group[group]) for group in not_age_groups)
+            for age_group, results in groups:
+                self.process_group(np.asarray(rows), age_group, results, multipliers[rows])
+
+        for results in results_by_group.values():
+            for result in results:
+                self.race_counts[self.index_by_id[race_parser.get_athlete_id(result)]] += 1
+
+    def process_group(self, rows, age_group, results, multipliers):
+        finished_indices = []
+        group_indices = []
+        extended_age_ranks = []
+        is_started = []
+        is_finished = []
+        for result in results:
+            if race_parser.get_finish_status(result) == race_builder.FINISH_STATUS_OK:
+                finished_indices.append(self.index_by_id[race_parser.get_athlete_id(result)])
+
+        for i, result in enumerate(results):
+            if race_parser.get_age_group(result) != age_group:
+                continue
+            finish_status = race_parser.get_finish_status(result)
+            group_indices.append(self.index_by_id[race_parser.get_athlete_id(result)])
+            is_finished.append(finish_status == race_builder.FINISH_STATUS_OK)
+            is_started.append(finish_status != race_builder.FINISH_STATUS_DNS)
+            extended_age_ranks.append((i + 1) if is_finished[-1] else (len(finished_indices) + 1))
+
+        finished_position_by_index = {index: position for position, index in enumerate(finished_indices)}
+        self_indices = [finished_position_by_index.get(index, -1) for index in group_indices]
+
+        group_scores = self.scores[np.ix_(rows, group_indices)]
+        finished_scores = self.scores[np.ix_(rows, finished_indices)]
+        extended_age_ranks = np.asarray(extended_age_ranks, dtype=np.float64)
+
+        seeds = elo_numpy.get_seeds(group_scores, finished_scores, self_indices)
+        mid_ranks = np.sqrt(extended_age_ranks * seeds)
+        need_scores = elo_numpy.get_scores_to_ranks(mid_ranks, finished_scores, self_indices, group_scores)
+        need_scores = np.where(is_started, need_scores, group_scores)
+        score_deltas = np.round((need_scores - group_scores) * multipliers[:, np.newaxis])
+
+        # seed rank error of finishers with a rating from previous races
+        rated = np.asarray(is_finished) & (self.race_counts[group_indices] > 0)
+        self.rank_errors[rows] += np.abs(seeds - extended_age_ranks)[:, rated].sum(axis=1)
+        self.rank_error_counts[rows] += int(rated.sum())
+
+        self.scores[np.ix_(rows, group_indices)] = group_scores + score_deltas
+
+    def get_metrics(self):
+        athlete_count = len(self.index_by_id)
+        rated = self.race_counts[:athlete_count] > 0
+        metrics = []
+        for row, config in enumerate(self.configs):
+            scores = self.scores[row, :athlete_count][rated]
+            rank_mae = self.rank_errors[row] / self.rank_error_counts[row] if self.rank_error_counts[row] else math.nan
+            metrics.append({
+                'name': config['name'],
+                'athletes': int(rated.sum()),
+                'rank_mae': float(rank_mae),
+                'mean': float(scores.mean()) if len(scores) else math.nan,
+                'std': float(scores.std()) if len(scores) else math.nan,
+                'p50': float(np.percentile(scores, 50)) if len(scores) else math.nan,
+                'p99': float(np.percentile(scores, 99)) if len(scores) else math.nan,
+                'max': float(scores.max()) if len(scores) else math.nan,
+            })
+        return metrics
+
+    def get_score_by_id(self, row=0):
+        return {athlete_id: self.scores[row, index] for athlete_id, index in self.index_by_id.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scores all races for many rating configurations in one pass')
+
+    parser.add_argument('-d', '--database', default='triscore')
+    parser.add_argument('-u', '--username', default='triscore-reader')
+    parser.add_argument('-p', '--password', default=None)
+    parser.add_argument('--snapshot', default=None, help='read races from a snapshot written by race/snapshot.py')
+    parser.add_argument('--configs', required=True, help='json list of configs: name, start_score, multipliers, extension')
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--output', default=None)
+
+    args = parser.parse_args()
+
+    if args.snapshot:
+        race_storage = SnapshotRaceStorage(args.snapshot)
+    elif args.password:
+        mongo_client = MongoClient(username=args.username, password=args.password, authSource=args.database)
+        race_storage = RaceStorage(mongo_client=mongo_client, db_name=args.database)
+    else:
+        parser.error('either --snapshot or --password is required')
+
+    configs = load_configs(args.configs)
+    sweep_scorer = SweepScorer(configs)
+    races = list(race_storage.get_races(limit=args.limit))
+    for i, race_info in enumerate(races):
+        race_name = race_parser.get_race_name(race_info)
+        race_date = race_parser.get_race_date(race_info)
+        logger.info(f'{i + 1}/{len(races)}: {race_date} {race_name}')
+        sweep_scorer.add_race(race_info, race_storage.get_race_results(race_name=race_name, race_date=race_date))
+
+    metrics = sweep_scorer.get_metrics()
+    for config_metrics in sorted(metrics, key=lambda m: m['rank_mae']):
+        logger.info(' '.join(f'{k}: {v:.2f}' if isinstance(v, float) else f'{k}: {v}' for k, v in config_metrics.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
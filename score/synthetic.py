@@ -0,0 +1,134 @@
+import datetime
+import random
+
+import race.builder as race_builder
+
+
+AGE_GROUP_STARTS = [18, 25, 30, 35, 40, 45, 50, 55, 60]
+RACE_TYPES = ['sprint', 'olympic', 'half', 'full']
+COUNTRIES = [643, 840, 826, 276, 250, 724]
+START_DATE = datetime.date(2020, 1, 1)
+# finish time in seconds of an athlete with zero skill in the full distance, shorter races are scaled down
+BASE_TIME_BY_TYPE = {'sprint': 4500, 'olympic': 9000, 'half': 18000, 'full': 39600}
+SKILL_TIME_FRACTION = 0.15
+NOISE_TIME_FRACTION = 0.05
+
+
+def get_age_group(gender, age):
+    for start in reversed(AGE_GROUP_STARTS):
+        if age >= start:
+            end = start + 4 if start != 18 else 24
+            return f'{gender}{start}-{end}'
+    return f'{gender}18-24'
+
+
+def make_athletes(rnd, count):
+    """
+    Athletes with a hidden skill in [-1, 1]: the higher the skill, the faster the athlete.
+    """
+    athletes = []
+    for i in range(count):
+        gender = rnd.choice(['M', 'M', 'F'])
+        athletes.append({
+            'id': f'athlete-{i}',
+            'n': f'Athlete {i}',
+            'g': gender,
+            'c': rnd.choice(COUNTRIES),
+            'a': get_age_group(gender, rnd.randint(18, 64)),
+            'skill': max(-1., min(1., rnd.gauss(0., 0.4))),
+        })
+    return athletes
+
+
+def make_race(rnd, index, athletes, race_type, dnf_rate=0.05, dns_rate=0.02):
+    base_time = BASE_TIME_BY_TYPE[race_type]
+    race_info = {
+        'name': f'Synthetic {race_type} {index}',
+        'date': (START_DATE + datetime.timedelta(days=index)).isoformat(),
+        'brand': 'synthetic',
+        'type': race_type,
+        'location': {'c': rnd.choice(COUNTRIES)},
+        'distance': {},
+    }
+
+    results = []
+    for athlete in athletes:
+        status = race_builder.FINISH_STATUS_OK
+        finish_time = race_builder.MAX_TIME
+        roll = rnd.random()
+        if roll < dns_rate:
+            status = race_builder.FINISH_STATUS_DNS
+        elif roll < dns_rate + dnf_rate:
+            status = race_builder.FINISH_STATUS_DNF
+        else:
+            noise = rnd.gauss(0., NOISE_TIME_FRACTION)
+            finish_time = int(base_time * (1. - SKILL_TIME_FRACTION * athlete['skill'] + noise))
+
+        results.append({
+            'id': athlete['id'], 'n': athlete['n'], 'c': athlete['c'], 'b': len(results) + 1, 'st': status,
+            't': finish_time, 'a': athlete['a'], 'g': athlete['g'], 'legs': {}
+        })
+
+    results.sort(key=lambda r: r['t'])
+    set_ranks(results)
+    return race_info, results
+
+
+def set_ranks(results):
+    size_by_key = {}
+    for result in results:
+        for key in [('a', result['a']), ('g', result['g'])]:
+            size_by_key[key] = size_by_key.get(key, 0) + 1
+
+    rank_by_key = {}
+    for overall_rank, result in enumerate(results, start=1):
+        finished = result['st'] == race_builder.FINISH_STATUS_OK
+        for field, key in [('ar', ('a', result['a'])), ('gr', ('g', result['g']))]:
+            rank_by_key[key] = rank_by_key.get(key, 0) + 1
+            result[field] = rank_by_key[key] if finished else 0
+        result['as'] = size_by_key[('a', result['a'])]
+        result['gs'] = size_by_key[('g', result['g'])]
+        result['tgr'] = 0
+        result['os'] = len(results)
+        result['or'] = overall_rank if finished else 0
+        result['tor'] = 0
+
+
+def make_season(seed=0, race_count=50, athlete_count=500, race_size=100):
+    """
+    Deterministic list of (race_info, results) in date order, races draw their participants from one athlete pool.
+    """
+    rnd = random.Random(seed)
+    athletes = make_athletes(rnd, athlete_count)
+    races = []
+    for index in range(race_count):
+        participants = rnd.sample(athletes, min(race_size, athlete_count))
+        races.append(make_race(rnd, index, participants, rnd.choice(RACE_TYPES)))
+    return races
+
+
+class SyntheticRaceStorage:
+    """
+    Race storage over generated races, the same interface as SnapshotRaceStorage.
+    """
+
+    def __init__(self, races):
+        self.races = races
+        self.index_by_key = {(race_info['date'], race_info['name']): i for i, (race_info, _) in enumerate(races)}
+
+    def get_races(self, skip=0, limit=0):
+        end = skip + limit if limit > 0 else len(self.races)
+        return [dict(race_info) for race_info, _ in self.races[skip:end]]
+
+    def get_race_info(self, race_name, race_date):
+        race_index = self.index_by_key.get((race_date, race_name))
+        return dict(self.races[race_index][0]) if race_index is not None else {}
+
+    def get_race_athlete_ids(self, race_name, race_date):
+        return list(set(result['id'] for result in self.get_race_results(race_name, race_date)))
+
+    def get_race_results(self, race_name, race_date):
+        race_index = self.index_by_key.get((race_date, race_name))
+        if race_index is None:
+            return []
+        return [dict(result) for result in self.races[race_index][1]]
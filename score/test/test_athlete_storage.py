@@ -0,0 +1,150 @@
+from pymongo import DeleteMany, ReplaceOne
+import race.builder as race_builder
+from score.elo_scorer import EloScorer, ENGINE_SCALAR
+from score.storage import AthleteStorage, InMemoryAthleteStorage, HISTORY_SIZE
+
+
+class FakeCursor(list):
+    def skip(self, skip):
+        return self
+
+    def limit(self, limit):
+        return self
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.requests = []
+
+    def find(self, where, projection=None, sort=None, batch_size=None):
+        ids = where.get('id', {}).get('$in')
+        docs = [dict(doc) for doc in self.docs if ids is None or doc['id'] in ids]
+        for field, value in (projection or {}).items():
+            if value == 0:
+                for doc in docs:
+                    doc.pop(field, None)
+        return FakeCursor(docs)
+
+    def bulk_write(self, requests, ordered=True):
+        self.requests.extend(requests)
+
+    def replace_one(self, where, doc, upsert=False):
+        self.requests.append(ReplaceOne(where, doc, upsert=upsert))
+
+    def insert_many(self, docs, ordered=True):
+        raise AssertionError('athlete races are upserted')
+
+    def delete_many(self, where):
+        raise AssertionError('athlete races are upserted')
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+class MemoryCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.docs = []
+
+    def find(self, where, projection=None, sort=None, batch_size=None):
+        ids = where.get('id', {}).get('$in')
+        docs = [dict(doc) for doc in self.docs if ids is None or doc['id'] in ids]
+        for field, order in reversed(sort or []):
+            docs.sort(key=lambda doc: doc[field], reverse=order < 0)
+        return FakeCursor(docs)
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(dict(doc) for doc in docs)
+
+    def create_index(self, keys, unique=False):
+        pass
+
+    def drop(self):
+        # like in mongo, the collection is created again by the next write through this handle
+        self.docs = []
+        self.db[self.name] = self
+
+    def rename(self, name, dropTarget=False):
+        assert dropTarget or name not in self.db
+        self.db[name] = self.db.pop(self.name)
+        self.name = name
+
+
+class MemoryDb(dict):
+    def __missing__(self, name):
+        self[name] = MemoryCollection(self, name)
+        return self[name]
+
+
+def make_result(athlete_id, finish_time):
+    return {
+        'id': athlete_id, 'n': athlete_id, 'c': 643, 'b': 1, 'st': race_builder.FINISH_STATUS_OK, 't': finish_time,
+        'a': 'M30-34', 'as': 0, 'ar': 0, 'g': 'M', 'gs': 0, 'gr': 0, 'tgr': 0, 'os': 0, 'or': 0, 'tor': 0, 'legs': {}
+    }
+
+
+def make_summary(index):
+    return {'race': f'R{index}', 'date': f'2020-01-{index:02}', 'index': index, 'ns': 1500 + index, 'a': 'M30-34', 'c': 643}
+
+
+class TestReplaceAthlete:
+    def test_upsert_races(self):
+        db = FakeDb()
+        athlete_storage = AthleteStorage({'triscore': db})
+        athlete_storage.replace_athlete({'id': 'a', 's': 1500, 'p': 2, 'h': [make_summary(1), make_summary(2)]})
+        races_requests = db['athlete_races'].requests
+        assert [request._filter for request in races_requests] == [
+            {'id': 'a', 'index': 1}, {'id': 'a', 'index': 2}, {'id': 'a', 'index': {'$nin': [1, 2]}}]
+        assert isinstance(races_requests[-1], DeleteMany)
+        assert all(request._upsert for request in races_requests[:2])
+
+
+class TestAddAthleteRaces:
+    def test_upsert_races(self):
+        db = FakeDb()
+        athlete_storage = AthleteStorage({'triscore': db})
+        athlete_storage.add_athlete_races([('a', make_summary(1)), ('b', make_summary(1))])
+        races_requests = db['athlete_races'].requests
+        assert [request._filter for request in races_requests] == [{'id': 'a', 'index': 1}, {'id': 'b', 'index': 1}]
+        assert all(isinstance(request, ReplaceOne) and request._upsert for request in races_requests)
+
+
+class TestGetTopAthletes:
+    def test_full_history(self):
+        db = FakeDb()
+        summaries = [make_summary(index) for index in range(1, HISTORY_SIZE + 3)]
+        db['athletes'].docs = [{'id': 'a', 's': 1600, 'h': summaries[-HISTORY_SIZE:]}]
+        db['athlete_races'].docs = [dict(summary, id='a') for summary in summaries]
+        athlete_storage = AthleteStorage({'triscore': db})
+        athletes = athlete_storage.get_top_athletes(with_history=True)
+        assert athletes == [{'id': 'a', 's': 1600, 'h': summaries}]
+        assert 'h' not in list(athlete_storage.get_top_athletes())[0]
+
+
+class TestFlush:
+    def test_round_trip(self):
+        db = MemoryDb()
+        mongo_client = {'triscore': db}
+        athlete_storage = InMemoryAthleteStorage()
+        athlete_storage.load(AthleteStorage(mongo_client))
+
+        elo_scorer = EloScorer(athlete_storage, engine=ENGINE_SCALAR)
+        for day in range(1, HISTORY_SIZE + 3):
+            athlete_ids = ['a', 'b', 'c'] if day % 2 else ['c', 'b', 'a']
+            race_info = {'name': 'R', 'date': f'2020-01-{day:02}', 'type': 'full', 'location': {'c': 643}}
+            elo_scorer.add_race(race_info, [make_result(athlete_id, 30000 + 100 * i) for i, athlete_id in enumerate(athlete_ids)])
+        athlete_storage.flush(mongo_client, batch_size=2)
+
+        assert sorted(db) == ['athlete_races', 'athletes']
+        assert all(len(athlete['h']) == HISTORY_SIZE for athlete in db['athletes'].docs)
+
+        loaded = InMemoryAthleteStorage()
+        loaded.load(AthleteStorage(mongo_client))
+        expected = athlete_storage.get_athletes_with_history()
+        assert len(expected[0]['h']) == HISTORY_SIZE + 2
+        assert loaded.get_athletes_with_history() == expected
@@ -0,0 +1,111 @@
+import copy
+import random
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+
+import race.builder as race_builder
+import score.elo_numpy as elo_numpy
+from score.elo_scorer import EloScorer, ENGINE_NUMPY, ENGINE_SCALAR
+from score.storage import MockAthleteStorage
+
+
+def make_result(athlete_id, age_group, finish_time, status=race_builder.FINISH_STATUS_OK):
+    return {
+        'id': athlete_id, 'n': athlete_id, 'c': 643, 'b': 1, 'st': status, 't': finish_time,
+        'a': age_group, 'as': 0, 'ar': 0, 'g': age_group[0], 'gs': 0, 'gr': 0, 'tgr': 0,
+        'os': 0, 'or': 0, 'tor': 0, 'legs': {}
+    }
+
+
+def make_race_results(seed, age_groups=['M30-34', 'M35-39', 'M40-44'], group_size=30):
+    rnd = random.Random(seed)
+    results = []
+    for age_group in age_groups:
+        for i in range(group_size):
+            athlete_id = f'{age_group}-{i}'
+            status = rnd.choice([race_builder.FINISH_STATUS_OK] * 8 + [race_builder.FINISH_STATUS_DNF, race_builder.FINISH_STATUS_DNS])
+            finish_time = rnd.randint(30000, 50000) if status == race_builder.FINISH_STATUS_OK else race_builder.MAX_TIME
+            results.append(make_result(athlete_id, age_group, finish_time, status))
+    return results
+
+
+RACE_INFO = {'name': 'IRONMAN Test', 'date': '2020-01-01', 'type': 'full', 'location': {'c': 643}}
+
+
+def score_races(engine, race_count=3, check_tolerance=None):
+    storage = MockAthleteStorage()
+    scorer = EloScorer(storage, engine=engine, check_tolerance=check_tolerance)
+    for i in range(race_count):
+        scorer.add_race(RACE_INFO, make_race_results(seed=i))
+    return storage.athlete_by_id
+
+
+class TestGetSeeds:
+    scorer = EloScorer(MockAthleteStorage())
+
+    def test_same_as_scalar(self):
+        rnd = random.Random(1)
+        score_by_id = {i: rnd.randint(1000, 2500) for i in range(50)}
+        finished_results = [{'id': i} for i in range(40)]
+        group_ids = list(range(30, 50))
+
+        seeds = elo_numpy.get_seeds(
+            [score_by_id[i] for i in group_ids],
+            [score_by_id[r['id']] for r in finished_results],
+            [i if i < 40 else -1 for i in group_ids])
+
+        for athlete_id, seed in zip(group_ids, seeds):
+            expected = self.scorer.get_seed(finished_results, score_by_id[athlete_id], athlete_id, score_by_id)
+            assert seed == pytest.approx(expected, abs=1e-9)
+
+    def test_duplicated_finisher(self):
+        finished_results = [make_result('a', 'M30-34', 30000), make_result('a', 'M30-34', 31000)]
+        with pytest.raises(AssertionError):
+            self.scorer.get_seeds_and_need_scores_numpy(finished_results, finished_results, [1, 2], {'a': 1500})
+
+    def test_score_to_rank_single_finisher(self):
+        r = elo_numpy.get_scores_to_ranks([1.], [1500.], [0], [1500.])
+        assert r.tolist() == [1500.]
+
+
+class TestEngines:
+    def test_numpy_matches_scalar(self):
+        scalar = score_races(ENGINE_SCALAR)
+        vectorized = score_races(ENGINE_NUMPY, check_tolerance=1e-6)
+
+        assert scalar.keys() == vectorized.keys()
+        for athlete_id, athlete in scalar.items():
+            for expected, race in zip(athlete['h'], vectorized[athlete_id]['h']):
+                assert race['esr'] == pytest.approx(expected['esr'], abs=1e-9)
+                assert race['da'] == expected['da']
+                assert race['ns'] == expected['ns']
+
+
+class TestParallelGroups:
+    def test_same_as_sequential(self):
+        age_groups = ['F25-29', 'F30-34', 'M30-34', 'M35-39', 'MPRO']
+        sequential = MockAthleteStorage()
+        parallel = MockAthleteStorage()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            sequential_scorer = EloScorer(sequential)
+            parallel_scorer = EloScorer(parallel, executor=executor, parallel_min_results=0)
+            for i in range(2):
+                # race results are stored ordered by finish time
+                race_results = sorted(make_race_results(seed=i, age_groups=age_groups, group_size=15), key=lambda r: r['t'])
+                sequential_scorer.add_race(RACE_INFO, copy.deepcopy(race_results))
+                parallel_scorer.add_race(RACE_INFO, copy.deepcopy(race_results))
+                assert parallel_scorer.race_summaries == sequential_scorer.race_summaries
+
+        assert parallel.athlete_by_id == sequential.athlete_by_id
+
+    def test_shared_athlete(self):
+        race_results = make_race_results(seed=0, age_groups=['M30-34', 'MPRO'], group_size=15)
+        # listed both as a pro and in an age group
+        race_results.append(make_result('M30-34-0', 'MPRO', 29000))
+        race_results = sorted(race_results, key=lambda r: r['t'])
+        sequential = MockAthleteStorage()
+        parallel = MockAthleteStorage()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            EloScorer(sequential).add_race(RACE_INFO, copy.deepcopy(race_results))
+            EloScorer(parallel, executor=executor, parallel_min_results=0).add_race(RACE_INFO, copy.deepcopy(race_results))
+        assert parallel.athlete_by_id == sequential.athlete_by_id
@@ -0,0 +1,20 @@
+import race.builder as race_builder
+from score.elo_scorer import EloScorer
+from score.storage import MockAthleteStorage
+
+
+def make_result(athlete_id, age_group, finish_time):
+    return {
+        'id': athlete_id, 'n': athlete_id, 'c': 643, 'b': 1, 'st': race_builder.FINISH_STATUS_OK, 't': finish_time,
+        'a': age_group, 'as': 0, 'ar': 0, 'g': age_group[0], 'gs': 0, 'gr': 0, 'tgr': 0,
+        'os': 0, 'or': 0, 'tor': 0, 'legs': {}
+    }
+
+
+class TestLoadRaceState:
+    def test_duplicated_athlete(self):
+        storage = MockAthleteStorage()
+        scorer = EloScorer(storage)
+        scorer.load_race_state([make_result('a', 'M30-34', 30000), make_result('a', 'M30-34', 31000)])
+        assert list(storage.athlete_by_id) == ['a']
+        assert scorer.score_by_id == {'a': storage.athlete_by_id['a']['s']}
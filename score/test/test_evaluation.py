@@ -0,0 +1,37 @@
+import pytest
+
+import score.evaluation as evaluation
+import score.synthetic as synthetic
+
+
+class TestGetPairStats:
+    def test_perfect_prediction(self):
+        concordant, discordant, score_ties, time_ties, log_loss_sum, pairs = \
+            evaluation.get_pair_stats([1700, 1600, 1500], [100, 200, 300])
+        assert (concordant, discordant, score_ties, time_ties, pairs) == (3, 0, 0, 0, 3)
+        assert log_loss_sum > 0
+
+    def test_ties(self):
+        concordant, discordant, score_ties, time_ties, _, pairs = \
+            evaluation.get_pair_stats([1500, 1500, 1600], [100, 100, 200])
+        assert (concordant, discordant, score_ties, time_ties, pairs) == (0, 2, 1, 1, 3)
+
+    def test_even_scores_log_loss(self):
+        _, _, _, _, log_loss_sum, _ = evaluation.get_pair_stats([1500, 1500], [100, 200])
+        assert log_loss_sum == pytest.approx(0.6931, abs=1e-4)
+
+
+class TestEvaluation:
+    def test_ratings_beat_random_order(self):
+        race_storage = synthetic.SyntheticRaceStorage(
+            synthetic.make_season(seed=1, race_count=30, athlete_count=200, race_size=60))
+        metrics = evaluation.Evaluation(race_storage).run()
+
+        quality = metrics['quality'][evaluation.ALL_RACE_TYPES]
+        assert quality['races'] > 0
+        assert quality['pairwise_accuracy'] > 0.6
+        assert quality['kendall_tau'] > 0.2
+        assert quality['log_loss'] < 0.6931
+        assert metrics['speed']['races'] == 30
+        assert evaluation.check_gates(metrics, min_pairwise_accuracy=0.6, max_log_loss=0.6931) == []
+        assert len(evaluation.check_gates(metrics, min_pairwise_accuracy=1.)) == 1
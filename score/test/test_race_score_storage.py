@@ -0,0 +1,61 @@
+from score.storage import RaceScoreStorage
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.indices = []
+
+    def find(self, where, projection=None):
+        docs = []
+        for doc in self.docs:
+            ids = where.get('id', {}).get('$in')
+            if (doc['race'], doc['date']) != (where['race'], where['date']) or (ids is not None and doc['id'] not in ids):
+                continue
+            docs.append({field: value for field, value in doc.items() if projection.get(field, 0) == 1})
+        return docs
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            assert request._upsert
+            self.docs = [doc for doc in self.docs if any(doc[field] != value for field, value in request._filter.items())]
+            self.docs.append(dict(request._doc))
+
+    def create_index(self, keys, unique=False):
+        self.indices.append((keys, unique))
+
+    def drop(self):
+        self.docs = []
+        self.indices = []
+
+
+def make_summary(race_name, athlete_score):
+    return {'race': race_name, 'date': '2020-01-01', 'index': 1, 'ps': athlete_score, 'ns': athlete_score + 10,
+            'da': 10, 'esr': 1, 'ear': 1, 'a': 'M30-34', 'c': 643}
+
+
+class TestRaceScoreStorage:
+    def setup_method(self):
+        self.collection = FakeCollection()
+        self.race_score_storage = RaceScoreStorage({'triscore': {'race_scores': self.collection}}, create_indices=True)
+
+    def test_unique_index(self):
+        assert self.collection.indices == [([('race', 1), ('date', 1), ('id', 1)], True)]
+
+    def test_upsert(self):
+        self.race_score_storage.add_race_scores([('a', make_summary('A', 1500)), ('b', make_summary('A', 1500))])
+        # a replayed race overwrites the rows of its athletes
+        self.race_score_storage.add_race_scores([('a', make_summary('A', 1600))])
+        assert len(self.collection.docs) == 2
+        assert self.race_score_storage.get_score_by_id('A', '2020-01-01') == {
+            'a': {'ps': 1600, 'ns': 1610}, 'b': {'ps': 1500, 'ns': 1510}}
+
+    def test_read_race_athletes(self):
+        self.race_score_storage.add_race_scores([
+            ('a', make_summary('A', 1500)), ('b', make_summary('A', 1400)), ('a', make_summary('B', 1700))])
+        assert self.race_score_storage.get_score_by_id('A', '2020-01-01', ['a']) == {'a': {'ps': 1500, 'ns': 1510}}
+        assert self.race_score_storage.get_score_by_id('C', '2020-01-01', ['a']) == {}
+
+    def test_no_athlete_country(self):
+        self.race_score_storage.add_race_scores([('a', make_summary('A', 1500))])
+        assert 'c' not in self.collection.docs[0]
@@ -0,0 +1,72 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import race.builder as race_builder
+import score.scheduler as scheduler
+from score.elo_scorer import EloScorer, ENGINE_SCALAR
+from score.storage import InMemoryAthleteStorage
+
+
+AGE_GROUPS = ['F30-34', 'M30-34', 'M35-39', 'MPRO']
+
+
+def make_race(seed, athlete_ids):
+    rnd = random.Random(seed)
+    results = []
+    for athlete_id in athlete_ids:
+        age_group = AGE_GROUPS[athlete_id % len(AGE_GROUPS)]
+        status = rnd.choice([race_builder.FINISH_STATUS_OK] * 8 + [race_builder.FINISH_STATUS_DNF])
+        finish_time = rnd.randint(30000, 50000) if status == race_builder.FINISH_STATUS_OK else race_builder.MAX_TIME
+        results.append({
+            'id': athlete_id, 'n': str(athlete_id), 'c': 643, 'b': 1, 'st': status, 't': finish_time,
+            'a': age_group, 'as': 0, 'ar': 0, 'g': age_group[0], 'gs': 0, 'gr': 0, 'tgr': 0,
+            'os': 0, 'or': 0, 'tor': 0, 'legs': {}
+        })
+    race_info = {'name': f'race-{seed}', 'date': f'2020-01-{seed + 1:02d}', 'type': 'half', 'location': {'c': 643}}
+    return race_info, sorted(results, key=lambda r: r['t'])
+
+
+class FakeRaceStorage:
+    def __init__(self, races):
+        self.results_by_name = {race_info['name']: results for race_info, results in races}
+
+    def get_race_athlete_ids(self, race_name, race_date):
+        return [result['id'] for result in self.results_by_name[race_name]]
+
+    def get_race_results(self, race_name, race_date):
+        return [dict(result) for result in self.results_by_name[race_name]]
+
+
+class TestGetRaceWaves:
+    def test_races_without_shared_athletes(self):
+        waves = scheduler.get_race_waves([[1, 2], [3, 4], [2, 5], [6], [5, 3]])
+        assert waves == [[0, 1, 3], [2], [4]]
+
+    def test_empty(self):
+        assert scheduler.get_race_waves([]) == []
+
+
+class TestRaceScheduler:
+    def test_same_as_sequential(self):
+        rnd = random.Random(7)
+        # three regions with separate athletes and a few travelling ones
+        races = [
+            make_race(seed, rnd.sample(range(100 * (seed % 3), 100 * (seed % 3 + 1)), 25) + ([1000] if seed % 4 == 0 else []))
+            for seed in range(12)
+        ]
+        race_infos = [race_info for race_info, _ in races]
+
+        sequential = InMemoryAthleteStorage()
+        elo_scorer = EloScorer(sequential)
+        race_storage = FakeRaceStorage(races)
+        for race_info in race_infos:
+            elo_scorer.add_race(race_info, race_storage.get_race_results(race_info['name'], race_info['date']))
+
+        parallel = InMemoryAthleteStorage()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            race_scheduler = scheduler.RaceScheduler(race_storage, parallel, executor, engine=ENGINE_SCALAR, max_pending_races=3)
+            race_scheduler.replay(race_infos)
+
+        expected = {athlete['id']: athlete for athlete in sequential.get_athletes_with_history()}
+        actual = {athlete['id']: athlete for athlete in parallel.get_athletes_with_history()}
+        assert actual == expected
@@ -0,0 +1,17 @@
+from score import scorer
+from types import SimpleNamespace
+
+
+def make_args(snapshot=None, dry_run=False, in_memory=False, skip=0, incremental=False):
+    return SimpleNamespace(snapshot=snapshot, dry_run=dry_run, in_memory=in_memory, skip=skip, incremental=incremental)
+
+
+class TestUsesMongo:
+    def test_snapshot_dry_run(self):
+        assert not scorer.uses_mongo(make_args(snapshot='/tmp/snapshot', dry_run=True))
+        assert not scorer.uses_mongo(make_args(snapshot='/tmp/snapshot', dry_run=True, in_memory=True))
+
+    def test_reads_or_writes_mongo(self):
+        assert scorer.uses_mongo(make_args(dry_run=True))
+        assert scorer.uses_mongo(make_args(snapshot='/tmp/snapshot'))
+        assert scorer.uses_mongo(make_args(snapshot='/tmp/snapshot', dry_run=True, in_memory=True, skip=10))
@@ -0,0 +1,43 @@
+import copy
+
+import score.sweep as sweep
+from score.elo_scorer import EloScorer, ENGINE_NUMPY
+from score.storage import MockAthleteStorage
+from score.test.test_elo_numpy import make_race_results, RACE_INFO
+
+
+AGE_GROUPS = ['F25-29', 'F30-34', 'M30-34', 'M35-39', 'M40-44', 'MPRO']
+
+
+def make_races(race_count=3):
+    return [
+        sorted(make_race_results(seed=i, age_groups=AGE_GROUPS, group_size=12), key=lambda r: r['t'])
+        for i in range(race_count)
+    ]
+
+
+class TestSweepScorer:
+    def test_default_config_same_as_numpy_engine(self):
+        storage = MockAthleteStorage()
+        elo_scorer = EloScorer(storage, engine=ENGINE_NUMPY)
+        sweep_scorer = sweep.SweepScorer([
+            sweep.make_config({}),
+            sweep.make_config({'name': 'low start', 'start_score': 1200}),
+            sweep.make_config({'name': 'no extension', 'extension': 0, 'multipliers': {'full': 0.5}}),
+        ])
+        for race_results in make_races():
+            elo_scorer.add_race(RACE_INFO, copy.deepcopy(race_results))
+            sweep_scorer.add_race(RACE_INFO, race_results)
+
+        expected = {athlete_id: athlete['s'] for athlete_id, athlete in storage.athlete_by_id.items()}
+        assert sweep_scorer.get_score_by_id(0) == expected
+        assert sweep_scorer.get_score_by_id(1) != expected
+
+    def test_metrics(self):
+        sweep_scorer = sweep.SweepScorer([sweep.make_config({}), sweep.make_config({'name': 'b', 'extension': 2})])
+        for race_results in make_races():
+            sweep_scorer.add_race(RACE_INFO, race_results)
+
+        metrics = sweep_scorer.get_metrics()
+        assert [m['name'] for m in metrics] == ['default', 'b']
+        assert all(m['rank_mae'] > 0 and m['athletes'] == len(AGE_GROUPS) * 12 for m in metrics)